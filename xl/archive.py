@@ -0,0 +1,204 @@
+'''
+Script: archive.py
+Author: G. Paxton
+Purpose: To write excel zip packages, deflating large parts on threads
+Revision: October 2026
+'''
+###############################################################################
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+
+from collections import deque
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT
+
+
+# Data
+'''
+Compression
+'''
+# name -> (zip method, deflate level)
+COMPRESSIONS = {
+    'stored': (ZIP_STORED, None),   # no compression, largest and fastest
+    'fast': (ZIP_DEFLATED, 1),
+    'default': (ZIP_DEFLATED, 6),   # what excel and openpyxl use
+    'max': (ZIP_DEFLATED, 9),       # smallest, for archiving
+}
+_PARALLEL_SIZE = 1 << 21    # parts this large are deflated on threads
+_PIECE = 1 << 22            # bytes each thread deflates at a time
+_WINDOW = 1 << 15           # deflate's look back, primed from the last piece
+# python versions whose zipfile _write_deflated was checked against
+_RAW_VERSIONS = ((3, 6), (3, 13))
+_RAW_WRITES = None          # set by _raw_writes on the first large part
+
+
+def _deflate(data, level, window, last):
+    '''Deflate one piece of a part as raw deflate data
+
+    Every piece but the last ends on a byte boundary without the final
+    block bit (a sync flush), so the pieces joined in order are one
+    deflate stream. window, the end of the piece before, lets matches
+    reach back across the join as they would in a single stream.
+    '''
+    if window:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9,
+                                      zlib.Z_DEFAULT_STRATEGY, window)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    flush = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(flush)
+
+
+def _pieces(chunks):
+    '''Yield (piece, the end of the piece before, last) of chunks'''
+    window = b''
+    chunk = next(chunks, None)
+    while chunk is not None:
+        following = next(chunks, None)
+        yield chunk, window, following is None
+        window = chunk[-_WINDOW:]
+        chunk = following
+
+
+def check_compression(compression):
+    '''Raise ValueError if compression isn't one of COMPRESSIONS'''
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression {0}, use one of {1}'.format(
+            compression, ', '.join(sorted(COMPRESSIONS))))
+
+
+class _Deflated:
+    '''Stands in for the compressor of a part written already deflated'''
+
+    def flush(self):
+        return b''
+
+
+def _raw_writes():
+    '''Return True if large parts can be written already deflated
+
+    _write_deflated sets private attributes of zipfile's _ZipWriteFile
+    (_compressor, _fileobj, _file_size, _crc and _compress_size), so
+    it is only used on the python versions it was checked against and
+    once a small part written that way reads back intact. Otherwise
+    every part goes through ZipFile.write and ZipFile.writestr.
+    '''
+    global _RAW_WRITES
+    if _RAW_WRITES is None:
+        _RAW_WRITES = False
+        low, high = _RAW_VERSIONS
+        if low <= sys.version_info[:2] <= high:
+            from io import BytesIO
+            data = b'<row r="1"><c r="A1"><v>1</v></c></row>' * 100
+            buffer = BytesIO()
+            try:
+                with XLArchive(buffer, threads=1) as package:
+                    package._write_deflated('probe', len(data),
+                                            iter([data[:1000],
+                                                  data[1000:]]))
+                with ZipFile(buffer) as package:
+                    _RAW_WRITES = package.read('probe') == data
+            except Exception:
+                pass
+    return _RAW_WRITES
+
+
+# CLASS
+class XLArchive(ZipFile):
+    '''Zip file for writing an excel package at a chosen compression
+
+    Parts of _PARALLEL_SIZE or more (the worksheets of a large book)
+    are cut into pieces deflated on a pool of threads, zlib releases
+    the GIL while it works, so a save isn't held to the speed of one
+    core. The smaller parts are compressed as they are written.
+    '''
+
+    def __init__(self, filename, compression='default', threads=None):
+        '''Open a new package to write
+
+        @param filename : file to write
+        @param compression : 'stored', 'fast', 'default' or 'max'
+        @param threads : threads deflating large parts (default one per
+                         core), 1 to deflate as the parts are written
+        '''
+        check_compression(compression)
+        method, self.level = COMPRESSIONS[compression]
+        ZipFile.__init__(self, filename, 'w', method, allowZip64=True)
+        self.compresslevel = self.level
+        self.threads = threads or multiprocessing.cpu_count()
+        self._pool = None
+
+
+    def write(self, filename, arcname=None, *args, **kwargs):
+        size = os.path.getsize(filename)
+        if args or kwargs or not self._parallel(size):
+            return ZipFile.write(self, filename, arcname, *args, **kwargs)
+        with open(filename, 'rb') as fh:
+            self._write_deflated(arcname or filename, size,
+                                 iter(lambda: fh.read(_PIECE), b''))
+
+
+    def writestr(self, zinfo_or_arcname, data, *args, **kwargs):
+        if (args or kwargs or isinstance(zinfo_or_arcname, ZipInfo) or
+                not self._parallel(len(data))):
+            return ZipFile.writestr(self, zinfo_or_arcname, data, *args,
+                                    **kwargs)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._write_deflated(zinfo_or_arcname, len(data),
+                             iter([data[i:i+_PIECE]
+                                   for i in range(0, len(data), _PIECE)]))
+
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        ZipFile.close(self)
+
+
+    def _parallel(self, size):
+        """Return True if a part of size bytes is deflated on threads"""
+        return (self.level is not None and self.threads > 1 and
+                size >= _PARALLEL_SIZE and _raw_writes())
+
+
+    def _write_deflated(self, name, size, chunks):
+        """Write a part deflating its pieces on the thread pool
+
+        The pieces are written in order as they finish, with at most two
+        per thread held at once.
+        """
+        if self._pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(self.threads)
+        zinfo = ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = size
+        crc = written = 0
+        pending = deque()
+        with self.open(zinfo, 'w', force_zip64=size > ZIP64_LIMIT) as dest:
+            dest._compressor = _Deflated()
+            for piece, window, last in _pieces(chunks):
+                crc = zlib.crc32(piece, crc)
+                pending.append(self._pool.submit(_deflate, piece, self.level,
+                                                 window, last))
+                while len(pending) > 2 * self.threads or (
+                        pending and pending[0].done()):
+                    data = pending.popleft().result()
+                    dest._fileobj.write(data)
+                    written += len(data)
+            while pending:
+                data = pending.popleft().result()
+                dest._fileobj.write(data)
+                written += len(data)
+            if not written:
+                data = _deflate(b'', self.level, b'', True)
+                dest._fileobj.write(data)
+                written += len(data)
+            dest._file_size = size
+            dest._crc = crc & 0xffffffff
+            dest._compress_size = written
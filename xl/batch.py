@@ -0,0 +1,139 @@
+'''
+Script: batch.py
+Author: G. Paxton
+Purpose: To run the same work over many excel files in parallel
+Revision: October 2026
+'''
+###############################################################################
+import os
+import time
+import traceback
+import multiprocessing
+
+from collections import namedtuple
+
+from xl.xlutils import XLUtil, NORMAL, READ, release_logger
+
+
+# Data
+'''
+Results
+'''
+XLResult = namedtuple('XLResult', ['path', 'value', 'error', 'seconds'])
+XLResult.__doc__ = '''Outcome of one batch job
+
+path : workbook the job ran against
+value : what the job function returned (None on error)
+error : formatted traceback if the job raised, else None
+seconds : wall time of the job, including load and save
+'''
+
+
+def _run_job(job):
+    '''Run one job in a worker process
+
+    @param job : (index, path, func, kwargs, mode, save, logFile)
+    @return (index, XLResult)
+    '''
+    index, path, func, kwargs, mode, save, logFile = job
+    start = time.time()
+    try:
+        xl = XLUtil(path, logFile=logFile, mode=mode, quiet=True)
+        value = func(xl, **kwargs)
+        if mode == READ:
+            xl.close_workbook()
+        elif save:
+            xl.save_workbook()
+        return index, XLResult(path, value, None, time.time() - start)
+    except Exception:
+        return index, XLResult(path, None, traceback.format_exc(),
+                               time.time() - start)
+    finally:
+        release_logger(logFile)
+
+
+# CLASS
+class XLBatch:
+    '''Run a function against an XLUtil for each workbook in a pool
+
+    Each job opens its own XLUtil in a worker process, calls the job
+    function with it and saves the workbook, so independent files are
+    built or transformed on every core at once. Errors are caught per
+    job and returned with the timings instead of stopping the batch.
+    '''
+
+    def __init__(self, jobs, workers=None, mode=NORMAL, save=True,
+                 logDir=None):
+        '''Set up a batch of jobs
+
+        @param jobs : iterable of (path, func) or (path, func, kwargs),
+                      func is called as func(xl, **kwargs) and must be
+                      a module level function so it can be pickled
+        @param workers : number of processes (default is one per core),
+                         1 runs every job in this process
+        @param mode : XLUtil mode every workbook is opened in
+        @param save : save each workbook after its job (not in READ mode)
+        @param logDir : directory for one "<index>.<file>.log" per job
+                        (index is the job's place in jobs, so books of
+                        the same name in other folders don't share a
+                        log), None to skip log files
+        '''
+        self.jobs = []
+        self.logFiles = []
+        for job in jobs:
+            path, func = job[0], job[1]
+            kwargs = job[2] if len(job) > 2 else {}
+            index = len(self.jobs)
+            logFile = None
+            if logDir is not None:
+                logFile = os.path.join(logDir, '{0}.{1}.log'.format(
+                    index, os.path.basename(path)))
+            self.logFiles.append(logFile)
+            self.jobs.append((index, path, func, kwargs, mode, save,
+                              logFile))
+        self.workers = workers or multiprocessing.cpu_count()
+        self.results = []
+        self.seconds = 0.0
+
+
+    def __iter__(self):
+        '''Run the jobs, yielding each XLResult as it finishes
+
+        '''
+        start = time.time()
+        self.results = [None] * len(self.jobs)
+        if self.workers == 1 or len(self.jobs) < 2:
+            for job in self.jobs:
+                index, result = _run_job(job)
+                self.results[index] = result
+                yield result
+        else:
+            workers = min(self.workers, len(self.jobs))
+            pool = multiprocessing.Pool(workers)
+            try:
+                for index, result in pool.imap_unordered(_run_job,
+                                                         self.jobs):
+                    self.results[index] = result
+                    yield result
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        self.seconds = time.time() - start
+
+
+    def run(self):
+        '''Run every job and return the XLResults in job order
+
+        '''
+        for result in self:
+            pass
+        return list(self.results)
+
+
+    def errors(self):
+        '''Return the results of the jobs that failed in the last run
+
+        '''
+        return [result for result in self.results
+                if result is not None and result.error]
@@ -0,0 +1,913 @@
+'''
+Script: formula.py
+Author: G. Paxton
+Purpose: To evaluate excel formulas and keep their values up to date
+Revision: October 2026
+'''
+###############################################################################
+from __future__ import division
+
+import datetime
+import math
+import re
+
+from itertools import chain
+
+from openpyxl.utils.cell import column_index_from_string
+from openpyxl.utils.datetime import to_excel
+
+
+# CLASS
+class FormulaError(str):
+    '''An excel error value such as #DIV/0!, equal to its text'''
+
+
+class _Fail(Exception):
+    '''Raised to end a formula with an error value'''
+
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+
+class _Range:
+    '''The values of a range given to a function, a list of rows'''
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+    def values(self):
+        for row in self.rows:
+            for value in row:
+                yield value
+
+
+# Data
+'''
+Errors
+'''
+DIV0 = FormulaError('#DIV/0!')
+NA = FormulaError('#N/A')
+NAME = FormulaError('#NAME?')
+NUM = FormulaError('#NUM!')
+REF = FormulaError('#REF!')
+VALUE = FormulaError('#VALUE!')
+
+try:
+    _STRINGS = (str, unicode)
+    _NUMBERS = (int, long, float)
+except NameError:
+    _STRINGS = (str,)
+    _NUMBERS = (int, float)
+
+_DATES = (datetime.datetime, datetime.date, datetime.time,
+          datetime.timedelta)
+
+try:
+    _RecursionError = RecursionError
+except NameError:       # python 2
+    _RecursionError = RuntimeError
+
+'''
+Parsing
+'''
+_SHEET = r"(?:(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?"
+_TOKENS = re.compile(r'''\s*(?:
+    (?P<string>"(?:[^"]|"")*")
+  | (?P<func>[A-Za-z_][\w.]*)\s*\(
+  | (?P<range>{0}\$?[A-Za-z]{{1,3}}\$?[0-9]+:\$?[A-Za-z]{{1,3}}\$?[0-9]+)
+  | (?P<ref>{0}\$?[A-Za-z]{{1,3}}\$?[0-9]+)
+  | (?P<columns>{0}\$?[A-Za-z]{{1,3}}:\$?[A-Za-z]{{1,3}})
+  | (?P<number>(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)
+  | (?P<bool>TRUE|FALSE)\b
+  | (?P<error>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))
+  | (?P<op><>|<=|>=|[-+*/^&=<>%(),])
+  | (?P<name>[A-Za-z_][\w.]*)
+)'''.format(_SHEET), re.X | re.I)
+
+# binary operator -> binding power, all are left associative
+_BINARY = {'=': 1, '<>': 1, '<': 1, '>': 1, '<=': 1, '>=': 1,
+           '&': 2, '+': 3, '-': 3, '*': 4, '/': 4, '^': 5}
+_CELL = re.compile(r'\$?([A-Za-z]{1,3})\$?([0-9]+)$')
+
+'''
+Dependencies
+'''
+_TILE = 32          # rows and columns of a tile of the range index
+_LARGE = 256        # ranges covering more tiles are listed apart
+
+
+def is_formula(value):
+    '''Return True if a cell value is a formula ("=...")'''
+    return isinstance(value, _STRINGS) and len(value) > 1 and value[0] == '='
+
+
+def _tokens(text):
+    '''Yield (kind, text) for each token of a formula (without the "=")'''
+    text = text.strip()
+    pos = 0
+    while pos < len(text):
+        match = _TOKENS.match(text, pos)
+        if match is None:
+            raise _Fail(NAME)
+        pos = match.end()
+        yield match.lastgroup, match.group(match.lastgroup)
+    yield 'end', None
+
+
+def _split_sheet(text, sheet):
+    '''Return (sheet key, rest) of "Sheet!A1", sheet if not given'''
+    if '!' not in text:
+        return sheet, text
+    name, text = text.rsplit('!', 1)
+    if name.startswith("'"):
+        name = name[1:-1].replace("''", "'")
+    return name.lower(), text
+
+
+def _cell(text):
+    '''Return (column, row) of "A1" or "$A$1"'''
+    match = _CELL.match(text)
+    return (column_index_from_string(match.group(1).upper()),
+            int(match.group(2)))
+
+
+class _Parser:
+    '''Parses a formula into nested tuples
+
+    ('value', v)  ('ref', sheet, col, row)  ('name', text)
+    ('range', sheet, col1, row1, col2, row2), row2 None for "A:B"
+    ('op', symbol, left, right)  ('neg', x)  ('pct', x)
+    ('call', NAME, [args])
+    '''
+
+    def __init__(self, text, sheet):
+        self.tokens = list(_tokens(text))
+        self.pos = 0
+        self.sheet = sheet
+
+
+    def parse(self):
+        tree = self.expression()
+        if self.peek()[0] != 'end':
+            raise _Fail(NAME)
+        return tree
+
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+
+    def take(self):
+        token = self.tokens[self.pos]
+        if token[0] != 'end':
+            self.pos += 1
+        return token
+
+
+    def expect(self, op):
+        if self.take() != ('op', op):
+            raise _Fail(NAME)
+
+
+    def expression(self, power=0):
+        left = self.unary()
+        while True:
+            kind, text = self.peek()
+            if kind != 'op':
+                break
+            if text == '%':
+                self.take()
+                left = ('pct', left)
+                continue
+            bind = _BINARY.get(text)
+            if bind is None or bind <= power:
+                break
+            self.take()
+            left = ('op', text, left, self.expression(bind))
+        return left
+
+
+    def unary(self):
+        kind, text = self.take()
+        if kind == 'op' and text in ('-', '+'):
+            operand = self.unary()
+            return ('neg', operand) if text == '-' else operand
+        if kind == 'op' and text == '(':
+            tree = self.expression()
+            self.expect(')')
+            return tree
+        if kind == 'number':
+            if '.' in text or 'e' in text.lower():
+                return ('value', float(text))
+            return ('value', int(text))
+        if kind == 'string':
+            return ('value', text[1:-1].replace('""', '"'))
+        if kind == 'bool':
+            return ('value', text.upper() == 'TRUE')
+        if kind == 'error':
+            return ('value', FormulaError(text.upper()))
+        if kind == 'ref':
+            sheet, text = _split_sheet(text, self.sheet)
+            return ('ref', sheet) + _cell(text)
+        if kind == 'range':
+            sheet, text = _split_sheet(text, self.sheet)
+            first, last = text.split(':')
+            (col1, row1), (col2, row2) = _cell(first), _cell(last)
+            return ('range', sheet, min(col1, col2), min(row1, row2),
+                    max(col1, col2), max(row1, row2))
+        if kind == 'columns':
+            sheet, text = _split_sheet(text, self.sheet)
+            first, last = [column_index_from_string(part.strip('$').upper())
+                           for part in text.split(':')]
+            return ('range', sheet, min(first, last), 1, max(first, last),
+                    None)
+        if kind == 'func':
+            return ('call', text.upper(), self.arguments())
+        if kind == 'name':
+            return ('name', text)
+        raise _Fail(NAME)
+
+
+    def arguments(self):
+        args = []
+        if self.peek() == ('op', ')'):
+            self.take()
+            return args
+        while True:
+            if self.peek() in (('op', ','), ('op', ')')):
+                args.append(('value', None))
+            else:
+                args.append(self.expression())
+            kind, text = self.take()
+            if (kind, text) == ('op', ')'):
+                return args
+            if (kind, text) != ('op', ','):
+                raise _Fail(NAME)
+
+
+def parse(formula, sheet):
+    '''Parse a formula ("=SUM(A1:A3)") of a sheet into nested tuples
+
+    Raises FormulaError's #NAME? (as _Fail) if it can't be parsed.
+    '''
+    return _Parser(formula[1:], sheet.lower()).parse()
+
+
+# VALUES
+def _number(value):
+    '''Return a value as a number, as arithmetic sees it'''
+    if value is None:
+        return 0
+    if value.__class__ is bool:
+        return int(value)
+    if isinstance(value, _NUMBERS):
+        return value
+    if isinstance(value, FormulaError):
+        raise _Fail(value)
+    if isinstance(value, _STRINGS):
+        try:
+            return float(value)
+        except ValueError:
+            raise _Fail(VALUE)
+    if isinstance(value, _DATES):
+        return to_excel(value)
+    raise _Fail(VALUE)
+
+
+def _range_number(value):
+    '''Return a value in a range as a number, None if it isn't one'''
+    if isinstance(value, FormulaError):
+        raise _Fail(value)
+    if value.__class__ is bool or value is None:
+        return None
+    if isinstance(value, _NUMBERS):
+        return value
+    if isinstance(value, _DATES):
+        return to_excel(value)
+    return None
+
+
+def _text(value):
+    '''Return a value as text, as & and CONCATENATE see it'''
+    if value is None:
+        return ''
+    if value.__class__ is bool:
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, FormulaError):
+        raise _Fail(value)
+    if isinstance(value, float):
+        return '{0:.15g}'.format(value)
+    if isinstance(value, _STRINGS):
+        return value
+    return str(value)
+
+
+def _logical(value):
+    '''Return a value as a bool, as IF and AND see it'''
+    if value is None:
+        return False
+    if isinstance(value, _STRINGS):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        raise _Fail(VALUE)
+    return bool(_number(value))
+
+
+def _rank(value):
+    '''Excel orders numbers before text before bools'''
+    if value.__class__ is bool:
+        return 2
+    if isinstance(value, _STRINGS):
+        return 1
+    return 0
+
+
+def _blank(other):
+    '''Return what an empty cell is when compared with a value'''
+    if isinstance(other, _STRINGS):
+        return ''
+    if other.__class__ is bool:
+        return False
+    return 0
+
+
+def _compare(a, b):
+    '''Return -1, 0 or 1 comparing two values as excel does'''
+    if a is None:
+        a = _blank(b)
+    if b is None:
+        b = _blank(a)
+    ra, rb = _rank(a), _rank(b)
+    if ra != rb:
+        return -1 if ra < rb else 1
+    if ra == 1:
+        a, b = a.lower(), b.lower()
+    elif ra == 0:
+        a, b = _number(a), _number(b)
+    return (a > b) - (a < b)
+
+
+def _divide(a, b):
+    b = _number(b)
+    if b == 0:
+        raise _Fail(DIV0)
+    return _number(a) / b
+
+
+def _power(a, b):
+    try:
+        result = _number(a) ** _number(b)
+    except (ZeroDivisionError, ValueError, OverflowError):
+        raise _Fail(NUM)
+    if isinstance(result, complex):
+        raise _Fail(NUM)
+    return result
+
+
+_OPERATORS = {
+    '+': lambda a, b: _number(a) + _number(b),
+    '-': lambda a, b: _number(a) - _number(b),
+    '*': lambda a, b: _number(a) * _number(b),
+    '/': _divide,
+    '^': _power,
+    '&': lambda a, b: _text(a) + _text(b),
+    '=': lambda a, b: _compare(a, b) == 0,
+    '<>': lambda a, b: _compare(a, b) != 0,
+    '<': lambda a, b: _compare(a, b) < 0,
+    '>': lambda a, b: _compare(a, b) > 0,
+    '<=': lambda a, b: _compare(a, b) <= 0,
+    '>=': lambda a, b: _compare(a, b) >= 0,
+}
+
+
+# FUNCTIONS
+#
+# Each gets its evaluated arguments, a _Range for a range argument.
+# IF and IFERROR only evaluate the arguments they need, so they are
+# handled by the Calculator.
+def _scalar(value):
+    '''Return a single value, a one cell range gives its value'''
+    if isinstance(value, _Range):
+        if len(value.rows) == 1 and len(value.rows[0]) == 1:
+            value = value.rows[0][0]
+        else:
+            raise _Fail(VALUE)
+    if isinstance(value, FormulaError):
+        raise _Fail(value)
+    return value
+
+
+def _numbers(args):
+    '''Return the numbers of the arguments of SUM, AVERAGE...
+
+    Values in ranges that aren't numbers are skipped, arguments given
+    directly are converted (so "1" is 1 but "x" is #VALUE!).
+    '''
+    numbers = []
+    for arg in args:
+        if isinstance(arg, _Range):
+            for value in arg.values():
+                number = _range_number(value)
+                if number is not None:
+                    numbers.append(number)
+        elif arg is not None:
+            numbers.append(_number(arg))
+    return numbers
+
+
+def _average(*args):
+    numbers = _numbers(args)
+    if not numbers:
+        raise _Fail(DIV0)
+    return sum(numbers) / len(numbers)
+
+
+def _count(*args):
+    count = 0
+    for arg in args:
+        if isinstance(arg, _Range):
+            count += sum(1 for value in arg.values()
+                         if _range_number(value) is not None)
+        elif isinstance(arg, _NUMBERS) or isinstance(arg, _DATES):
+            count += 1
+    return count
+
+
+def _counta(*args):
+    count = 0
+    for arg in args:
+        if isinstance(arg, _Range):
+            count += sum(1 for value in arg.values() if value is not None)
+        elif arg is not None:
+            count += 1
+    return count
+
+
+def _logicals(args):
+    values = []
+    for arg in args:
+        if isinstance(arg, _Range):
+            for value in arg.values():
+                if isinstance(value, FormulaError):
+                    raise _Fail(value)
+                if value.__class__ is bool or isinstance(value, _NUMBERS):
+                    values.append(bool(value))
+        else:
+            values.append(_logical(arg))
+    if not values:
+        raise _Fail(VALUE)
+    return values
+
+
+def _round(value, digits=0):
+    value = _number(_scalar(value))
+    scale = 10 ** int(_number(_scalar(digits)))
+    rounded = math.floor(abs(value) * scale + 0.5) / scale
+    return -rounded if value < 0 else rounded
+
+
+def _vlookup(lookup, table, column, approximate=True):
+    lookup = _scalar(lookup)
+    if not isinstance(table, _Range):
+        raise _Fail(VALUE)
+    column = int(_number(_scalar(column)))
+    if column < 1:
+        raise _Fail(VALUE)
+    if column > len(table.rows[0]):
+        raise _Fail(REF)
+    if approximate is not None and not _logical(_scalar(approximate)):
+        for row in table.rows:
+            if row[0] is not None and _compare(row[0], lookup) == 0:
+                return row[column-1]
+        raise _Fail(NA)
+    # approximate match, the first column is sorted ascending
+    found = None
+    for row in table.rows:
+        first = row[0]
+        if first is None or isinstance(first, FormulaError):
+            continue
+        if _rank(first) != _rank(lookup):
+            continue
+        if _compare(first, lookup) > 0:
+            break
+        found = row
+    if found is None:
+        raise _Fail(NA)
+    return found[column-1]
+
+
+def _criteria(criteria):
+    '''Return a test of a value for the criteria of SUMIF and COUNTIF'''
+    criteria = _scalar(criteria)
+    op, operand = '=', criteria
+    if isinstance(criteria, _STRINGS):
+        match = re.match(r'(<=|>=|<>|=|<|>)?(.*)$', criteria, re.S)
+        op, operand = match.group(1) or '=', match.group(2)
+        try:
+            operand = float(operand)
+        except ValueError:
+            pass
+    if isinstance(operand, _STRINGS) and op in ('=', '<>'):
+        pattern = re.compile(re.escape(operand).replace(r'\*', '.*')
+                             .replace(r'\?', '.') + '$', re.I | re.S)
+        if operand == '':
+            match = lambda value: value is None or value == ''
+        else:
+            match = lambda value: (isinstance(value, _STRINGS) and
+                                   pattern.match(value) is not None)
+        return match if op == '=' else (lambda value: not match(value))
+    compare = _OPERATORS[op]
+
+    def test(value):
+        if value is None or isinstance(value, FormulaError):
+            return False
+        if _rank(value) != _rank(operand):
+            return op == '<>'
+        return compare(value, operand)
+
+    return test
+
+
+def _cells(values):
+    if isinstance(values, _Range):
+        return list(values.values())
+    return [_scalar(values)]
+
+
+def _sumif(values, criteria, sums=None):
+    test = _criteria(criteria)
+    cells = _cells(values)
+    totals = cells if sums is None else _cells(sums)
+    total = 0
+    for value, number in zip(cells, totals):
+        if test(value):
+            number = _range_number(number)
+            if number is not None:
+                total += number
+    return total
+
+
+def _countif(values, criteria):
+    test = _criteria(criteria)
+    return sum(1 for value in _cells(values) if test(value))
+
+
+_FUNCTIONS = {
+    'SUM': lambda *args: sum(_numbers(args)),
+    'AVERAGE': _average,
+    'MIN': lambda *args: min(_numbers(args) or [0]),
+    'MAX': lambda *args: max(_numbers(args) or [0]),
+    'COUNT': _count,
+    'COUNTA': _counta,
+    'AND': lambda *args: all(_logicals(args)),
+    'OR': lambda *args: any(_logicals(args)),
+    'NOT': lambda value: not _logical(_scalar(value)),
+    'ROUND': _round,
+    'ABS': lambda value: abs(_number(_scalar(value))),
+    'VLOOKUP': _vlookup,
+    'SUMIF': _sumif,
+    'COUNTIF': _countif,
+    'CONCATENATE': lambda *args: ''.join(_text(_scalar(arg))
+                                         for arg in args),
+    'LEN': lambda value: len(_text(_scalar(value))),
+    'UPPER': lambda value: _text(_scalar(value)).upper(),
+    'LOWER': lambda value: _text(_scalar(value)).lower(),
+}
+
+
+# CLASS
+class _RangeIndex:
+    '''Index of the ranges the formulas refer to on one sheet, by tile
+
+    As the merged range index of xlutils: the sheet is divided into
+    _TILE x _TILE tiles and each range is listed under every tile it
+    covers, so a written span only looks at the ranges near it. Whole
+    column ranges (A:A) are listed under (column tile, None), ranges
+    covering more than _LARGE tiles under None.
+    '''
+
+    def __init__(self):
+        self.tiles = {}     # tile -> {formula cell: [its ranges there]}
+
+
+    def _tiles(self, col1, row1, col2, row2):
+        """Return the tiles a range is listed under"""
+        columns = range((col1 - 1) // _TILE, (col2 - 1) // _TILE + 1)
+        if row2 is None:
+            if len(columns) > _LARGE:
+                return [None]
+            return [(column, None) for column in columns]
+        rows = range((row1 - 1) // _TILE, (row2 - 1) // _TILE + 1)
+        if len(columns) * len(rows) > _LARGE:
+            return [None]
+        return [(column, row) for row in rows for column in columns]
+
+
+    def add(self, key, span):
+        tiles = self.tiles
+        for tile in self._tiles(*span):
+            tiles.setdefault(tile, {}).setdefault(key, []).append(span)
+
+
+    def remove(self, key, span):
+        tiles = self.tiles
+        for tile in self._tiles(*span):
+            listed = tiles.get(tile)
+            if listed is not None and listed.pop(key, None) is not None:
+                if not listed:
+                    del tiles[tile]
+
+
+    def overlapping(self, col1, row1, col2, row2):
+        """Return the formula cells with a range overlapping a span"""
+        first, last = (col1 - 1) // _TILE, (col2 - 1) // _TILE
+        top, bottom = (row1 - 1) // _TILE, (row2 - 1) // _TILE
+        tiles = self.tiles
+        if (last - first + 1) * (bottom - top + 2) > len(tiles):
+            # a span over more tiles than are listed, go through the list
+            candidates = [listed for tile, listed in tiles.items()
+                          if tile is None or (first <= tile[0] <= last and (
+                              tile[1] is None or top <= tile[1] <= bottom))]
+        else:
+            columns = range(first, last + 1)
+            candidates = [tiles[tile] for tile in chain(
+                ((column, row) for row in range(top, bottom + 1)
+                 for column in columns),
+                ((column, None) for column in columns), [None])
+                          if tile in tiles]
+        found = set()
+        for listed in candidates:
+            for key, spans in listed.items():
+                if key in found:
+                    continue
+                for c1, r1, c2, r2 in spans:
+                    if (c1 <= col2 and col1 <= c2 and r1 <= row2 and
+                            (r2 is None or row1 <= r2)):
+                        found.add(key)
+                        break
+        return found
+
+
+class Calculator:
+    '''Evaluates the formulas of a workbook, caching their values
+
+    Cells are keyed (sheet, column, row) with the sheet title in lower
+    case, as excel's sheet names are. Evaluating a formula records the
+    cells and ranges it refers to, so when cells are written only the
+    formulas downstream of them lose their cached value.
+    '''
+
+    def __init__(self, cell, block, formulas):
+        '''
+        @param cell : function(sheet, column, row) giving a cell's value
+        @param block : function(sheet, col1, row1, col2, row2) giving
+                       the rows of values of a span, row2 None for every
+                       used row, raising KeyError for unknown sheets
+        @param formulas : function giving the (sheet, column, row) of
+                          every formula in the workbook
+        '''
+        self._get = cell
+        self._block = block
+        self._formulas = formulas
+        self.values = {}        # formula cell -> its value
+        self.parsed = {}        # formula cell -> (formula, tree)
+        self.cells = set()      # formula cells known of
+        self.scanned = False
+        self.dependents = {}    # cell -> formula cells referring to it
+        self.ranges = {}        # sheet -> _RangeIndex of its ranges
+        self.precedents = {}    # formula cell -> (cells, ranges)
+        self._active = set()    # formulas being evaluated
+        self._used = []         # (cells, ranges) of the formulas evaluated
+
+
+    def value(self, sheet, column, row):
+        '''Return the value of a cell, evaluating it if a formula
+
+        Circular references give #REF!.
+        '''
+        key = (sheet.lower(), column, row)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        try:
+            return self._value(key)
+        except _RecursionError:
+            # a long chain of formulas, evaluate them from the far end
+            self._active.clear()
+            del self._used[:]
+            self.recalculate()
+            return self._value(key)
+
+
+    def recalculate(self):
+        '''Evaluate every formula without a cached value
+
+        @return count : number of formulas evaluated
+        '''
+        if not self.scanned:
+            self.cells.update((sheet.lower(), column, row)
+                              for sheet, column, row in self._formulas())
+            self.scanned = True
+        count = len(self.values)
+        todo = sorted(key for key in self.cells if key not in self.values)
+        while todo:
+            deep = []
+            for key in todo:
+                if key in self.values:
+                    continue
+                try:
+                    self._value(key)
+                except _RecursionError:
+                    self._active.clear()
+                    del self._used[:]
+                    deep.append(key)
+            if len(deep) == len(todo):
+                raise _RecursionError('formula references nested too deep')
+            todo = deep[::-1]
+        return len(self.values) - count
+
+
+    def written(self, sheet, column, row, rows):
+        '''Note cells written from (column, row), dropping stale values
+
+        @param rows : the rows of values written
+        '''
+        sheet = sheet.lower()
+        keys = []
+        last = column
+        for r, values in enumerate(rows, row):
+            for c, value in enumerate(values, column):
+                key = (sheet, c, r)
+                keys.append(key)
+                if is_formula(value):
+                    self.cells.add(key)
+                elif key in self.cells:
+                    self.cells.discard(key)
+                    self.parsed.pop(key, None)
+                    self._unlink(key)
+                if c > last:
+                    last = c
+        if keys:
+            self._invalidate(sheet, column, row, last, keys[-1][2], keys)
+
+
+    def reset(self):
+        '''Forget every cached value and dependency'''
+        self.__init__(self._get, self._block, self._formulas)
+
+
+    def _value(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        try:
+            raw = self._get(*key)
+        except KeyError:
+            return REF
+        if not is_formula(raw):
+            return raw
+        return self._calculate(key, raw)
+
+
+    def _calculate(self, key, formula):
+        """Evaluate a formula cell, caching its value and references"""
+        if key in self._active:
+            return REF
+        self.cells.add(key)
+        parsed = self.parsed.get(key)
+        self._unlink(key)
+        self._active.add(key)
+        self._used.append(([], []))
+        try:
+            if parsed is None or parsed[0] != formula:
+                parsed = self.parsed[key] = (formula, parse(formula, key[0]))
+            result = _scalar(self._eval(parsed[1]))
+        except _Fail as fail:
+            result = fail.error
+        finally:
+            self._active.discard(key)
+            cells, ranges = self._used.pop()
+        if result is None:
+            result = 0
+        for cell in cells:
+            self.dependents.setdefault(cell, set()).add(key)
+        for span in ranges:
+            index = self.ranges.get(span[0])
+            if index is None:
+                index = self.ranges[span[0]] = _RangeIndex()
+            index.add(key, span[1:])
+        self.precedents[key] = (cells, ranges)
+        self.values[key] = result
+        return result
+
+
+    def _unlink(self, key):
+        """Remove the references a formula cell made"""
+        cells, ranges = self.precedents.pop(key, ((), ()))
+        for cell in cells:
+            dependents = self.dependents.get(cell)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self.dependents[cell]
+        for span in ranges:
+            index = self.ranges.get(span[0])
+            if index is not None:
+                index.remove(key, span[1:])
+
+
+    def _overlapping(self, sheet, col1, row1, col2, row2):
+        """Return the formula cells with a range overlapping a span"""
+        index = self.ranges.get(sheet)
+        if index is None:
+            return ()
+        return index.overlapping(col1, row1, col2, row2)
+
+
+    def _invalidate(self, sheet, col1, row1, col2, row2, keys):
+        """Drop the values of the cells written and every formula after"""
+        todo = list(self._overlapping(sheet, col1, row1, col2, row2))
+        dependents = self.dependents
+        for key in keys:
+            self.values.pop(key, None)
+            if key in dependents:
+                todo.extend(dependents[key])
+        values = self.values
+        while todo:
+            key = todo.pop()
+            if key not in values:
+                continue
+            del values[key]
+            todo.extend(dependents.get(key, ()))
+            todo.extend(self._overlapping(key[0], key[1], key[2],
+                                          key[1], key[2]))
+
+
+    def _eval(self, tree):
+        """Evaluate a parsed formula, a range gives a _Range"""
+        kind = tree[0]
+        if kind == 'value':
+            return tree[1]
+        if kind == 'ref':
+            key = tree[1:]
+            self._used[-1][0].append(key)
+            return self._value(key)
+        if kind == 'range':
+            self._used[-1][1].append(tree[1:])
+            return self._range(*tree[1:])
+        if kind == 'op':
+            a = _scalar(self._eval(tree[2]))
+            b = _scalar(self._eval(tree[3]))
+            return _OPERATORS[tree[1]](a, b)
+        if kind == 'neg':
+            return -_number(_scalar(self._eval(tree[1])))
+        if kind == 'pct':
+            return _number(_scalar(self._eval(tree[1]))) / 100
+        if kind == 'call':
+            return self._call(tree[1], tree[2])
+        raise _Fail(NAME)
+
+
+    def _call(self, name, args):
+        if name == 'IF':
+            if not 1 < len(args) < 4:
+                raise _Fail(VALUE)
+            if _logical(_scalar(self._eval(args[0]))):
+                return _scalar(self._eval(args[1]))
+            if len(args) == 3:
+                return _scalar(self._eval(args[2]))
+            return False
+        if name == 'IFERROR':
+            if len(args) != 2:
+                raise _Fail(VALUE)
+            try:
+                return _scalar(self._eval(args[0]))
+            except _Fail:
+                return _scalar(self._eval(args[1]))
+        function = _FUNCTIONS.get(name)
+        if function is None:
+            raise _Fail(NAME)
+        try:
+            return function(*[self._eval(arg) for arg in args])
+        except TypeError:
+            raise _Fail(VALUE)     # wrong number of arguments
+
+
+    def _range(self, sheet, col1, row1, col2, row2):
+        """Return the values of a range, evaluating its formulas"""
+        try:
+            rows = self._block(sheet, col1, row1, col2, row2)
+        except KeyError:
+            raise _Fail(REF)
+        values = self.values
+        for r, row in enumerate(rows, row1):
+            for i, value in enumerate(row):
+                if is_formula(value):
+                    key = (sheet, col1 + i, r)
+                    row[i] = (values[key] if key in values
+                              else self._calculate(key, value))
+        return _Range(rows)
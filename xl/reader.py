@@ -0,0 +1,197 @@
+'''
+Script: reader.py
+Author: G. Paxton
+Purpose: To load excel files one worksheet at a time
+Revision: October 2026
+'''
+###############################################################################
+import warnings
+
+from zipfile import ZipFile
+
+from openpyxl.cell import MergedCell
+from openpyxl.comments.comment_sheet import CommentSheet
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.manifest import Manifest
+from openpyxl.packaging.relationship import (RelationshipList,
+                                             get_dependents, get_rels_path)
+from openpyxl.pivot.table import TableDefinition
+from openpyxl.reader.drawings import find_images
+from openpyxl.reader.excel import ExcelReader, _find_workbook_part
+from openpyxl.worksheet._reader import WorksheetReader
+from openpyxl.worksheet.table import Table
+from openpyxl.xml.constants import (ARC_CONTENT_TYPES, COMMENTS_NS,
+                                    SHARED_STRINGS, SHEET_MAIN_NS)
+from openpyxl.xml.functions import fromstring
+
+
+def workbook_part(archive):
+    '''Return the archive path of the workbook part ("xl/workbook.xml")
+
+    @param archive : open ZipFile of the excel file
+    '''
+    package = Manifest.from_tree(fromstring(archive.read(ARC_CONTENT_TYPES)))
+    return _find_workbook_part(package).PartName[1:]
+
+
+def read_sheet_names(path):
+    '''Return the sheet names of an excel file from its manifest
+
+    Only the workbook part is parsed, no sheet, string or style data.
+
+    @param path : path of the excel file
+    '''
+    with ZipFile(path) as archive:
+        root = fromstring(archive.read(workbook_part(archive)))
+    sheets = root.find('{%s}sheets' % SHEET_MAIN_NS)
+    if sheets is None:
+        return []
+    return [sheet.get('name') for sheet in sheets]
+
+
+# CLASS
+class LazyReader(ExcelReader):
+    '''Excel reader that parses each worksheet only when asked
+
+    read() loads the workbook structure, strings and styles and creates
+    an empty placeholder for every worksheet. load_sheet() parses one
+    placeholder's XML into it later on.
+    '''
+
+    def __init__(self, path):
+        ExcelReader.__init__(self, path)
+        self.path = path
+        self.pending = {}   # placeholder worksheet -> (sheet, rel)
+        self.parts = {}     # worksheet -> archive path of its xml
+        self.strings = None # archive path of the shared string table
+
+
+    def read_worksheets(self):
+        '''Create placeholders instead of parsing the worksheets
+
+        '''
+        for sheet, rel in self.parser.find_sheets():
+            if rel.target not in self.valid_files:
+                continue
+            if "chartsheet" in rel.Type:
+                self.read_chartsheet(sheet, rel)
+                continue
+            ws = self.wb.create_sheet(sheet.name)
+            ws.sheet_state = sheet.state
+            self.pending[ws] = (sheet, rel)
+            self.parts[ws] = rel.target
+        strings = self.package.find(SHARED_STRINGS)
+        if strings is not None:
+            self.strings = strings.PartName[1:]
+
+
+    def load_sheet(self, ws):
+        '''Parse a placeholder worksheet's XML into it
+
+        @param ws : worksheet created by read_worksheets
+        '''
+        sheet, rel = self.pending.pop(ws)
+        with ZipFile(self.path) as archive:
+            self.archive = archive
+            self._read_worksheet(ws, sheet, rel)
+
+
+    def load_all(self, skip=()):
+        '''Parse every worksheet that is still a placeholder
+
+        @param skip : worksheets to leave as placeholders
+        '''
+        todo = [ws for ws in self.pending if ws not in skip]
+        if todo:
+            with ZipFile(self.path) as archive:
+                self.archive = archive
+                for ws in todo:
+                    sheet, rel = self.pending.pop(ws)
+                    self._read_worksheet(ws, sheet, rel)
+
+
+    def untouched(self, ws):
+        '''Return True if a worksheet is a placeholder as first created
+
+        Edits made straight through the workbook (wb[name]['B1'] = 1)
+        land in the placeholder, such a sheet has to be written again
+        instead of copied from the file.
+        '''
+        return ws in self.pending and not (
+            any(cell.value is not None or cell.has_style
+                for cell in ws._cells.values()) or ws.merged_cells.ranges or ws.row_dimensions or
+            ws.column_dimensions or ws.conditional_formatting or
+            ws.data_validations.dataValidation or ws._images or
+            ws._charts or ws.tables or ws._hyperlinks or ws.freeze_panes)
+
+
+    def moved(self, parts, strings):
+        '''Follow the file after it was saved over with new part names
+
+        The placeholders are parsed from their new parts later on.
+
+        @param parts : {worksheet: archive path of its xml}
+        @param strings : archive path of the shared string table
+        '''
+        with ZipFile(self.path) as archive:
+            self.valid_files = archive.namelist()
+        self.parts = parts
+        self.strings = strings
+        for ws, (sheet, rel) in self.pending.items():
+            rel.target = parts[ws]
+
+
+    def _read_worksheet(self, ws, sheet, rel):
+        '''Parse one worksheet, as ExcelReader.read_worksheets does
+
+        Cells set in the placeholder before it was parsed win over the
+        file's.
+        '''
+        edited = [cell for cell in ws._cells.values()
+                  if cell.value is not None or cell.has_style]
+        rels = RelationshipList()
+        rels_path = get_rels_path(rel.target)
+        if rels_path in self.valid_files:
+            rels = get_dependents(self.archive, rels_path)
+        ws._rels = rels
+
+        with self.archive.open(rel.target) as fh:
+            ws_parser = WorksheetReader(ws, fh, self.shared_strings,
+                                        self.data_only, self.rich_text)
+            ws_parser.bind_all()
+        for cell in edited:
+            ws._cells[(cell.row, cell.column)] = cell
+
+        # assign any comments to cells
+        for r in rels.find(COMMENTS_NS):
+            src = self.archive.read(r.target)
+            comment_sheet = CommentSheet.from_tree(fromstring(src))
+            for ref, comment in comment_sheet.comments:
+                cell = ws[ref]
+                if isinstance(cell, MergedCell):
+                    warnings.warn("Cell '{0}':{1} is part of a merged range "
+                                  "but has a comment which will be "
+                                  "removed".format(ws.title, ref))
+                    continue
+                cell.comment = comment
+
+        ws.legacy_drawing = None
+
+        for path in ws_parser.tables:
+            ws.add_table(Table.from_tree(fromstring(self.archive.read(path))))
+
+        for drawing in rels.find(SpreadsheetDrawing._rel_type):
+            charts, images = find_images(self.archive, drawing.target)
+            for chart in charts:
+                ws.add_chart(chart, chart.anchor)
+            for image in images:
+                ws.add_image(image, image.anchor)
+
+        pivot_caches = self.parser.pivot_caches
+        for r in rels.find(TableDefinition.rel_type):
+            tree = fromstring(self.archive.read(r.Target))
+            pivot = TableDefinition.from_tree(tree)
+            pivot.cache = pivot_caches[pivot.cacheId]
+            ws.add_pivot(pivot)
+
+        ws.sheet_state = sheet.state
@@ -0,0 +1,265 @@
+'''
+Script: shard.py
+Author: G. Paxton
+Purpose: To build the sheets of one excel workbook in parallel processes
+Revision: October 2026
+'''
+###############################################################################
+import datetime
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+import traceback
+
+from zipfile import ZipFile
+
+import openpyxl
+
+from openpyxl.writer.excel import ExcelWriter
+
+from xl.archive import XLArchive, check_compression
+from xl.batch import XLResult
+from xl.reader import LazyReader
+from xl.storage import _UTC
+from xl.writer import plain_sheets
+from xl.xlutils import XLUtil, NORMAL, READ, merge_styles, release_logger
+
+
+# Data
+'''
+Parts
+'''
+# style attributes of cells, rows (s="3") and columns (style="3")
+_STYLE_ATTR = re.compile(br'(<(?:c|row|col) [^>]*?\b(?:s|style)=")(\d+)"')
+# differential styles of conditional formats (<cfRule dxfId="0">)
+_DXF_ATTR = re.compile(br'(<cfRule [^>]*?\bdxfId=")(\d+)"')
+_TAB_SELECTED = b' tabSelected="1"'
+
+
+def _build_sheet(job):
+    '''Build one shard's workbook in a worker process
+
+    @param job : (index, name, func, kwargs, mode, path, logFile)
+    @return (index, XLResult), the result's path is the shard's file
+    '''
+    index, name, func, kwargs, mode, path, logFile = job
+    start = time.time()
+    try:
+        xl = XLUtil(path, logFile=logFile, mode=mode, quiet=True)
+        xl.worksheet.title = name
+        value = func(xl, **kwargs)
+        xl.save_workbook()
+        return index, XLResult(path, value, None, time.time() - start)
+    except Exception:
+        return index, XLResult(path, None, traceback.format_exc(),
+                               time.time() - start)
+    finally:
+        release_logger(logFile)
+
+
+def _renumber(pattern, mapping, data):
+    '''Replace the numbers pattern matches in data through mapping'''
+    return pattern.sub(
+        lambda match: match.group(1) +
+        str(mapping[int(match.group(2))]).encode('ascii') + b'"', data)
+
+
+def _copy_part(job):
+    '''Extract a shard's sheet xml to a file, renumbering its styles
+
+    @param job : (shard file, archive path, style mapping or None,
+                  differential style mapping or None, keep tabSelected,
+                  file to write)
+    '''
+    path, part, mapping, dxfs, selected, target = job
+    with ZipFile(path) as archive:
+        data = archive.read(part)
+    if not selected:
+        data = data.replace(_TAB_SELECTED, b'')
+    if mapping is not None:
+        data = _renumber(_STYLE_ATTR, mapping, data)
+    if dxfs is not None:
+        data = _renumber(_DXF_ATTR, dxfs, data)
+    with open(target, 'wb') as fh:
+        fh.write(data)
+    return target
+
+
+# CLASS
+class _ShardWriter(ExcelWriter):
+    '''Excel writer taking each worksheet's xml from a file'''
+
+    def __init__(self, workbook, archive, parts):
+        ExcelWriter.__init__(self, workbook, archive)
+        self.parts = parts      # worksheet -> (xml file, rels)
+
+
+    def write_worksheet(self, ws):
+        path, rels = self.parts[ws]
+        ws._drawing = None
+        ws._rels = rels
+        self._archive.write(path, ws.path[1:])
+        self.manifest.append(ws)
+
+
+class XLShards:
+    '''Build each sheet of one workbook in its own worker process
+
+    Every sheet is built by a function given its own XLUtil on a
+    temporary one-sheet workbook, in a process pool. save_workbook then
+    joins the sheets' xml into one file, adding every shard's cell
+    formats and conditional formats' differential styles to one style
+    table and renumbering the sheets' references to match, so a
+    workbook of many sheets takes about as long as its largest sheets
+    divided among the cores.
+    '''
+
+    def __init__(self, excelPath, sheets, workers=None, mode=NORMAL,
+                 logDir=None):
+        '''Set up the sheets of a workbook
+
+        @param excelPath : path of the workbook, .xlsx is added if missing
+        @param sheets : iterable of (name, func) or (name, func, kwargs)
+                        in sheet order, func is called as
+                        func(xl, **kwargs) with the sheet active and must
+                        be a module level function so it can be pickled,
+                        sheets it makes are added after its own
+        @param workers : number of processes (default is one per core),
+                         1 builds every sheet in this process
+        @param mode : XLUtil mode of the shards, NORMAL or STREAM
+        @param logDir : directory for one "<sheet>.log" per sheet,
+                        None to skip log files
+
+        Note: a sheet's tables, comments and images can't be joined
+        (they are numbered per file), a shard using them raises
+        ValueError on save. Conditional formats are joined, their
+        differential styles renumbered as the cell formats are.
+        Workbook level settings (defined names, print titles) of the
+        shards are not kept.
+        '''
+        if mode == READ:
+            raise ValueError('Shards are built in NORMAL or STREAM mode')
+        if excelPath[-5:] != '.xlsx':
+            excelPath += '.xlsx'
+        self.path = excelPath
+        self.sheets = []
+        for sheet in sheets:
+            kwargs = sheet[2] if len(sheet) > 2 else {}
+            self.sheets.append((sheet[0], sheet[1], kwargs))
+        self.workers = workers or multiprocessing.cpu_count()
+        self.mode = mode
+        self.logDir = logDir
+        self.results = []
+        self.seconds = 0.0
+
+
+    def save_workbook(self, fileName=None, compression='default'):
+        '''Build the sheets and save them as one workbook
+
+        @param fileName : file to save to, default the excelPath
+        @param compression : 'stored', 'fast', 'default' or 'max' for
+                             the joined workbook
+        @return results : XLResult per sheet in order, its value is what
+                          the sheet's function returned and its path
+                          the joined workbook (None if nothing was saved)
+
+        Raises RuntimeError (with the worker's traceback) if a sheet's
+        function fails, nothing is saved then.
+        '''
+        start = time.time()
+        check_compression(compression)
+        folder = tempfile.mkdtemp(prefix='xlshards')
+        pool = None
+        saved = None
+        try:
+            jobs = []
+            for index, (name, func, kwargs) in enumerate(self.sheets):
+                logFile = None
+                if self.logDir is not None:
+                    logFile = os.path.join(self.logDir, name + '.log')
+                path = os.path.join(folder, 'shard{0}.xlsx'.format(index))
+                jobs.append((index, name, func, kwargs, self.mode, path,
+                             logFile))
+            workers = min(self.workers, len(jobs))
+            if workers > 1:
+                pool = multiprocessing.Pool(workers)
+            self.results = [None] * len(jobs)
+            for index, result in self._map(pool, _build_sheet, jobs):
+                self.results[index] = result
+            for index, result in enumerate(self.results):
+                if result.error:
+                    raise RuntimeError('Sheet {0} failed:\n{1}'.format(
+                        self.sheets[index][0], result.error))
+            workbook, copies, parts = self._join(folder)
+            for path in self._map(pool, _copy_part, copies):
+                pass
+            self._write(workbook, fileName or self.path, parts, compression)
+            saved = fileName or self.path
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            shutil.rmtree(folder, ignore_errors=True)
+            # the shards' files are gone
+            self.results = [result and result._replace(path=saved)
+                            for result in self.results]
+        self.seconds = time.time() - start
+        return list(self.results)
+
+
+    def _map(self, pool, func, jobs):
+        """Run func over the jobs in the pool, or here without one"""
+        if pool is None:
+            return map(func, jobs)
+        return pool.imap_unordered(func, jobs)
+
+
+    def _join(self, folder):
+        """Make the joined workbook from the shards' files
+
+        @return (workbook, _copy_part jobs, {worksheet: (xml file, rels)})
+        """
+        workbook = openpyxl.Workbook()
+        workbook.remove(workbook.active)
+        copies = []
+        parts = {}
+        for result in self.results:
+            reader = LazyReader(result.path)
+            reader.read()
+            reader.archive.close()
+            mapping = merge_styles(workbook, reader.wb)
+            if mapping == list(range(len(mapping))):
+                mapping = None
+            dxfs = [workbook._differential_styles.add(dxf)
+                    for dxf in reader.wb._differential_styles.styles]
+            if dxfs == list(range(len(dxfs))):
+                dxfs = None
+            raw = plain_sheets(result.path, reader.parts)
+            for ws in reader.wb.worksheets:
+                if ws.title in workbook.sheetnames:
+                    raise ValueError('Two shards make sheet {0}'.format(
+                        ws.title))
+                if ws not in raw:
+                    raise ValueError('Sheet {0} has tables, comments or '
+                                     'images, it cannot be joined'.format(
+                                         ws.title))
+                sheet = workbook.create_sheet(ws.title)
+                sheet.sheet_state = ws.sheet_state
+                target = os.path.join(folder, 'part{0}.xml'.format(
+                    len(copies)))
+                copies.append((result.path, raw[ws][0], mapping, dxfs,
+                               not copies, target))
+                parts[sheet] = (target, raw[ws][1])
+        return workbook, copies, parts
+
+
+    def _write(self, workbook, fileName, parts, compression):
+        """Save the joined workbook"""
+        workbook.active = 0
+        workbook.properties.modified = datetime.datetime.now(
+            _UTC).replace(tzinfo=None)
+        archive = XLArchive(fileName, compression)
+        _ShardWriter(workbook, archive, parts).save()
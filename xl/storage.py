@@ -0,0 +1,767 @@
+'''
+Script: storage.py
+Author: G. Paxton
+Purpose: To keep the cells of very large worksheets compact or on disk
+Revision: October 2026
+'''
+###############################################################################
+import os
+import sqlite3
+import datetime
+import tempfile
+
+from array import array
+from heapq import merge
+from itertools import groupby
+
+from openpyxl.cell import Cell
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.worksheet.dimensions import SheetDimension
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.utils import get_column_letter
+
+from xl.archive import XLArchive
+
+
+# Data
+'''
+Values
+'''
+# kind column -> function turning the stored value back into a python one
+_DATETIME = '%Y-%m-%d %H:%M:%S.%f'
+_DECODE = {
+    'b': bool,
+    'dt': lambda text: datetime.datetime.strptime(text, _DATETIME),
+    'd': lambda text: datetime.datetime.strptime(text, '%Y-%m-%d').date(),
+    't': lambda text: datetime.datetime.strptime(text, '%H:%M:%S.%f').time(),
+    'td': lambda seconds: datetime.timedelta(seconds=seconds),
+}
+
+try:
+    _PLAIN = (str, unicode, int, long, float)
+    _INTS = (int, long)
+except NameError:
+    _PLAIN = (str, int, float)
+    _INTS = (int,)
+_INT64 = 2 ** 63        # SQLite integers are 64 bit
+_BATCH = 10000          # cells moved into the file per insert
+
+'''
+Columns
+'''
+# kinds of value in a ColumnStore column
+_NONE, _FLOAT, _INT, _BOOL, _TEXT, _OBJECT = range(6)
+_EXACT = 2 ** 53        # ints below this are exact as floats
+_CHUNK = 1024           # rows decoded at a time
+
+try:
+    _UTC = datetime.timezone.utc
+except AttributeError:
+    _UTC = None         # python 2, local time
+
+
+def encode(value):
+    '''Return (value, kind) to store for a cell value
+
+    Strings and numbers are stored as they are (kind None). Raises
+    TypeError for values that can't be stored, such as rich text,
+    formula objects, timezone aware datetimes or ints past 64 bits.
+    '''
+    if value is None:
+        return None, None
+    if value.__class__ is bool:
+        return int(value), 'b'
+    if isinstance(value, _INTS):
+        if -_INT64 <= value < _INT64:
+            return value, None
+        raise TypeError('Cannot store {0}, it is past 64 bits'.format(value))
+    if isinstance(value, _PLAIN):
+        if isinstance(value, float) and value.__class__ is not float:
+            value = float(value)            # eg numpy.float64
+        return value, None
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return value.strftime(_DATETIME), 'dt'
+    elif isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d'), 'd'
+    elif isinstance(value, datetime.time):
+        if value.tzinfo is None:
+            return value.strftime('%H:%M:%S.%f'), 't'
+    elif isinstance(value, datetime.timedelta):
+        return value.total_seconds(), 'td'
+    elif hasattr(value, 'item') and hasattr(value, 'dtype'):
+        return encode(value.item())     # numpy scalar
+    raise TypeError('Cannot store a {0}'.format(type(value).__name__))
+
+
+def decode(value, kind):
+    '''Return the python value for a stored (value, kind)'''
+    if kind is None:
+        return value
+    return _DECODE[kind](value)
+
+
+# CLASS
+class SpillFile:
+    '''Temporary SQLite file holding the cells of spilled worksheets
+
+    Each worksheet gets its own table of (row, col, value, kind, style)
+    rows. The file is removed when closed or garbage collected.
+    '''
+
+    def __init__(self, directory=None):
+        '''Create the file
+
+        @param directory : directory for the file (default system temp)
+        '''
+        handle, self.path = tempfile.mkstemp(suffix='.xlspill',
+                                             dir=directory)
+        os.close(handle)
+        self.conn = self._connect()
+        self.tables = 0
+        self._inherited = None
+
+
+    def _connect(self):
+        """Open a connection tuned for scratch data"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL keeps what a forked save's snapshot reads while writing
+        # goes on, see snapshot
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+
+    def sheet(self):
+        '''Return a new, empty SheetStore in this file
+
+        '''
+        self.tables += 1
+        return SheetStore(self, 'cells{0}'.format(self.tables))
+
+
+    def commit(self):
+        '''Make everything written so far visible to other connections
+
+        '''
+        self.conn.commit()
+
+
+    def reopen(self):
+        '''Use a new connection, in a forked child process
+
+        The inherited connection is kept (never used or closed) so the
+        parent's is left untouched.
+        '''
+        self._inherited = self.conn
+        self.conn = self._connect()
+
+
+    def snapshot(self):
+        '''Start a read transaction, so later commits aren't seen by it
+
+        A forked save calls this before the parent writes again. The
+        transaction only starts at its first read, so one is done here.
+        '''
+        self.conn.execute('BEGIN')
+        self.conn.execute('SELECT count(*) FROM sqlite_master').fetchone()
+
+
+    def close(self):
+        '''Close and remove the file
+
+        '''
+        if self.conn is None:
+            return
+        self.conn.close()
+        self.conn = None
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+
+
+    def __del__(self):
+        if self._inherited is None:
+            self.close()
+
+
+class SheetStore:
+    '''The cells of one worksheet, in a table of a SpillFile
+
+    Style ids are indexes into the workbook's cell style list.
+    '''
+    in_memory = False
+
+    def __init__(self, spill, table):
+        self.spill = spill
+        self.table = table
+        spill.conn.execute(
+            'CREATE TABLE {0} (row INTEGER, col INTEGER, value, kind TEXT,'
+            ' style INTEGER, PRIMARY KEY (row, col)) WITHOUT ROWID'
+            .format(table))
+        self._put = ('INSERT INTO {0} (row, col, value, kind) VALUES '
+                     '(?, ?, ?, ?) ON CONFLICT (row, col) DO UPDATE SET '
+                     'value = excluded.value, kind = excluded.kind'
+                     .format(table))
+        self._style = ('INSERT INTO {0} (row, col, style) VALUES (?, ?, ?) '
+                       'ON CONFLICT (row, col) DO UPDATE SET '
+                       'style = excluded.style'.format(table))
+
+
+    def take(self, cells, styles):
+        '''Move the plain cells of a worksheet's cell dict into the store
+
+        Cells with a hyperlink or comment, merged cells and values that
+        can't be stored stay in the dict. Cells leave the dict only once
+        they are in the file, _BATCH at a time.
+
+        @param cells : the worksheet's {(row, col): cell} dict
+        @param styles : the workbook's cell style list
+        @return count : number of cells moved
+        '''
+        insert = 'INSERT OR REPLACE INTO {0} VALUES (?, ?, ?, ?, ?)'.format(
+            self.table)
+        keys = list(cells)
+        moved = 0
+        for start in range(0, len(keys), _BATCH):
+            batch = []
+            for key in keys[start:start+_BATCH]:
+                cell = cells[key]
+                if (cell.__class__ is not Cell or cell._hyperlink is not None
+                        or cell._comment is not None):
+                    continue
+                try:
+                    value, kind = encode(cell._value)
+                except TypeError:
+                    continue
+                style = (styles.add(StyleArray(cell._style))
+                         if cell.has_style else None)
+                batch.append((key[0], key[1], value, kind, style))
+            self.spill.conn.executemany(insert, batch)
+            for row in batch:
+                del cells[row[:2]]
+            moved += len(batch)
+        return moved
+
+
+    def extend(self, cells):
+        '''Add cells taken from another store
+
+        @param cells : (row, col, value, style id) of each cell
+        @return rejected : the cells whose value can't be stored
+        '''
+        rejected = []
+
+        def rows():
+            for row, col, value, style in cells:
+                try:
+                    stored, kind = encode(value)
+                except TypeError:
+                    rejected.append((row, col, value, style))
+                    continue
+                yield row, col, stored, kind, style
+
+        self.spill.conn.executemany(
+            'INSERT OR REPLACE INTO {0} VALUES (?, ?, ?, ?, ?)'.format(
+                self.table), rows())
+        return rejected
+
+
+    def put(self, column, row, value):
+        '''Set the value of a cell, keeping its style
+
+        Raises TypeError if the value can't be stored.
+        '''
+        value, kind = encode(value)
+        self.spill.conn.execute(self._put, (row, column, value, kind))
+
+
+    def put_rows(self, column, row, rows):
+        '''Set the values of rows of cells starting at (column, row)
+
+        @return rejected : [(column, row, value)] of values that can't
+                           be stored, they are left to the caller
+        '''
+        rejected = []
+
+        def values():
+            for r, values in enumerate(rows, row):
+                for c, value in enumerate(values, column):
+                    try:
+                        value, kind = encode(value)
+                    except TypeError:
+                        rejected.append((c, r, value))
+                        continue
+                    yield r, c, value, kind
+
+        self.spill.conn.executemany(self._put, values())
+        return rejected
+
+
+    def get(self, column, row):
+        '''Return the value of a cell (None if empty)'''
+        found = self.spill.conn.execute(
+            'SELECT value, kind FROM {0} WHERE row = ? AND col = ?'.format(
+                self.table), (row, column)).fetchone()
+        return None if found is None else decode(*found)
+
+
+    def values(self, col1, row1, col2, row2):
+        '''Yield a tuple of values for every row of a span'''
+        found = self.spill.conn.execute(
+            'SELECT row, col, value, kind FROM {0} WHERE row BETWEEN ? AND ?'
+            ' AND col BETWEEN ? AND ? ORDER BY row, col'.format(self.table),
+            (row1, row2, col1, col2))
+        width = col2 - col1 + 1
+        empty = (None,) * width
+        row = row1
+        for r, cells in groupby(found, lambda cell: cell[0]):
+            while row < r:
+                yield empty
+                row += 1
+            values = [None] * width
+            for cell in cells:
+                values[cell[1] - col1] = decode(cell[2], cell[3])
+            yield tuple(values)
+            row += 1
+        while row <= row2:
+            yield empty
+            row += 1
+
+
+    def restyle(self, col1, row1, col2, row2, change):
+        '''Set the style of every cell of a span, creating missing cells
+
+        @param change : function of a cell's style id (None if unstyled)
+                        returning the new style id
+        '''
+        conn = self.spill.conn
+        select = ('SELECT col, style FROM {0} WHERE row = ? AND '
+                  'col BETWEEN ? AND ?'.format(self.table))
+        memo = {}
+
+        def styles():
+            for row in range(row1, row2 + 1):
+                old = dict(conn.execute(select, (row, col1, col2)).fetchall())
+                for column in range(col1, col2 + 1):
+                    style = old.get(column)
+                    try:
+                        new = memo[style]
+                    except KeyError:
+                        new = memo[style] = change(style)
+                    yield row, column, new
+
+        conn.executemany(self._style, styles())
+
+
+    def style(self, column, row):
+        '''Return the style id of a cell (None if unstyled or empty)'''
+        found = self.spill.conn.execute(
+            'SELECT style FROM {0} WHERE row = ? AND col = ?'.format(
+                self.table), (row, column)).fetchone()
+        return None if found is None else found[0]
+
+
+    def bounds(self):
+        '''Return (min col, min row, max col, max row), None if empty'''
+        found = self.spill.conn.execute(
+            'SELECT min(col), min(row), max(col), max(row) FROM {0}'.format(
+                self.table)).fetchone()
+        return None if found[0] is None else found
+
+
+    def cells(self):
+        '''Yield (row, col, value, style id) of every cell in row order'''
+        for row, col, value, kind, style in self.spill.conn.execute(
+                'SELECT row, col, value, kind, style FROM {0} '
+                'ORDER BY row, col'.format(self.table)):
+            yield row, col, decode(value, kind), style
+
+
+    def drop(self):
+        '''Remove the table'''
+        self.spill.conn.execute('DROP TABLE {0}'.format(self.table))
+
+
+class _Column(object):
+    '''One column of a ColumnStore, covering rows start onwards
+
+    Each row has a kind, a float (the number, or the id of the shared
+    string) and, once the column is styled, a style id (-1 unstyled).
+    '''
+    __slots__ = ('start', 'numbers', 'kinds', 'styles')
+
+    def __init__(self, start):
+        self.start = start
+        self.numbers = array('d')
+        self.kinds = bytearray()
+        self.styles = None
+
+
+    def cover(self, first, last):
+        """Grow the column to cover rows first to last"""
+        if not self.kinds:
+            self.start = first
+        if first < self.start:
+            count = self.start - first
+            self.numbers = array('d', [0.0]) * count + self.numbers
+            self.kinds = bytearray(count) + self.kinds
+            if self.styles is not None:
+                self.styles = array('l', [-1]) * count + self.styles
+            self.start = first
+        count = last - self.start + 1 - len(self.kinds)
+        if count > 0:
+            self.numbers.extend(array('d', [0.0]) * count)
+            self.kinds.extend(bytearray(count))
+            if self.styles is not None:
+                self.styles.extend(array('l', [-1]) * count)
+
+
+class ColumnStore:
+    '''The cells of one worksheet, held in typed column arrays
+
+    A cell costs 9 bytes (13 once its column is styled) instead of an
+    openpyxl Cell and its dict entry. Text is kept once in a shared
+    string table, values other than numbers, bools and text in a dict.
+    Offers the same methods as SheetStore, style ids are indexes into
+    the workbook's cell style list.
+    '''
+    in_memory = True
+
+    def __init__(self):
+        self.columns = {}       # col -> _Column
+        self.strings = []       # shared string table
+        self._string_ids = {}
+        self.objects = {}       # (row, col) -> any other value
+
+
+    def __len__(self):
+        return sum(len(col.kinds) for col in self.columns.values())
+
+
+    def _cover(self, column, first, last):
+        """Return the column, grown to cover rows first to last"""
+        col = self.columns.get(column)
+        if col is None:
+            col = self.columns[column] = _Column(first)
+        col.cover(first, last)
+        return col
+
+
+    def take(self, cells, styles):
+        '''Move the plain cells of a worksheet's cell dict into the store
+
+        Cells with a hyperlink or comment and merged cells stay in the
+        dict.
+
+        @param cells : the worksheet's {(row, col): cell} dict
+        @param styles : the workbook's cell style list
+        @return count : number of cells moved
+        '''
+        plain = [key for key, cell in cells.items()
+                 if cell.__class__ is Cell and cell._hyperlink is None
+                 and cell._comment is None]
+        extents = {}
+        for row, col in plain:
+            first, last = extents.get(col, (row, row))
+            extents[col] = (min(first, row), max(last, row))
+        for col, (first, last) in extents.items():
+            self._cover(col, first, last)
+        for key in plain:
+            cell = cells.pop(key)
+            self.put(key[1], key[0], cell._value)
+            if cell.has_style:
+                self._set_style(key[1], key[0],
+                                styles.add(StyleArray(cell._style)))
+        return len(plain)
+
+
+    def put(self, column, row, value):
+        '''Set the value of a cell, keeping its style
+
+        '''
+        self.put_rows(column, row, ((value,),))
+
+
+    def put_rows(self, column, row, rows):
+        '''Set the values of rows of cells starting at (column, row)
+
+        @return rejected : always empty, any value can be kept
+        '''
+        if not isinstance(rows, (list, tuple)):
+            rows = list(rows)
+        if not rows:
+            return []
+        last = row + len(rows) - 1
+        width = max(len(values) for values in rows)
+        cols = [self._cover(c, row, last)
+                for c in range(column, column + width)]
+        numbers = [col.numbers for col in cols]
+        kinds = [col.kinds for col in cols]
+        starts = [col.start for col in cols]
+        strings = self.strings
+        string_ids = self._string_ids
+        objects = self.objects
+        for r, values in enumerate(rows, row):
+            for c, value in enumerate(values):
+                i = r - starts[c]
+                cls = value.__class__
+                if cls is float:
+                    kind = _FLOAT
+                elif cls is str:
+                    kind = _TEXT
+                    number = string_ids.get(value)
+                    if number is None:
+                        number = string_ids[value] = len(strings)
+                        strings.append(value)
+                    value = number
+                elif cls is int and -_EXACT < value < _EXACT:
+                    kind = _INT
+                elif value is None:
+                    kind = _NONE
+                    value = 0
+                elif cls is bool:
+                    kind = _BOOL
+                else:
+                    kind = _OBJECT
+                    objects[(r, column + c)] = value
+                    value = 0
+                if kinds[c][i] == _OBJECT and kind != _OBJECT:
+                    del objects[(r, column + c)]
+                numbers[c][i] = value
+                kinds[c][i] = kind
+        return []
+
+
+    def _decoded(self, column, first, last):
+        """Return (values, style ids or None) of a column's rows"""
+        count = last - first + 1
+        col = self.columns.get(column)
+        if col is None:
+            return [None] * count, None
+        a = max(first, col.start)
+        b = min(last, col.start + len(col.kinds) - 1)
+        if a > b:
+            return [None] * count, None
+        lo, hi = a - col.start, b - col.start + 1
+        values = [None] * (a - first)
+        kinds = col.kinds[lo:hi]
+        numbers = col.numbers[lo:hi]
+        if kinds.count(b'\x01') == len(kinds):
+            values.extend(numbers)
+        else:
+            strings = self.strings
+            objects = self.objects
+            append = values.append
+            for i, kind in enumerate(kinds):
+                if kind == _FLOAT:
+                    append(numbers[i])
+                elif kind == _INT:
+                    append(int(numbers[i]))
+                elif kind == _TEXT:
+                    append(strings[int(numbers[i])])
+                elif kind == _NONE:
+                    append(None)
+                elif kind == _BOOL:
+                    append(bool(numbers[i]))
+                else:
+                    append(objects[(a + i, column)])
+        values.extend([None] * (last - b))
+        if col.styles is None:
+            return values, None
+        styles = [-1] * (a - first)
+        styles.extend(col.styles[lo:hi])
+        styles.extend([-1] * (last - b))
+        return values, styles
+
+
+    def get(self, column, row):
+        '''Return the value of a cell (None if empty)'''
+        return self._decoded(column, row, row)[0][0]
+
+
+    def values(self, col1, row1, col2, row2):
+        '''Yield a tuple of values for every row of a span'''
+        for first in range(row1, row2 + 1, _CHUNK):
+            last = min(first + _CHUNK - 1, row2)
+            columns = [self._decoded(c, first, last)[0]
+                       for c in range(col1, col2 + 1)]
+            for values in zip(*columns):
+                yield values
+
+
+    def _set_style(self, column, row, style):
+        col = self._cover(column, row, row)
+        if col.styles is None:
+            col.styles = array('l', [-1]) * len(col.kinds)
+        col.styles[row - col.start] = style
+
+
+    def restyle(self, col1, row1, col2, row2, change):
+        '''Set the style of every cell of a span, creating missing cells
+
+        @param change : function of a cell's style id (None if unstyled)
+                        returning the new style id
+        '''
+        memo = {}
+        for column in range(col1, col2 + 1):
+            col = self._cover(column, row1, row2)
+            if col.styles is None:
+                col.styles = array('l', [-1]) * len(col.kinds)
+            styles = col.styles
+            for i in range(row1 - col.start, row2 - col.start + 1):
+                old = styles[i]
+                try:
+                    styles[i] = memo[old]
+                except KeyError:
+                    new = memo[old] = change(None if old < 0 else old)
+                    styles[i] = new
+
+
+    def style(self, column, row):
+        '''Return the style id of a cell (None if unstyled or empty)'''
+        styles = self._decoded(column, row, row)[1]
+        return None if styles is None or styles[0] < 0 else styles[0]
+
+
+    def bounds(self):
+        '''Return (min col, min row, max col, max row), None if empty'''
+        used = [(column, col) for column, col in self.columns.items()
+                if col.kinds]
+        if not used:
+            return None
+        return (min(column for column, col in used),
+                min(col.start for column, col in used),
+                max(column for column, col in used),
+                max(col.start + len(col.kinds) - 1 for column, col in used))
+
+
+    def cells(self):
+        '''Yield (row, col, value, style id) of every cell in row order'''
+        bounds = self.bounds()
+        if bounds is None:
+            return
+        columns = sorted(self.columns)
+        for first in range(bounds[1], bounds[3] + 1, _CHUNK):
+            last = min(first + _CHUNK - 1, bounds[3])
+            decoded = [(column,) + self._decoded(column, first, last)
+                       for column in columns]
+            for i in range(last - first + 1):
+                for column, values, styles in decoded:
+                    style = None
+                    if styles is not None and styles[i] >= 0:
+                        style = styles[i]
+                    if values[i] is not None or style is not None:
+                        yield first + i, column, values[i], style
+
+
+    def drop(self):
+        '''Release the cells'''
+        self.columns.clear()
+        self.objects.clear()
+        del self.strings[:]
+        self._string_ids.clear()
+
+
+class _StoreSheetWriter(WorksheetWriter):
+    '''Worksheet writer taking the cells from a SheetStore
+
+    Cells still held in the worksheet (merged cells, cells with links or
+    comments) take the place of the stored cell at the same position.
+    '''
+
+    def __init__(self, ws, store):
+        WorksheetWriter.__init__(self, ws)
+        self.store = store
+
+
+    def write_dimensions(self):
+        bounds = self.store.bounds()
+        held = list(self.ws._cells)
+        if bounds is None and not held:
+            ref = 'A1:A1'
+        else:
+            cols = [key[1] for key in held]
+            rows = [key[0] for key in held]
+            if bounds is not None:
+                cols.extend((bounds[0], bounds[2]))
+                rows.extend((bounds[1], bounds[3]))
+            ref = '{0}{1}:{2}{3}'.format(get_column_letter(min(cols)),
+                                         min(rows),
+                                         get_column_letter(max(cols)),
+                                         max(rows))
+        self.xf.send(SheetDimension(ref).to_tree())
+
+
+    def rows(self):
+        ws = self.ws
+        styles = ws.parent._cell_styles
+        held = ws._cells
+
+        def stored():
+            for row, col, value, style in self.store.cells():
+                if (row, col) in held:
+                    continue
+                cell = Cell(ws, row=row, column=col, value=value)
+                if style is not None:
+                    cell._style = StyleArray(styles[style])
+                yield row, col, cell
+
+        cells = merge(stored(), ((key[0], key[1], held[key])
+                                 for key in sorted(held)))
+        # rows only styled through their row dimension
+        dimensions = iter(sorted(ws.row_dimensions.keys()))
+        dimension = next(dimensions, None)
+        for row, group in groupby(cells, lambda cell: cell[0]):
+            while dimension is not None and dimension <= row:
+                if dimension < row:
+                    yield dimension, []
+                dimension = next(dimensions, None)
+            yield row, [cell[2] for cell in group]
+        while dimension is not None:
+            yield dimension, []
+            dimension = next(dimensions, None)
+
+
+class _StoreWriter(ExcelWriter):
+    '''Excel writer that writes stored worksheets from their stores'''
+
+    def __init__(self, workbook, archive, stores):
+        ExcelWriter.__init__(self, workbook, archive)
+        self.stores = stores
+
+
+    def write_worksheet(self, ws):
+        store = self.stores.get(ws)
+        if store is None:
+            return ExcelWriter.write_worksheet(self, ws)
+        ws._drawing = SpreadsheetDrawing()
+        ws._drawing.charts = ws._charts
+        ws._drawing.images = ws._images
+        writer = _StoreSheetWriter(ws, store)
+        writer.write()
+        ws._rels = writer._rels
+        self._archive.write(writer.out, ws.path[1:])
+        self.manifest.append(ws)
+        writer.cleanup()
+
+
+def save_workbook(workbook, filename, stores, compression='default'):
+    '''Save a workbook whose stored worksheets are in stores
+
+    The stored cells are turned back into openpyxl cells one row at a
+    time as each sheet is written, so they are never all in memory.
+
+    @param workbook : openpyxl workbook
+    @param filename : file to save to
+    @param stores : {worksheet: SheetStore or ColumnStore}
+    @param compression : 'stored', 'fast', 'default' or 'max'
+    '''
+    archive = XLArchive(filename, compression)
+    workbook.properties.modified = datetime.datetime.now(
+        _UTC).replace(tzinfo=None)
+    _StoreWriter(workbook, archive, stores).save()
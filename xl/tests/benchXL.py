@@ -0,0 +1,331 @@
+"""
+Benchmark xlutils
+
+Times the XLUtil reading, writing, styling, sizing, saving and loading
+methods on sheets of 1k, 100k and 1M cells, reports cells per second and
+peak memory and compares them against a stored baseline. The import of
+xlutils in a fresh interpreter is timed too, as 'startup'.
+
+    python -m xl.tests.benchXL                      run and compare
+    python -m xl.tests.benchXL --sizes 1k,100k      only some sizes
+    python -m xl.tests.benchXL --save-baseline      store the results
+
+Exits with status 1 if a case is slower than the baseline by more than
+the --tolerance factor (default 1.5). Cases that took under 10ms in
+the baseline are reported but not compared.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:     # python 2
+    tracemalloc = None
+
+from xl import xlutils
+
+
+# Data
+'''
+Sizes
+'''
+COLUMNS = 10
+SIZES = {'1k': 1000, '100k': 100000, '1M': 1000000}
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'bench_baseline.json')
+TOLERANCE = 1.5
+MIN_SECONDS = 0.01     # faster cases are too noisy to compare
+STARTUP = 'startup'    # results key of the import timing
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def _table(rows):
+    '''Return rows of COLUMNS values, alternating numbers and text'''
+    return [[r * COLUMNS + c if c % 2 else 'v{0}'.format(r * COLUMNS + c)
+             for c in range(COLUMNS)] for r in range(rows)]
+
+
+# CASES
+#
+# Each case is (name, setup, run). setup(xl, rows, path) prepares the
+# XLUtil outside of the timing and returns the argument run is given.
+def _empty(xl, rows, path):
+    return _table(rows)
+
+
+def _filled(xl, rows, path):
+    table = _table(rows)
+    xl.write_block('A1', table)
+    return table
+
+
+def _saved(xl, rows, path):
+    xl.write_block('A1', _table(rows))
+    xl.save_workbook(path)
+    return path
+
+
+def _coords(rows):
+    return [xlutils.column_letter(c) + str(r)
+            for r in range(1, rows + 1) for c in range(1, COLUMNS + 1)]
+
+
+def _run_write(xl, table):
+    write = xl.write
+    values = [value for row in table for value in row]
+    for coord, value in zip(_coords(len(table)), values):
+        write(coord, value)
+
+
+def _run_read(xl, table):
+    read = xl.read
+    for coord in _coords(len(table)):
+        read(coord)
+
+
+def _run_write_row(xl, table):
+    for row, values in enumerate(table, 1):
+        xl.write_row((1, row), values)
+
+
+def _run_read_row(xl, table):
+    for row in range(1, len(table) + 1):
+        xl.read_row((1, row), COLUMNS)
+
+
+def _run_write_column(xl, table):
+    for column, values in enumerate(zip(*table), 1):
+        xl.write_column((column, 1), values)
+
+
+def _run_read_column(xl, table):
+    for column in range(1, COLUMNS + 1):
+        xl.read_column((column, 1), len(table))
+
+
+def _run_write_block(xl, table):
+    xl.write_block('A1', table)
+
+
+def _run_read_block(xl, table):
+    xl.read_block(((1, 1), (COLUMNS, len(table))))
+
+
+def _run_style_block(xl, table):
+    xl.style_block(((1, 1), (COLUMNS, len(table))),
+                   font=xlutils.FONT_BOLD, align=xlutils.ALIGN_CENTER,
+                   fill=xlutils.FILL_GREY)
+
+
+def _run_autosize(xl, table):
+    for column in range(1, COLUMNS + 1):
+        xl.set_column_width(column, auto=True)
+
+
+def _run_save(xl, table):
+    xl.save_workbook()
+
+
+def _run_load(xl, path):
+    xlutils.XLUtil(path, logFile=None, quiet=True).get_active_sheet()
+
+
+CASES = [
+    ('write', _empty, _run_write),
+    ('read', _filled, _run_read),
+    ('write_row', _empty, _run_write_row),
+    ('read_row', _filled, _run_read_row),
+    ('write_column', _empty, _run_write_column),
+    ('read_column', _filled, _run_read_column),
+    ('write_block', _empty, _run_write_block),
+    ('read_block', _filled, _run_read_block),
+    ('style_block', _filled, _run_style_block),
+    ('autosize', _filled, _run_autosize),
+    ('save', _filled, _run_save),
+    ('load', _saved, _run_load),
+]
+
+
+def _repeat(cells):
+    '''Return how many times a case is timed, fewer for larger sizes'''
+    return 5 if cells <= 1000 else 3 if cells <= 100000 else 1
+
+
+def run_case(case, cells, directory, memory=True):
+    '''Time one case and measure its peak memory
+
+    The case is timed a few times (keeping the best) and, if memory is
+    set, run once more under tracemalloc (which slows everything down)
+    for the peak.
+
+    @param case : (name, setup, run) from CASES
+    @param cells : number of cells the case works on
+    @param directory : scratch directory for the workbooks
+    @param memory : also measure the peak memory
+    @return {'seconds', 'cells_per_second', 'peak_mb'}
+    '''
+    name, setup, run = case
+    rows = cells // COLUMNS
+    path = os.path.join(directory, '{0}_{1}.xlsx'.format(name, cells))
+
+    seconds = None
+    for i in range(_repeat(cells)):
+        xl = xlutils.XLUtil(path, logFile=None, quiet=True)
+        arg = setup(xl, rows, path)
+        gc.collect()
+        start = _clock()
+        run(xl, arg)
+        elapsed = _clock() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        del xl, arg
+        if os.path.isfile(path):
+            os.remove(path)
+
+    peak = None
+    if memory and tracemalloc is not None:
+        path = path[:-5] + '_mem.xlsx'
+        xl = xlutils.XLUtil(path, logFile=None, quiet=True)
+        arg = setup(xl, rows, path)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run(xl, arg)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+        del xl, arg
+    return {'seconds': round(seconds, 4),
+            'cells_per_second': int(cells / seconds) if seconds else None,
+            'peak_mb': None if peak is None else round(peak, 2)}
+
+
+def run_startup(repeat=5):
+    '''Time importing xlutils in a fresh interpreter, keeping the best
+
+    @param repeat : number of interpreters started
+    @return {'seconds', 'cells_per_second', 'peak_mb'} as run_case
+    '''
+    code = ('import time\n'
+            'clock = getattr(time, "perf_counter", time.time)\n'
+            'start = clock()\n'
+            'import xl.xlutils\n'
+            'print(clock() - start)')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    seconds = min(float(subprocess.check_output([sys.executable, '-c', code],
+                                                cwd=root))
+                  for i in range(repeat))
+    return {'seconds': round(seconds, 4), 'cells_per_second': None,
+            'peak_mb': None}
+
+
+def run(sizes, memory=True, cases=CASES):
+    '''Time the startup then run every case at each size
+
+    @param sizes : list of keys of SIZES
+    @param memory : also measure the peak memory
+    @return {STARTUP: {'import': result}, size: {case name: result}}
+    '''
+    directory = tempfile.mkdtemp(prefix='benchXL')
+    results = {STARTUP: {'import': run_startup()}}
+    report_line(STARTUP, 'import', results[STARTUP]['import'])
+    try:
+        for size in sizes:
+            results[size] = {}
+            for case in cases:
+                results[size][case[0]] = run_case(case, SIZES[size],
+                                                  directory, memory)
+                report_line(size, case[0], results[size][case[0]])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def report_line(size, name, result, base=None):
+    '''Print one result, with its ratio to the baseline if given'''
+    line = '{0:>7} {1:<13} {2:>9.3f}s {3:>12} cells/s'.format(
+        size, name, result['seconds'], result['cells_per_second'] or '-')
+    if result['peak_mb'] is not None:
+        line += ' {0:>9.1f}MB'.format(result['peak_mb'])
+    if base and base['seconds']:
+        line += '  x{0:.2f}'.format(result['seconds'] / base['seconds'])
+    print(line)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    '''Return the (size, case, ratio) of every case slower than baseline
+
+    @param results : output of run
+    @param baseline : stored output of an earlier run
+    @param tolerance : time ratio above which a case has regressed
+    '''
+    slower = []
+    for size in sorted(results, key=lambda size: SIZES.get(size, 0)):
+        for name, result in sorted(results[size].items()):
+            base = baseline.get(size, {}).get(name)
+            if not base or base['seconds'] < MIN_SECONDS:
+                continue
+            ratio = result['seconds'] / base['seconds']
+            if ratio > tolerance:
+                slower.append((size, name, ratio))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark xlutils')
+    parser.add_argument('--sizes', default='1k,100k,1M',
+                        help='comma separated sizes out of 1k,100k,1M')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline json file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='slowdown factor reported as a regression')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the (slow) peak memory runs')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error('Unknown size {0}'.format(size))
+    results = run(sizes, memory=not args.no_memory)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as fh:
+                baseline = json.load(fh)
+        baseline.update(results)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True)
+        print('Saved baseline {0}'.format(args.baseline))
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print('No baseline {0} to compare with'.format(args.baseline))
+        return 0
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    print('\nCompared with {0}'.format(args.baseline))
+    for size in [STARTUP] + sizes:
+        for name, result in sorted(results[size].items()):
+            report_line(size, name, result, baseline.get(size, {}).get(name))
+    slower = compare(results, baseline, args.tolerance)
+    for size, name, ratio in slower:
+        print('REGRESSION {0} {1}: {2:.2f}x slower'.format(size, name, ratio))
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,101 +1,1008 @@
 """
 Test xlutils
+
+    python -m pytest xl/tests/testXL.py
+    python -m unittest xl.tests.testXL
 """
+import array
+import os
+import shutil
+import subprocess
 import sys
-sys.path.insert(0, '..')
-
-import xlutils
-
-print("\nTesting of the XLHelper capabilities\n")
-print dir(xlutils)
-print
-
-print "XLUtil Docs"
-print xlutils.XLUtil.__doc__
-
-print "Methods"
-print dir(xlutils.XLUtil)
-print
-
-xl = xlutils.XLUtil("test1")
-print xl.__init__.__doc__
-
-
-print xl.get_sheets.__doc__
-sheets = xl.get_sheets()
-print(sheets)
-
-
-active = xl.get_active_sheet()
-print(active)
-
-
-newSheet = "New Sheet"
-
-
-xl.make_sheet(newSheet)
-print(xl.get_sheets())
-
-
-xl.select_sheet(newSheet)
-print(xl.get_active_sheet())
-
-
-xl.remove_sheet(newSheet)
-print(xl.get_sheets())
-
-
-sheet = xl.get_sheets()[0]
-xl.select_sheet(sheet)
-
-
-print(xl.get_coord('A1'))
-print(xl.get_coord('AA12'))
-
-
-print(xl.make_coord(1, 1))
-print(xl.make_coord(27, 12))
-
-
-print(xl.get_span('A1:b2'))
-print(xl.make_span([1, 1], [2, 2]))
-
-
-xl.write("a1", "Testing")
-print(xl.read('a1'))
-
-
-xl.write_row('a2', ['A', 'B', 'C'])
-print(xl.read_row('a2', 3))
-
-
-xl.write_column('a3', ['X', 'Y', 'Z'])
-print(xl.read_column('a3', 3))
-
-
-xl.write_block('a10', [ ['ACDC', 'BTO'],
-                        ['Align Tech', 'Boeing', 'Citigroup'],
-                        ['Audi', 'Buick']])
-print(xl.read_block('a10:c12'))
-
-
-xl.style('a1', font=xlutils.FONT_BOLD, align=xlutils.ALIGN_CENTER,
-         fill=xlutils.FILL_GREY)
-
-
-
-xl.write_row('c4', ['ALPHA', 'BETA', 'GAMMA'])
-xl.style_block('c4:e4', font=xlutils.FONT_BOLD,
-             align=xlutils.ALIGN_CENTER, fill=xlutils.FILL_GREY)
-
-xl.write_column('g3', ['CHI', 'PSI', 'OMEGA'])
-xl.style_block('g3:g5', font=xlutils.FONT_BOLD,
-             align=xlutils.ALIGN_CENTER, fill=xlutils.FILL_GREY)
-
-xl.freeze('b2')
-
-xl.set_column_width(1, auto=True)
-xl.set_column_width(2, w=25)
+import tempfile
+import unittest
 
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
-print xl.save_workbook()
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+import openpyxl
+
+from xl import archive, xlutils
+from xl.batch import XLBatch
+from xl.shard import XLShards
+
+
+def build_shard(xl, rows, bold=False, highlight=None):
+    """Sheet builder for TestShards, module level so it can be pickled"""
+    xl.write_row('A1', ['name', 'value'])
+    if bold:
+        xl.style_block('A1:B1', font=xlutils.FONT_BOLD)
+    if highlight:
+        from openpyxl.formatting.rule import CellIsRule
+        from openpyxl.styles import PatternFill
+        xl.get_active_sheet().conditional_formatting.add(
+            'B2:B100', CellIsRule(operator='greaterThan', formula=['1'],
+                                  fill=PatternFill(bgColor=highlight)))
+    for i in range(rows):
+        xl.append_row(['row{0}'.format(i), i])
+    return rows
+
+
+def batch_job(xl, value):
+    """Job for TestBatch, module level so it can be pickled"""
+    if value is None:
+        raise ValueError('no value')
+    xl.write('A1', value)
+    return value * 2
+
+
+class XLTestCase(unittest.TestCase):
+    '''Gives every test a scratch directory and a new workbook in it'''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='testXL')
+        self.path = os.path.join(self.dir, 'test1.xlsx')
+        self.xl = xlutils.XLUtil(self.path, logFile=None)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def reopen(self, mode=xlutils.NORMAL):
+        """Save the workbook and open it again"""
+        self.xl.save_workbook()
+        return xlutils.XLUtil(self.path, logFile=None, mode=mode)
+
+
+class TestSheets(XLTestCase):
+
+    def test_sheets(self):
+        xl = self.xl
+        self.assertEqual(xl.get_sheets(), ['Sheet'])
+        self.assertEqual(xl.get_active_sheet().title, 'Sheet')
+
+        xl.make_sheet('New Sheet')
+        self.assertEqual(xl.get_sheets(), ['New Sheet', 'Sheet'])
+        xl.select_sheet('New Sheet')
+        self.assertEqual(xl.get_active_sheet().title, 'New Sheet')
+        xl.remove_sheet('New Sheet')
+        self.assertEqual(xl.get_sheets(), ['Sheet'])
+
+        xl.select_sheet('Made')
+        self.assertEqual(xl.get_active_sheet().title, 'Made')
+        xl.rename_sheet('Renamed')
+        self.assertIn('Renamed', xl.get_sheets())
+
+
+    def test_lazy_load(self):
+        for name in ('One', 'Two', 'Three'):
+            self.xl.select_sheet(name)
+            self.xl.write('A1', name)
+        xl = self.reopen()
+        self.assertEqual(xl.get_sheets(), ['Three', 'Two', 'One', 'Sheet'])
+        self.assertNotIn('workbook', xl.__dict__)
+        xl.select_sheet('Two')
+        self.assertEqual(xl.read('A1'), 'Two')
+        self.assertEqual(len(xl._reader.pending), 3)
+
+        xl.write('B1', 'more')
+        xl.save_workbook()
+        xl = xlutils.XLUtil(self.path, logFile=None)
+        xl.select_sheet('One')
+        self.assertEqual(xl.read('A1'), 'One')
+        xl.select_sheet('Two')
+        self.assertEqual(xl.read_row('A1', 2), ['Two', 'more'])
+
+
+    def test_partial_save(self):
+        for name in ('One', 'Two', 'Three'):
+            self.xl.select_sheet(name)
+            self.xl.write_row('A1', [name, 1])
+        xl = self.reopen()
+        xl.select_sheet('Two')
+        xl.write('B1', 2)
+        xl.save_workbook()
+        self.assertEqual(sorted(ws.title for ws in xl._raw),
+                         ['One', 'Sheet', 'Three'])
+
+        xl.select_sheet('One')
+        xl.write('C1', 'c')
+        xl.save_workbook()
+        # Two stays parsed, so it is written again
+        self.assertEqual(sorted(ws.title for ws in xl._raw),
+                         ['Sheet', 'Three'])
+        xl = xlutils.XLUtil(self.path, logFile=None)
+        for name, row in (('One', ['One', 1, 'c']), ('Two', ['Two', 2, None]),
+                          ('Three', ['Three', 1, None])):
+            xl.select_sheet(name)
+            self.assertEqual(xl.read_row('A1', 3), row)
+
+
+    def test_partial_save_direct_edits(self):
+        for name in ('One', 'Two', 'Three'):
+            self.xl.select_sheet(name)
+            self.xl.write('A1', name)
+        xl = self.reopen()
+        xl.select_sheet('One')
+        self.assertEqual(xl.read('A1'), 'One')
+        xl.worksheet['B1'] = 'direct'
+        # Two and Three are unparsed, the edits must survive their parsing
+        xl.workbook['Two']['B1'] = 'by name'
+        xl.workbook['Three']['A1'] = 'over'
+        self.assertEqual(xl.workbook['Sheet']['A1'].value, None)
+        xl.save_workbook()
+        self.assertEqual([ws.title for ws in xl._raw], ['Sheet'])
+        xl = xlutils.XLUtil(self.path, logFile=None)
+        for name, row in (('One', ['One', 'direct']),
+                          ('Two', ['Two', 'by name']),
+                          ('Three', ['over', None])):
+            xl.select_sheet(name)
+            self.assertEqual(xl.read_row('A1', 2), row)
+
+
+    def test_save_async(self):
+        xl = self.xl
+        xl.write_row('A1', ['saved', 1])
+        future = xl.save_workbook_async()
+        # changes after the call are not in the save
+        xl.write_row('A1', ['later', 2])
+        self.assertEqual(future.result(timeout=30), self.path)
+        saved = xlutils.XLUtil(self.path, logFile=None)
+        self.assertEqual(saved.read_row('A1', 2), ['saved', 1])
+        self.assertEqual(xl.read_row('A1', 2), ['later', 2])
+
+        stream = xlutils.XLUtil(os.path.join(self.dir, 'stream.xlsx'),
+                                logFile=None, mode=xlutils.STREAM)
+        stream.write_row('A1', [1, 2])
+        path = stream.save_workbook_async().result(timeout=30)
+        self.assertEqual(xlutils.XLUtil(path, logFile=None).read('B1'), 2)
+
+
+    def test_save_async_replacing(self):
+        for name in ('One', 'Two'):
+            self.xl.select_sheet(name)
+            self.xl.write('A1', name)
+        xl = self.reopen()
+        xl.select_sheet('One')
+        xl.write('B1', 'changed')
+        future = xl.save_workbook_async()
+        xl.write('C1', 'later')
+        future.result(timeout=30)
+        # the untouched sheet was read before its file was replaced
+        xl.select_sheet('Two')
+        self.assertEqual(xl.read('A1'), 'Two')
+
+        saved = xlutils.XLUtil(self.path, logFile=None)
+        saved.select_sheet('One')
+        self.assertEqual(saved.read_row('A1', 3), ['One', 'changed', None])
+        saved.select_sheet('Two')
+        self.assertEqual(saved.read('A1'), 'Two')
+        xl.save_workbook()
+        saved = xlutils.XLUtil(self.path, logFile=None)
+        saved.select_sheet('One')
+        self.assertEqual(saved.read('C1'), 'later')
+
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'no asyncio before 3.4')
+    def test_save_aio(self):
+        import asyncio
+        self.xl.write('A1', 'aio')
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            saved = loop.run_until_complete(self.xl.save_workbook_aio())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(saved, self.path)
+        xl = xlutils.XLUtil(self.path, logFile=None)
+        self.assertEqual(xl.read('A1'), 'aio')
+
+
+    def test_copy_sheet(self):
+        template = xlutils.XLUtil(os.path.join(self.dir, 'template.xlsx'),
+                                  logFile=None)
+        template.rename_sheet('Template')
+        template.write_row('A1', ['Name', 'Amount'])
+        template.style_block('A1:B1', font=xlutils.FONT_BOLD,
+                             fill=xlutils.FILL_GREY, num='0.00%')
+        template.merge('A3:B4')
+        template.set_column_width(2, 25)
+
+        xl = self.xl
+        xl.style('A1', align=xlutils.ALIGN_CENTER)
+        xl.copy_sheet('Template', 'One', source=template)
+        xl.copy_sheet('Template', 'Two', source=template)
+        xl.copy_sheet('One', 'Three')
+        self.assertRaises(ValueError, xl.copy_sheet, 'One', 'Two')
+        xl = self.reopen()
+        for name in ('One', 'Two', 'Three'):
+            xl.select_sheet(name)
+            ws = xl.get_active_sheet()
+            self.assertEqual(xl.read_row('A1', 2), ['Name', 'Amount'])
+            self.assertTrue(ws['B1'].font.bold)
+            self.assertEqual(ws['B1'].fill.fgColor.rgb, '00DDDDDD')
+            self.assertEqual(ws['B1'].number_format, '0.00%')
+            self.assertEqual([str(cr) for cr in ws.merged_cells.ranges],
+                             ['A3:B4'])
+            self.assertEqual(ws.column_dimensions['B'].width, 25)
+        xl.select_sheet('Sheet')
+        self.assertEqual(xl.get_active_sheet()['A1'].alignment.horizontal,
+                         'center')
+
+
+    def test_compression(self):
+        for i in range(1, 301):
+            self.xl.write_row((1, i), [i, 'row{0}'.format(i)])
+        for compression, method in (('stored', ZIP_STORED),
+                                    ('fast', ZIP_DEFLATED),
+                                    ('max', ZIP_DEFLATED)):
+            self.xl.save_workbook(compression=compression)
+            with ZipFile(self.path) as package:
+                info = package.getinfo('xl/worksheets/sheet1.xml')
+                self.assertEqual(info.compress_type, method)
+            xl = xlutils.XLUtil(self.path, logFile=None)
+            self.assertEqual(xl.read_row('A300', 2), [300, 'row300'])
+        self.assertRaises(ValueError, self.xl.save_workbook,
+                          compression='zip')
+
+        # a part deflated in pieces on threads is one deflate stream
+        data = b''.join(b'<c r="A' + str(i).encode('ascii') + b'"/>'
+                        for i in range(20000))
+        sizes = archive._PARALLEL_SIZE, archive._PIECE
+        versions = archive._RAW_VERSIONS
+        archive._PARALLEL_SIZE, archive._PIECE = 1000, 40000
+        try:
+            # on a python it wasn't checked against zipfile writes it all
+            for checked in (versions, ((2, 0), (2, 7))):
+                archive._RAW_VERSIONS, archive._RAW_WRITES = checked, None
+                with archive.XLArchive(self.path, 'max',
+                                       threads=3) as package:
+                    package.writestr('part.xml', data)
+                    self.assertEqual(archive._RAW_WRITES,
+                                     checked is versions and
+                                     sys.version_info[:2] <= versions[1])
+                with ZipFile(self.path) as package:
+                    self.assertIsNone(package.testzip())
+                    self.assertEqual(package.getinfo('part.xml').compress_type,
+                                     ZIP_DEFLATED)
+                    self.assertEqual(package.read('part.xml'), data)
+        finally:
+            archive._PARALLEL_SIZE, archive._PIECE = sizes
+            archive._RAW_VERSIONS, archive._RAW_WRITES = versions, None
+
+
+class TestCoords(XLTestCase):
+
+    def test_coords(self):
+        xl = self.xl
+        self.assertEqual(xl.get_coord('A1'), [1, 1])
+        self.assertEqual(xl.get_coord('AA12'), [27, 12])
+        self.assertEqual(xl.get_coord((3, 4)), [3, 4])
+        self.assertEqual(xl.make_coord(1, 1), 'A1')
+        self.assertEqual(xl.make_coord(27, 12), 'AA12')
+        self.assertEqual(xl.get_span('A1:b2'), ([1, 1], [2, 2]))
+        self.assertEqual(xl.make_span([1, 1], [2, 2]), 'A1:B2')
+        self.assertRaises(ValueError, xl.get_coord, '1A')
+
+
+    def test_column_letters(self):
+        for column in (1, 26, 27, 702, 703, xlutils.MAX_COLUMN):
+            letters = xlutils.column_letter(column)
+            self.assertEqual(xlutils.column_index(letters), column)
+        self.assertEqual(xlutils.column_letter(xlutils.MAX_COLUMN), 'XFD')
+        self.assertRaises(ValueError, xlutils.column_letter, 16385)
+        self.assertRaises(ValueError, xlutils.column_index, 'XFE')
+        self.assertRaises(ValueError, xlutils.parse_coord, 'A1048577')
+        self.assertRaises(ValueError, xlutils.parse_coord, 'A0')
+
+
+class TestValues(XLTestCase):
+
+    def test_write_read(self):
+        xl = self.xl
+        xl.write('a1', 'Testing')
+        self.assertEqual(xl.read('a1'), 'Testing')
+        self.assertEqual(xl.read('z99'), None)
+
+        xl.write_row('a2', ['A', 'B', 'C'])
+        self.assertEqual(xl.read_row('a2', 3), ['A', 'B', 'C'])
+
+        xl.write_column('a3', ['X', 'Y', 'Z'])
+        self.assertEqual(xl.read_column('a3', 3), ['X', 'Y', 'Z'])
+
+        xl.write_block('a10', [['ACDC', 'BTO'],
+                               ['Align Tech', 'Boeing', 'Citigroup'],
+                               ['Audi', 'Buick']])
+        self.assertEqual(xl.read_block('a10:c12'),
+                         [['ACDC', 'BTO', None],
+                          ['Align Tech', 'Boeing', 'Citigroup'],
+                          ['Audi', 'Buick', None]])
+
+
+    def test_append_and_iterate(self):
+        xl = self.xl
+        for i in range(5):
+            xl.append_row([i, i * 2])
+        self.assertEqual(list(xl.iter_rows('A4:B5')), [(3, 6), (4, 8)])
+        blocks = list(xl.iter_block(chunk_size=2))
+        self.assertEqual([len(block) for block in blocks], [2, 2, 1])
+
+
+    def test_lookups(self):
+        xl = self.xl
+        xl.write_block('A1', [['id', 'name'], [10, 'ten'], [20, 'twenty']])
+        self.assertEqual(xl.build_index('A'), {'id': [1], 10: [2], 20: [3]})
+        self.assertEqual(xl.vlookup(20, 'A', 2), 'twenty')
+        self.assertIsNone(xl.vlookup(30, 1, 'B'))
+
+        xl.write('A2', 30)
+        xl.append_row([10, 'ten again'])
+        xl.write_column('A5', [20])
+        self.assertEqual(xl.find(10), [4])
+        self.assertEqual(xl.find(20), [3, 5])
+        self.assertEqual(xl.vlookup(30, 'A', 'B'), 'ten')
+
+        xl.select_sheet('Other')
+        self.assertEqual(xl.vlookup('id', 'A', 'B', sheet='Sheet'), 'name')
+        self.assertEqual(xl.find(10, 'A'), [])
+
+
+    def test_saved_values(self):
+        self.xl.write_block('B2', [[1, 2.5], ['x', None]])
+        xl = self.reopen()
+        self.assertEqual(xl.read_block('B2:C3'), [[1, 2.5], ['x', None]])
+
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_arrays(self):
+        xl = self.xl
+        xl.write_block('A1', numpy.arange(6, dtype='int32').reshape(3, 2))
+        xl.write_block('C1', numpy.array([[1.5, numpy.nan],
+                                          [numpy.inf, -numpy.inf],
+                                          [0.25, 2.0]]))
+        xl.write_block('E1', numpy.array([[True], [False], [True]]))
+        buffer = memoryview(array.array('d', [1.0, 2.0, 3.0, float('inf')]))
+        xl.write_block('F1', buffer.cast('B').cast('d', [2, 2]))
+        xl = self.reopen()
+
+        ints = xl.read_block_array('A1:B3')
+        self.assertEqual(ints.dtype, numpy.int64)
+        self.assertEqual(ints.shape, (3, 2))
+        self.assertEqual(ints.tolist(), [[0, 1], [2, 3], [4, 5]])
+        # NaN is an empty cell, inf is text as in import_csv
+        self.assertEqual(xl.read_block('C1:D2'),
+                         [[1.5, None], ['inf', '-inf']])
+        floats = xl.read_block_array('C1:D1')
+        self.assertEqual(floats.dtype, numpy.float64)
+        self.assertEqual(floats[0, 0], 1.5)
+        self.assertTrue(numpy.isnan(floats[0, 1]))
+        self.assertEqual(xl.read_block_array('C3:D3').tolist(), [[0.25, 2]])
+        bools = xl.read_block_array('E1:E3')
+        self.assertEqual((bools.dtype, bools.shape), (numpy.bool_, (3, 1)))
+        self.assertEqual(xl.read_block('F1:G2'), [[1, 2], [3, 'inf']])
+        self.assertRaises(ValueError, xl.write_block, 'A1', numpy.zeros(3))
+
+
+    def test_stream_and_read_modes(self):
+        stream = xlutils.XLUtil(self.path, logFile=None,
+                                mode=xlutils.STREAM)
+        stream.freeze('A2')
+        stream.set_column_width(2, 20)
+        for i in range(1, 101):
+            stream.write_row((1, i), [i, 'row{0}'.format(i)])
+        self.assertRaises(TypeError, stream.read, 'A1')
+        self.assertRaises(ValueError, stream.freeze, 'B2')
+        self.assertRaises(ValueError, stream.set_column_width, 1, 20)
+        stream.save_workbook()
+
+        xl = xlutils.XLUtil(self.path, logFile=None, mode=xlutils.READ)
+        self.assertEqual(xl.read_row('A100', 2), [100, 'row100'])
+        xl.close_workbook()
+        ws = openpyxl.load_workbook(self.path).active
+        self.assertEqual(ws.freeze_panes, 'A2')
+        self.assertEqual(ws.column_dimensions['B'].width, 20)
+
+        xl = xlutils.XLUtil(self.path, logFile=None, mode=xlutils.READ)
+        self.assertRaises(TypeError, xl.write, 'A1', 1)
+        xl.close_workbook()
+
+
+class TestFormatting(XLTestCase):
+
+    def test_styles(self):
+        xl = self.xl
+        xl.write_row('c4', ['ALPHA', 'BETA', 'GAMMA'])
+        xl.style('a1', font=xlutils.FONT_BOLD, align=xlutils.ALIGN_CENTER,
+                 fill=xlutils.FILL_GREY)
+        xl.style_block('c4:e4', font=xlutils.FONT_BOLD,
+                       align=xlutils.ALIGN_CENTER, fill=xlutils.FILL_GREY)
+        ws = xl.get_active_sheet()
+        for coord in ('A1', 'C4', 'E4'):
+            self.assertTrue(ws[coord].font.b)
+            self.assertEqual(ws[coord].alignment.horizontal, 'center')
+            self.assertEqual(ws[coord].fill, xlutils.FILL_GREY)
+        self.assertFalse(ws['F4'].font.b)
+
+
+    def test_freeze_and_widths(self):
+        xl = self.xl
+        xl.write_column('a1', ['short', 'a much longer value'])
+        xl.freeze('b2')
+        xl.set_column_width(1, auto=True)
+        xl.set_column_width(2, w=25)
+        ws = self.reopen().get_active_sheet()
+        self.assertEqual(ws.freeze_panes, 'B2')
+        self.assertAlmostEqual(ws.column_dimensions['A'].width,
+                               (len('a much longer value') + 2) * 1.1)
+        self.assertEqual(ws.column_dimensions['B'].width, 25)
+
+
+    def test_row_and_column_styles(self):
+        xl = self.xl
+        xl.write('A1', 'x')
+        xl.style_row(2, font=xlutils.FONT_BOLD, fill=xlutils.FILL_GREY)
+        xl.style_column('C', align=xlutils.ALIGN_CENTER)
+        xl.style_column(4, num='0.00')
+        ws = self.reopen().get_active_sheet()
+        row = ws.row_dimensions[2]
+        self.assertTrue(row.font.b)
+        self.assertEqual(row.fill, xlutils.FILL_GREY)
+        self.assertEqual(ws.column_dimensions['C'].alignment.horizontal,
+                         'center')
+        self.assertFalse(ws.column_dimensions['C'].font.b)
+        self.assertEqual(ws.column_dimensions['D'].number_format, '0.00')
+        self.assertFalse(ws.row_dimensions[3].font.b)
+
+
+    def test_autosize_all(self):
+        xl = self.xl
+        xl.write_row('A1', ['id', 'a longer heading', 12345678])
+        xl.write_column('A2', ['x' * 80, 7])
+        xl.autosize_all()
+        ws = xl.get_active_sheet()
+        widths = [ws.column_dimensions[letter].width for letter in 'ABC']
+        self.assertEqual(widths, [(50 + 2) * 1.1, (16 + 2) * 1.1,
+                                  (8 + 2) * 1.1])
+
+        # a loaded sheet is measured from its cells
+        xl = self.reopen()
+        xl.write('B3', 'the longest value in B')
+        xl.autosize_all()
+        xl.save_workbook()
+        ws = openpyxl.load_workbook(self.path).active
+        self.assertAlmostEqual(ws.column_dimensions['A'].width, 52 * 1.1)
+        self.assertAlmostEqual(ws.column_dimensions['B'].width, 24 * 1.1)
+        self.assertAlmostEqual(ws.column_dimensions['C'].width, 10 * 1.1)
+
+
+    def test_autosize_shrinks(self):
+        for xl in (self.xl, xlutils.XLUtil(self.path, logFile=None,
+                                           compact=True)):
+            xl.write_row('A1', ['x' * 20, 'b', 'z' * 20])
+            xl.write('B2', 'y' * 20)
+            xl.write_block('A2', numpy.array([[123456789.0]])
+                           if numpy is not None else [[123456789.0]])
+            xl.autosize_all()
+            # overwritten by shorter values and cleared by a merge
+            xl.write('A1', 'short')
+            xl.write('A2', 1)
+            xl.merge('B1:B2')
+            xl.write_row('C1', [1.5])
+            xl.autosize_all()
+            ws = xl.get_active_sheet()
+            widths = [ws.column_dimensions[letter].width
+                      for letter in 'ABC']
+            self.assertEqual(widths, [(5 + 2) * 1.1, (1 + 2) * 1.1,
+                                      (3 + 2) * 1.1])
+            xl.write('A1', None)
+            xl.set_column_width(1, auto=True)
+            self.assertEqual(ws.column_dimensions['A'].width, (1 + 2) * 1.1)
+
+
+    def test_merge(self):
+        xl = self.xl
+        xl.merge('A1:B2')
+        self.assertEqual([str(r) for r in
+                          xl.get_active_sheet().merged_cells.ranges],
+                         ['A1:B2'])
+        xl.unmerge('A1:B2')
+        self.assertEqual(len(xl.get_active_sheet().merged_cells.ranges), 0)
+
+
+    def test_merge_many(self):
+        xl = self.xl
+        xl.write('C3', 'kept')
+        xl.merge_many([((c, r), (c + 1, r)) for r in range(1, 101)
+                       for c in range(3, 40, 2)])
+        xl.merge('C3:D3')
+        self.assertEqual(xl.merged_range_at('D3'), 'C3:D3')
+        self.assertEqual(xl.merged_range_at('AN100'), 'AM100:AN100')
+        self.assertIsNone(xl.merged_range_at('B3'))
+        self.assertRaises(ValueError, xl.merge, 'B2:C3')
+        self.assertRaises(ValueError, xl.unmerge, 'C3:C4')
+        xl.unmerge('E7:F7')
+        self.assertIsNone(xl.merged_range_at('E7'))
+
+        ws = self.reopen().get_active_sheet()
+        self.assertEqual(len(ws.merged_cells.ranges), 100 * 19 - 1)
+        self.assertEqual(ws['C3'].value, 'kept')
+
+
+class TestTables(XLTestCase):
+
+    def test_tables(self):
+        xl = self.xl
+        xl.write_table('B2', [['a', 'b'], [1, 2]], 'Sales')
+        xl.append_table_row([3, 4], 'Sales')
+        xl.append_table_rows([[5, 6], [7, 8]], 'Sales')
+        self.assertTrue(xl.is_table_exists('Sales'))
+        self.assertFalse(xl.is_table_exists('Missing'))
+        self.assertEqual(xl.get_table_span('Sales'), 'B2:C6')
+        self.assertRaises(ValueError, xl.append_table_row, [1], 'Missing')
+
+        xl = self.reopen()
+        self.assertEqual(xl.get_table_span('Sales'), 'B2:C6')
+        xl.append_table_row([9, 10], 'Sales')
+        self.assertEqual(xl.get_table_span('Sales'), 'B2:C7')
+        self.assertEqual(xl.read_row('B7', 2), [9, 10])
+
+
+    def test_format_table(self):
+        xl = self.xl
+        rows = [['name', 'qty']] + [['x', i] for i in range(100)]
+        xl.write_table('A1', rows, 'Stock')
+        xl.format_table('Stock')
+        xl.append_table_rows([['y', 100]], 'Stock')
+        ws = xl.get_active_sheet()
+        self.assertTrue(ws['A1'].font.b)
+        self.assertEqual(ws['B1'].alignment.horizontal, 'center')
+        self.assertFalse(ws['A2'].has_style)
+        self.assertRaises(ValueError, xl.format_table, 'Missing')
+
+        table = self.reopen().get_active_sheet().tables['Stock']
+        self.assertEqual(table.ref, 'A1:B102')
+        self.assertEqual(table.tableStyleInfo.name, xlutils.TABLE_STYLE)
+        self.assertTrue(table.tableStyleInfo.showRowStripes)
+
+
+class TestCSV(XLTestCase):
+
+    def write_csv(self, text):
+        path = os.path.join(self.dir, 'in.csv')
+        with open(path, 'w') as fh:
+            fh.write(text)
+        return path
+
+
+    def test_import(self):
+        path = self.write_csv('id,name,amount\n1,a,2.5\n2,,nan\n3,"c,d",7\n')
+        xl = self.xl
+        self.assertEqual(xl.import_csv(path, start='B2', chunk_rows=2,
+                                       header=True), 4)
+        self.assertEqual(xl.read_block('B2:D5'),
+                         [['id', 'name', 'amount'], [1, 'a', 2.5],
+                          [2, None, 'nan'], [3, 'c,d', 7]])
+        for field, value in (('-12', -12), ('+1.5e3', 1500.0), ('.5', 0.5),
+                             ('1_000', '1_000'), (' 12 ', ' 12 '),
+                             ('12\n', '12\n'), ('1e999', '1e999'),
+                             ('inf', 'inf'), ('0x10', '0x10')):
+            self.assertEqual(xlutils._coerce_value(field), value)
+
+        xl.import_csv(path, start='F1', coerce=False)
+        self.assertEqual(xl.read_row('F3', 3), ['2', '', 'nan'])
+        xl.import_csv(path, start='J1', coerce=[None, str.upper], header=True)
+        self.assertEqual(xl.read_row('J2', 3), ['1', 'A', '2.5'])
+
+
+    def test_stream_round_trip(self):
+        path = self.write_csv(''.join('{0},row {0}\n'.format(i)
+                                      for i in range(50)))
+        stream = xlutils.XLUtil(self.path, logFile=None,
+                                mode=xlutils.STREAM)
+        self.assertEqual(stream.import_csv(path, chunk_rows=8), 50)
+        stream.save_workbook()
+
+        xl = xlutils.XLUtil(self.path, logFile=None, mode=xlutils.READ)
+        out = os.path.join(self.dir, 'out.csv')
+        self.assertEqual(xl.export_csv(out, chunk_rows=8), 50)
+        xl.close_workbook()
+        with open(out) as fh:
+            self.assertEqual(fh.read().splitlines()[49], '49,row 49')
+
+
+@unittest.skipIf(pandas is None, 'pandas is not installed')
+class TestFrames(XLTestCase):
+
+    def test_round_trip(self):
+        df = pandas.DataFrame({
+            'id': [1, 2, 3],
+            'amount': [2.5, None, 7.0],
+            'when': pandas.to_datetime(['2026-01-02', None, '2026-03-04']),
+            'name': ['a', None, 'c']})
+        xl = self.xl
+        self.assertEqual(xl.from_dataframe(df, start='B2', index=True,
+                                           chunk_rows=2), 4)
+        self.assertEqual(xl.read_row('B2', 5),
+                         ['index', 'id', 'amount', 'when', 'name'])
+        self.assertEqual(xl.read_row('B4', 5), [1, 2, None, None, None])
+        self.assertTrue(xl.worksheet['C2'].font.bold)
+
+        back = xl.to_dataframe('C2:F5')
+        self.assertEqual(list(back.columns), list(df.columns))
+        self.assertEqual([dtype.kind for dtype in back.dtypes[:3]],
+                         ['i', 'f', 'M'])
+        self.assertEqual(back['when'].iloc[2], df['when'].iloc[2])
+        self.assertTrue(back['amount'].isna().iloc[1])
+        self.assertEqual([len(chunk) for chunk in
+                          xl.to_dataframe('C2:F5', chunksize=2)], [2, 1])
+        self.assertEqual(list(xl.to_dataframe('C3:D5', header=False).columns),
+                         ['C', 'D'])
+
+
+    def test_non_finite(self):
+        df = pandas.DataFrame({
+            'a': [1.5, float('inf'), float('nan'), -float('inf')],
+            'b': pandas.array([1.0, None, 2.0, 3.0], dtype='Float64'),
+            'c': [1, 2, 3, 4]})
+        xl = self.xl
+        # the first chunk is finite numbers, the others are not
+        self.assertEqual(xl.from_dataframe(df, chunk_rows=1), 5)
+        xl = self.reopen()
+        self.assertEqual(xl.read_block('A2:C5'),
+                         [[1.5, 1, 1], ['inf', None, 2], [None, 2, 3],
+                          ['-inf', 3, 4]])
+        back = xl.to_dataframe('A1:C5')
+        self.assertEqual(back['a'].tolist()[::3], [1.5, '-inf'])
+        self.assertTrue(back['b'].isna().iloc[1])
+        self.assertEqual(back['c'].dtype.kind, 'i')
+
+
+class TestStorage(XLTestCase):
+
+    def test_spill(self):
+        xl = xlutils.XLUtil(self.path, logFile=None, memory_budget=20)
+        xl.write_block('A1', [[r * 10 + c for c in range(5)]
+                              for r in range(10)])
+        ws = xl.get_active_sheet()
+        self.assertIn(ws, xl._stores)
+        self.assertEqual(len(ws._cells), 0)
+
+        # ints past 64 bits can't go in the file, they stay as cells
+        xl.write_row('F1', [2 ** 70, 1])
+        xl.write('F2', -2 ** 64)
+        self.assertEqual(list(ws._cells), [(1, 6), (2, 6)])
+        self.assertEqual(xl.read_column('F1', 2), [2 ** 70, -2 ** 64])
+        self.assertEqual(xl.read('G1'), 1)
+        big = xlutils.XLUtil(os.path.join(self.dir, 'big.xlsx'),
+                             logFile=None, memory_budget=3)
+        big.write_block('A1', [[1, 2 ** 64], [3, 4]])
+        self.assertEqual(list(big.get_active_sheet()._cells), [(1, 2)])
+        self.assertEqual(big.read_block('A1:B2'), [[1, 2 ** 64], [3, 4]])
+        big.close_workbook()
+
+        xl.write('B2', 'text')
+        xl.style_block('A1:B1', font=xlutils.FONT_BOLD)
+        xl.merge('D4:E5')
+        xl.append_row(['last'])
+        self.assertEqual(xl.read('B2'), 'text')
+        self.assertEqual(xl.read_row('A10', 3), [90, 91, 92])
+        self.assertEqual(xl.read('A11'), 'last')
+        self.assertRaises(TypeError, xl.iter_rows, values_only=False)
+
+        xl.save_workbook()
+        xl.close_workbook()
+        ws = xlutils.XLUtil(self.path, logFile=None).get_active_sheet()
+        self.assertEqual(ws['B2'].value, 'text')
+        self.assertTrue(ws['A1'].font.b)
+        self.assertFalse(ws['A2'].font.b)
+        self.assertEqual(ws['D4'].value, 33)
+        self.assertAlmostEqual(ws['F1'].value / 2 ** 70, 1)
+        self.assertEqual([str(r) for r in ws.merged_cells.ranges],
+                         ['D4:E5'])
+        self.assertEqual(ws.max_row, 11)
+
+
+    @unittest.skipIf(not hasattr(os, 'fork'), 'saves in a thread without fork')
+    def test_spill_save_async(self):
+        xl = xlutils.XLUtil(self.path, logFile=None, memory_budget=20)
+        xl.write_block('A1', [[r * 10 + c for c in range(5)]
+                              for r in range(10)])
+        self.assertIn(xl.get_active_sheet(), xl._stores)
+        future = xl.save_workbook_async()
+        # committed to the spill file while the child saves
+        xl.write('A1', 'later')
+        xl._spill.commit()
+        path = xl._spill.path
+        # closing waits for the save still reading the file
+        xl.close_workbook()
+        self.assertTrue(future.done())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(future.result(), self.path)
+        xl = xlutils.XLUtil(self.path, logFile=None)
+        self.assertEqual(xl.read_row('A1', 2), [0, 1])
+
+
+    def test_compact(self):
+        xl = xlutils.XLUtil(self.path, logFile=None, compact=True,
+                            memory_budget=40)
+        xl.write('A1', 'head')
+        xl.style('A1', font=xlutils.FONT_BOLD)
+        row = [1, 2.5, 'x', True, None, 2 ** 60]
+        xl.write_block('A2', [row] * 5)
+        ws = xl.get_active_sheet()
+        self.assertIsInstance(xl._stores[ws], xlutils.ColumnStore)
+        self.assertEqual(xl.read_row('A2', 6), row)
+        self.assertEqual(xl.read('A1'), 'head')
+
+        xl.write_column('H1', range(10))
+        self.assertNotIsInstance(xl._stores[ws], xlutils.ColumnStore)
+        self.assertEqual(xl.read_row('A6', 6), row)
+        self.assertEqual(xl.read_column('H9', 2), [8, 9])
+
+        xl.save_workbook()
+        ws = xlutils.XLUtil(self.path, logFile=None).get_active_sheet()
+        self.assertEqual(ws['A1'].value, 'head')
+        self.assertTrue(ws['A1'].font.b)
+        self.assertEqual(ws['C6'].value, 'x')
+
+
+class TestFormulas(XLTestCase):
+
+    def test_evaluate(self):
+        xl = self.xl
+        xl.write_block('A1', [[1, 'a'], [2, 'b'], [3, 'c']])
+        xl.write_column('C1', ['=SUM(A1:A3)', '=IF(C1>5,"big","small")',
+                               '=VLOOKUP(2,A1:B3,2,FALSE)', '=A1/0',
+                               '=AVERAGE(A:A)*2^2+-1', '=C6'])
+        xl.make_sheet('Other')
+        xl.select_sheet('Other')
+        xl.write('A1', "='Sheet'!C1*10")
+        self.assertEqual(xl.read('A1'), "='Sheet'!C1*10")
+        self.assertEqual(xl.read('A1', evaluate=True), 60)
+
+        xl.select_sheet('Sheet')
+        self.assertEqual(xl.read_column('C1', 6), [
+            '=SUM(A1:A3)', '=IF(C1>5,"big","small")',
+            '=VLOOKUP(2,A1:B3,2,FALSE)', '=A1/0',
+            '=AVERAGE(A:A)*2^2+-1', '=C6'])
+        self.assertEqual([xl.read((3, row), evaluate=True)
+                          for row in range(1, 7)],
+                         [6, 'big', 'b', '#DIV/0!', 7, '#REF!'])
+
+        # only the formulas downstream of A3 are recalculated
+        xl.write('A3', -10)
+        self.assertEqual(xl.recalculate(), 5)
+        self.assertEqual(xl.read('C2', evaluate=True), 'small')
+        xl.select_sheet('Other')
+        self.assertEqual(xl.read('A1', evaluate=True), -70)
+        self.assertEqual(xl.recalculate(), 0)
+
+
+    def test_range_index(self):
+        xl = self.xl
+        xl.write_column('D1', ['=SUM(A1:A10)+{0}'.format(k)
+                               for k in range(100)])
+        # over a few tiles, a whole column and over many tiles
+        xl.write_column('F1', ['=SUM(A100:C200)', '=SUM(B:B)',
+                               '=SUM(A1:C10000)'])
+        self.assertEqual(xl.recalculate(), 103)
+        for coord, value, count in (('A1', 1, 101), ('B150', 2, 3),
+                                    ('E20000', 3, 0), ('A5000', 4, 1)):
+            xl.write(coord, value)
+            self.assertEqual(xl.recalculate(), count)
+        self.assertEqual(xl.read('D100', evaluate=True), 100)
+        self.assertEqual([xl.read((6, row), evaluate=True)
+                          for row in range(1, 4)], [2, 2, 7])
+
+        # a formula rewritten no longer depends on its old range
+        xl.write('F1', '=SUM(H1:H2)')
+        self.assertEqual(xl.recalculate(), 1)
+        xl.write('A150', 5)
+        self.assertEqual(xl.recalculate(), 1)
+        self.assertEqual(xl.read('F3', evaluate=True), 12)
+
+
+    def test_merge(self):
+        xl = self.xl
+        xl.write_row('A1', [1, 2, '=SUM(A1:B1)', '=B1*10'])
+        self.assertEqual(xl.read('C1', evaluate=True), 3)
+        self.assertEqual(xl.read('D1', evaluate=True), 20)
+        # merging empties B1
+        xl.merge('A1:B1')
+        self.assertEqual(xl.read('C1', evaluate=True), 1)
+        self.assertEqual(xl.read('D1', evaluate=True), 0)
+        xl.unmerge('A1:B1')
+        xl.write('B1', 4)
+        self.assertEqual(xl.read('C1', evaluate=True), 5)
+        self.assertEqual(xl.read('D1', evaluate=True), 40)
+
+
+class TestShards(XLTestCase):
+
+    def test_join(self):
+        shards = XLShards(self.path, [('One', build_shard, {'rows': 5}),
+                                      ('Two', build_shard,
+                                       {'rows': 3, 'bold': True})],
+                          workers=2)
+        results = shards.save_workbook()
+        self.assertEqual([r.value for r in results], [5, 3])
+        self.assertEqual([r.path for r in results], [self.path] * 2)
+        xl = xlutils.XLUtil(self.path, logFile=None)
+        self.assertEqual(xl.get_sheets(), ['One', 'Two'])
+        xl.select_sheet('Two')
+        self.assertEqual(xl.read_row('A4', 2), ['row2', 2])
+        self.assertTrue(xl.get_active_sheet()['A1'].font.b)
+        xl.select_sheet('One')
+        self.assertFalse(xl.get_active_sheet()['A1'].font.b)
+
+        shards = XLShards(self.path, [('Bad', build_shard, {'rows': 'x'})],
+                          workers=1)
+        self.assertRaises(RuntimeError, shards.save_workbook)
+        self.assertEqual([r.path for r in shards.results], [None])
+
+
+    def test_conditional_formats(self):
+        sheets = [(name, build_shard, {'rows': 3, 'highlight': color})
+                  for name, color in (('One', 'FFFF0000'),
+                                      ('Two', 'FF00FF00'),
+                                      ('Three', 'FFFF0000'))]
+        XLShards(self.path, sheets, workers=1).save_workbook()
+        wb = openpyxl.load_workbook(self.path)
+        self.assertEqual(len(wb._differential_styles.styles), 2)
+        for (name, func, kwargs) in sheets:
+            rules = [rule for cf in wb[name].conditional_formatting
+                     for rule in cf.rules]
+            self.assertEqual([rule.dxf.fill.bgColor.rgb for rule in rules],
+                             [kwargs['highlight']])
+
+
+class TestBatch(XLTestCase):
+
+    def run_batch(self, workers):
+        # the same name in two folders gets a log each
+        paths = [os.path.join(self.dir, str(i % 2), 'book.xlsx')
+                 for i in range(4)]
+        paths[2:] = [os.path.join(self.dir, 'book{0}.xlsx'.format(i))
+                     for i in (2, 3)]
+        for folder in ('0', '1'):
+            os.mkdir(os.path.join(self.dir, folder))
+        jobs = [(path, batch_job, {'value': i or None})
+                for i, path in enumerate(paths)]
+        out, sys.stdout = sys.stdout, StringIO()
+        try:
+            batch = XLBatch(jobs, workers=workers, logDir=self.dir)
+            results = batch.run()
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = out
+        self.assertEqual(printed, '')
+        self.assertEqual([r.path for r in results], paths)
+        self.assertEqual([r.value for r in results], [None, 2, 4, 6])
+        self.assertIn('ValueError: no value', results[0].error)
+        self.assertFalse(os.path.exists(paths[0]))
+        for i, result in enumerate(results[1:], 1):
+            self.assertIsNone(result.error)
+            self.assertGreaterEqual(result.seconds, 0)
+            xl = xlutils.XLUtil(result.path, logFile=None)
+            self.assertEqual(xl.read('A1'), i)
+            logFile = os.path.join(self.dir, '{0}.{1}.log'.format(
+                i, os.path.basename(result.path)))
+            self.assertEqual(batch.logFiles[i], logFile)
+            with open(logFile) as fh:
+                self.assertIn('Saving ' + result.path, fh.read())
+        return batch
+
+
+    def test_inline(self):
+        batch = self.run_batch(1)
+        # the log files are closed as each job finishes
+        for logFile in batch.logFiles:
+            self.assertNotIn((os.getpid(), os.path.abspath(logFile)),
+                             xlutils._LOGGERS)
+
+
+    def test_pool(self):
+        self.run_batch(2)
+
+
+class TestInstrumentation(XLTestCase):
+
+    def test_profile(self):
+        xl = self.xl
+        with xl.profile() as prof:
+            xl.write_block('A1', [[1, 2, 3], [4, 5, 6]])
+            xl.read_row('A1', 3)
+            xl.read_row('A2', 3)
+            xl.style_block('A1:C2', font=xlutils.FONT_BOLD)
+        self.assertEqual(prof['write_block']['cells'], 6)
+        self.assertEqual(prof['read_row']['calls'], 2)
+        self.assertEqual(prof['read_row']['cells'], 6)
+        self.assertEqual(prof['style_block']['cells'], 6)
+        self.assertNotIn('write', prof)
+        self.assertNotIn('write_block', xl.__dict__)
+
+        xl.write('A1', 1)
+        self.assertEqual(xl.stats()['read_row']['calls'], 2)
+        self.assertNotIn('write', xl.stats())
+
+
+    def test_stats_and_quiet(self):
+        self.xl.write_block('A1', [[1, 2], [3, 4]])
+        xl = self.reopen()
+        xl.instrument()
+        xl.read('A1')
+        stats = xl.stats()
+        self.assertEqual(stats['load_workbook']['calls'], 1)
+        self.assertEqual(stats['load_sheet']['cells'], 4)
+        xl.reset_stats()
+        self.assertEqual(xl.stats(), {})
+
+        import sys
+        out, sys.stdout = sys.stdout, StringIO()
+        try:
+            xlutils.XLUtil(self.path, logFile=None,
+                           quiet=True).save_workbook()
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = out
+        self.assertEqual(printed, '')
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import(self):
+        # a fresh interpreter, listing the heavy modules each import loads
+        # (the time it takes is in benchXL)
+        code = ('import sys\n'
+                'heavy = ("openpyxl", "numpy", "xl.formula", "xl.storage")\n'
+                'def loaded():\n'
+                '    print(",".join(n for n in heavy if n in sys.modules)'
+                ' or "-")\n'
+                'import xl\n'
+                'loaded()\n'
+                'import xl.xlutils\n'
+                'loaded()')
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root).decode().split()
+        self.assertEqual(output[0], '-')
+        # before python 3.7 (no module __getattr__) they load at import
+        if sys.version_info >= (3, 7):
+            self.assertEqual(output[1], '-')
+        # the constants and names made on first use
+        self.assertTrue(xlutils.FONT_BOLD.b)
+        self.assertIs(xlutils.HEADER_STYLE['font'], xlutils.FONT_BOLD)
+        self.assertEqual(xlutils.ColumnStore.__name__, 'ColumnStore')
+        with self.assertRaises(AttributeError):
+            xlutils.NOT_A_NAME
+
+
+if __name__ == '__main__':
+    unittest.main()
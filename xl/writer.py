@@ -0,0 +1,124 @@
+'''
+Script: writer.py
+Author: G. Paxton
+Purpose: To save excel files, copying unchanged worksheets from the source
+Revision: October 2026
+'''
+###############################################################################
+import datetime
+
+from zipfile import ZipFile
+
+from openpyxl.packaging.relationship import (Relationship, RelationshipList,
+                                             get_rels_path)
+from openpyxl.xml.constants import ARC_WORKBOOK_RELS, SHARED_STRINGS
+from openpyxl.xml.functions import fromstring, tostring
+
+from xl.archive import XLArchive
+from xl.storage import _StoreWriter, _UTC
+
+
+# Data
+'''
+Parts
+'''
+ARC_SHARED_STRINGS = 'xl/sharedStrings.xml'
+
+
+class _SharedStrings:
+    '''Manifest entry of the copied shared string table'''
+    path = '/' + ARC_SHARED_STRINGS
+    mime_type = SHARED_STRINGS
+
+
+def plain_sheets(path, parts):
+    '''Return the sheets of a file that can be copied without parsing
+
+    A sheet qualifies if its only relationships are external links
+    (hyperlinks), anything else (tables, comments, drawings...) is
+    numbered per workbook when saved so the sheet has to be written.
+
+    @param path : the excel file
+    @param parts : {worksheet: archive path of its xml}
+    @return {worksheet: (archive path, RelationshipList)}
+    '''
+    found = {}
+    with ZipFile(path) as archive:
+        names = set(archive.namelist())
+        for ws, part in parts.items():
+            if part not in names:
+                continue
+            rels = RelationshipList()
+            rels_path = get_rels_path(part)
+            if rels_path in names:
+                rels = RelationshipList.from_tree(
+                    fromstring(archive.read(rels_path)))
+            if all(rel.TargetMode == 'External' for rel in rels):
+                found[ws] = (part, rels)
+    return found
+
+
+# CLASS
+class _Archive(XLArchive):
+    '''Zip file that adds relationships to the workbook's as it is written'''
+    extra_rels = ()
+
+    def writestr(self, name, data, *args, **kwargs):
+        if name == ARC_WORKBOOK_RELS and self.extra_rels:
+            rels = RelationshipList.from_tree(fromstring(data))
+            for rel in self.extra_rels:
+                rels.append(rel)
+            data = tostring(rels.to_tree())
+        return XLArchive.writestr(self, name, data, *args, **kwargs)
+
+
+class _PartialWriter(_StoreWriter):
+    '''Excel writer copying unchanged worksheets from the source file
+
+    Copied sheets keep their xml as it is, so they still refer to the
+    source's shared string table (which is copied along) and to its
+    cell formats, which openpyxl keeps in the same order when loading.
+    '''
+
+    def __init__(self, workbook, archive, stores, source, raw, strings):
+        _StoreWriter.__init__(self, workbook, archive, stores)
+        self.source = source
+        self.raw = raw
+        if raw and strings:
+            archive.writestr(ARC_SHARED_STRINGS, source.read(strings))
+            archive.extra_rels = [Relationship(type='sharedStrings',
+                                               Target='sharedStrings.xml')]
+            self.manifest.append(_SharedStrings)
+
+
+    def write_worksheet(self, ws):
+        part = self.raw.get(ws)
+        if part is None:
+            return _StoreWriter.write_worksheet(self, ws)
+        path, rels = part
+        data = self.source.read(path)
+        if ws is not self.workbook.active:
+            data = data.replace(b' tabSelected="1"', b'')
+        ws._drawing = None
+        ws._rels = rels
+        self._archive.writestr(ws.path[1:], data)
+        self.manifest.append(ws)
+
+
+def save_workbook(workbook, filename, stores, source, raw, strings=None,
+                  compression='default'):
+    '''Save a workbook, copying the unchanged sheets from its source
+
+    @param workbook : openpyxl workbook loaded from source
+    @param filename : file to save to, not source itself
+    @param stores : {worksheet: store} of the stored worksheets
+    @param source : path of the file the workbook was loaded from
+    @param raw : {worksheet: (archive path, rels)} from plain_sheets
+    @param strings : archive path of the source's shared string table
+    @param compression : 'stored', 'fast', 'default' or 'max'
+    '''
+    with ZipFile(source) as src:
+        archive = _Archive(filename, compression)
+        workbook.properties.modified = datetime.datetime.now(
+            _UTC).replace(tzinfo=None)
+        _PartialWriter(workbook, archive, stores, src, raw, strings).save()
@@ -7,39 +7,79 @@ Revision: March 2018
 ###############################################################################
 import sys
 import os
+import io
+import csv
 import logging
 import re
+import threading
+import time
+import contextlib
+import traceback
+import warnings
+import datetime
+import weakref
 
-import openpyxl
+from bisect import insort
+from copy import copy
+from itertools import chain, count, islice
 
-from openpyxl.utils import get_column_letter, column_index_from_string
-from openpyxl.styles import PatternFill, Border
-from openpyxl.styles import Side, Alignment, Protection, Font
-from openpyxl.workbook.defined_name import DefinedName,DefinedNameList
-from openpyxl.worksheet.table import Table, TableStyleInfo
+# openpyxl and the xl modules built on it are imported where they are
+# first used, importing xlutils alone doesn't load them
 
 # Data
 '''
-Fonts
+Styles
 '''
-FONT = Font(name='Calibri', size=11, bold=False, italic=False,
-            vertAlign=None, underline='none', strike=False,
-            color='FF000000')
-FONT_BOLD = Font(bold=True)
-'''
-Fills
-'''
-FILL = PatternFill(fill_type=None, start_color='FFFFFFFF',
-                   end_color='FF000000')
-FILL_GREY = PatternFill('solid', fgColor='DDDDDD')
-FILL_WHITE = PatternFill('solid', fgColor='FFFFFF')
+# FONT, FONT_BOLD, FILL, FILL_GREY, FILL_WHITE, ALIGN, ALIGN_CENTER,
+# BORDER and HEADER_STYLE are made on first use (see _style_constant)
+# name -> function making it from the openpyxl.styles module
+_STYLE_CONSTANTS = {
+    'FONT': lambda styles: styles.Font(
+        name='Calibri', size=11, bold=False, italic=False, vertAlign=None,
+        underline='none', strike=False, color='FF000000'),
+    'FONT_BOLD': lambda styles: styles.Font(bold=True),
+    'FILL': lambda styles: styles.PatternFill(
+        fill_type=None, start_color='FFFFFFFF', end_color='FF000000'),
+    'FILL_GREY': lambda styles: styles.PatternFill('solid', fgColor='DDDDDD'),
+    'FILL_WHITE': lambda styles: styles.PatternFill('solid',
+                                                    fgColor='FFFFFF'),
+    'ALIGN': lambda styles: styles.Alignment(
+        horizontal='general', vertical='bottom', text_rotation=0,
+        wrap_text=False, shrink_to_fit=False, indent=0),
+    'ALIGN_CENTER': lambda styles: styles.Alignment(horizontal="center",
+                                                    vertical="center"),
+    'BORDER': lambda styles: styles.Border(
+        diagonal_direction=0,
+        **dict((side, styles.Side(border_style=None, color='FF000000'))
+               for side in ('left', 'right', 'top', 'bottom', 'diagonal',
+                            'outline', 'vertical', 'horizontal'))),
+    # style_block arguments of from_dataframe's header row
+    'HEADER_STYLE': lambda styles: {'font': _style_constant('FONT_BOLD'),
+                                    'align': _style_constant('ALIGN_CENTER')},
+}
+
 '''
-Alignment
+Imports
 '''
-ALIGN =Alignment(horizontal='general', vertical='bottom',
-                 text_rotation=0, wrap_text=False,
-                 shrink_to_fit=False, indent=0)
-ALIGN_CENTER = Alignment(horizontal="center", vertical="center")
+# names of other modules xlutils hands out (xlutils.Font...), imported
+# on first use
+_IMPORTS = dict(
+    [(name, 'openpyxl.styles') for name in (
+        'Alignment', 'Border', 'Font', 'PatternFill', 'Protection', 'Side')] +
+    [(name, 'openpyxl.cell') for name in (
+        'Cell', 'MergedCell', 'WriteOnlyCell')] +
+    [(name, 'openpyxl.worksheet.table') for name in (
+        'Table', 'TableColumn', 'TableStyleInfo')] +
+    [(name, 'openpyxl.workbook.defined_name') for name in (
+        'DefinedName', 'DefinedNameList')] +
+    [('StyleArray', 'openpyxl.styles.cell_style'),
+     ('CellRange', 'openpyxl.worksheet.cell_range'),
+     ('MergedCellRange', 'openpyxl.worksheet.merge'),
+     ('AutoFilter', 'openpyxl.worksheet.filters'),
+     ('Calculator', 'xl.formula'), ('is_formula', 'xl.formula'),
+     ('LazyReader', 'xl.reader'), ('read_sheet_names', 'xl.reader'),
+     ('ColumnStore', 'xl.storage'), ('SpillFile', 'xl.storage'),
+     ('plain_sheets', 'xl.writer')])
 
 '''
 Format
@@ -48,18 +88,749 @@ FORMAT = 'General'
 FORMAT_COMMA = '#,##0.00'
 
 '''
-Borders
+Tables
+'''
+TABLE_STYLE = 'TableStyleLight1'    # grey banded rows
+
+'''
+CSV
+'''
+# fields import_csv (coerce=True) makes numbers, anything else stays text
+_INT_RE = re.compile(r'[-+]?[0-9]+\Z')
+_FLOAT_RE = re.compile(r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)'
+                       r'(?:[eE][-+]?[0-9]+)?\Z')
+
+'''
+Frames
+'''
+_FRAME_ROWS = 10000     # rows converted at a time between frames and cells
+
+'''
+Logging
+'''
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_LOG = logging.getLogger('xl.xlutils')
+_LOG.addHandler(logging.NullHandler())
+_LOGGERS = {}           # (pid, log file) -> logger
+_LOGGER_NUMBERS = count()   # names the loggers, never reused
+
+'''
+Instrumentation
+'''
+_clock = getattr(time, 'perf_counter', time.time)
+# method -> function giving the cells a call touched, it is called with
+# the XLUtil and the call's arguments once the call has returned
+_INSTRUMENTED = {
+    'write': lambda xl, coord, value: 1,
+    'write_row': lambda xl, coord, values: _length(values),
+    'write_column': lambda xl, coord, values: _length(values),
+    'write_block': lambda xl, coord, values: _block_size(values),
+    'append_row': lambda xl, values: _length(values),
+    'write_table': lambda xl, coord, tableData, tableName:
+        _block_size(tableData),
+    'append_table_row': lambda xl, rowData, tableName: _length(rowData),
+    'append_table_rows': lambda xl, rowsData, tableName:
+        _block_size(rowsData),
+    'read': lambda xl, coord, evaluate=False: 1,
+    'read_row': lambda xl, coord, length: max(length, 0),
+    'read_column': lambda xl, coord, length: max(length, 0),
+    'read_block': lambda xl, span: _span_size(span),
+    'read_block_array': lambda xl, span, dtype=None: _span_size(span),
+    'to_dataframe': lambda xl, span=None, *args, **kwargs:
+        _span_size(span) if span else 0,
+    'from_dataframe': lambda xl, df, *args, **kwargs: int(df.size),
+    'style': lambda xl, coord, *args, **kwargs: 1,
+    'style_block': lambda xl, span, *args, **kwargs: _span_size(span),
+    'style_row': lambda xl, row, *args, **kwargs: 0,
+    'style_column': lambda xl, column, *args, **kwargs: 0,
+    '_load_workbook': lambda xl: _workbook_size(xl),
+    '_load_sheet': lambda xl, ws: len(ws._cells),
+    'save_workbook': lambda xl, fileName=None, compression='default':
+        _workbook_size(xl),
+    'save_workbook_async': lambda xl, fileName=None, compression='default':
+        _workbook_size(xl),
+}
+
 '''
-BORDER = Border(left=Side(border_style=None, color='FF000000'),
-                right=Side(border_style=None,color='FF000000'),
-                top=Side(border_style=None,color='FF000000'),
-                bottom=Side(border_style=None, color='FF000000'),
-                diagonal=Side(border_style=None, color='FF000000'),
-                diagonal_direction=0,
-                outline=Side(border_style=None, color='FF000000'),
-                vertical=Side(border_style=None, color='FF000000'),
-                horizontal=Side(border_style=None, color='FF000000')
-               )
+Modes
+'''
+NORMAL = 'normal'   # whole workbook in memory, read & write anywhere
+STREAM = 'stream'   # write-only, rows flushed in order with flat memory
+READ = 'read'       # read-only, rows parsed lazily as they are iterated
+MODES = (NORMAL, STREAM, READ)
+
+'''
+Coordinates
+'''
+MAX_COLUMN = 16384      # column XFD
+MAX_ROW = 1048576
+_COORD_RE = re.compile(r'^\$?([A-Za-z]{1,3})\$?(\d+)$')
+_COL_LETTERS = []       # index -> letters, built on first use
+_COL_INDEX = {}         # letters -> index, built on first use
+_COORD_CACHE = {}       # "B2" -> (2, 2)
+_SPAN_CACHE = {}        # "A1:B2" -> ((1, 1), (2, 2))
+_CACHE_LIMIT = 65536
+_INT_CODES = ('b', 'h', 'i', 'l', 'q', 'n')   # struct codes, lower cased
+
+'''
+Merged cells
+'''
+_MERGE_TILE = 32        # rows and columns of a tile of the merge index
+_MERGE_LARGE = 256      # ranges covering more tiles are listed apart
+
+try:
+    _STRING_TYPES = (str, unicode)
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+def _style_constant(name):
+    '''Return a style constant of _STYLE_CONSTANTS, made on first use'''
+    value = globals().get(name)
+    if value is None:
+        import openpyxl.styles
+        value = globals()[name] = _STYLE_CONSTANTS[name](openpyxl.styles)
+    return value
+
+
+def _import(name):
+    '''Return a name of _IMPORTS, importing its module on first use'''
+    value = globals()[name] = getattr(
+        __import__(_IMPORTS[name], fromlist=[name]), name)
+    return value
+
+
+def __getattr__(name):
+    '''Make the style constants and imports when first asked for'''
+    if name in _STYLE_CONSTANTS:
+        return _style_constant(name)
+    if name in _IMPORTS:
+        return _import(name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(
+        __name__, name))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ is python 3.7 onwards, make them all now
+    for _name in _STYLE_CONSTANTS:
+        _style_constant(_name)
+    for _name in _IMPORTS:
+        _import(_name)
+
+
+def _build_column_tables():
+    '''Fill the column letter <-> index lookup tables once'''
+    letters = [''] + [chr(c) for c in range(65, 91)]
+    for first in letters[1:27]:
+        letters.extend(first + second for second in letters[1:27])
+    for first in letters[1:27]:
+        letters.extend(first + second for second in letters[27:703])
+    _COL_LETTERS[:] = letters
+    _COL_INDEX.clear()
+    _COL_INDEX.update((letter, idx) for idx, letter in enumerate(letters))
+
+
+def column_letter(column):
+    '''Return the column letters for a column number (1 -> "A")'''
+    if not _COL_LETTERS:
+        _build_column_tables()
+    if 0 < column <= MAX_COLUMN:
+        return _COL_LETTERS[column]
+    raise ValueError('Invalid column index {0}'.format(column))
+
+
+def column_index(letters):
+    '''Return the column number for column letters ("A" -> 1)'''
+    if not _COL_INDEX:
+        _build_column_tables()
+    column = _COL_INDEX.get(letters.upper(), 0)
+    if 0 < column <= MAX_COLUMN:
+        return column
+    raise ValueError('Invalid column letters {0}'.format(letters))
+
+
+def parse_coord(coordinate):
+    '''Return (column, row) for "B2", "$B$2" or a (column, row) pair
+
+    String results are memoized, so repeated coordinates are a dict hit.
+    '''
+    if coordinate.__class__ is tuple:
+        return coordinate
+    try:
+        return _COORD_CACHE[coordinate]
+    except KeyError:
+        pass
+    except TypeError: # list given as [column, row]
+        return (int(coordinate[0]), int(coordinate[1]))
+    match = _COORD_RE.match(coordinate)
+    if match is None:
+        raise ValueError('Invalid coordinate {0}'.format(coordinate))
+    coord = (column_index(match.group(1)), int(match.group(2)))
+    if not 0 < coord[1] <= MAX_ROW:
+        raise ValueError('Invalid coordinate {0}'.format(coordinate))
+    if len(_COORD_CACHE) >= _CACHE_LIMIT:
+        _COORD_CACHE.clear()
+    _COORD_CACHE[coordinate] = coord
+    return coord
+
+
+def parse_span(span):
+    '''Return ((col1, row1), (col2, row2)) for "A1:B2" or a pair of coords
+
+    A single coordinate is treated as a one cell span.
+    '''
+    try:
+        return _SPAN_CACHE[span]
+    except (KeyError, TypeError):
+        pass
+    if isinstance(span, _STRING_TYPES):
+        if ':' in span:
+            idx = span.index(':')
+            coords = (parse_coord(span[:idx]), parse_coord(span[idx+1:]))
+        else:
+            coord = parse_coord(span)
+            coords = (coord, coord)
+        if len(_SPAN_CACHE) >= _CACHE_LIMIT:
+            _SPAN_CACHE.clear()
+        _SPAN_CACHE[span] = coords
+        return coords
+    if isinstance(span[0], _STRING_TYPES + (tuple, list)):
+        return (parse_coord(span[0]), parse_coord(span[1]))
+    coord = parse_coord(span)
+    return (coord, coord)
+
+
+def coord_string(coordinate):
+    '''Return the "A1" string for any accepted coordinate'''
+    if isinstance(coordinate, _STRING_TYPES):
+        return coordinate.upper()
+    return column_letter(coordinate[0]) + str(coordinate[1])
+
+
+def span_string(span):
+    '''Return the "A1:B2" string for any accepted span'''
+    if isinstance(span, _STRING_TYPES):
+        return span.upper()
+    (col1, row1), (col2, row2) = parse_span(span)
+    return (column_letter(col1) + str(row1) + ':' +
+            column_letter(col2) + str(row2))
+
+
+def get_logger(logFile):
+    '''Return the logger writing to logFile
+
+    Each log file gets its own logger (per process) instead of the shared
+    root logger, so instances and worker processes given different files
+    never write into each other's logs. None gives the plain 'xl.xlutils'
+    logger, which only outputs what the application configures.
+    '''
+    if logFile is None:
+        return _LOG
+    key = (os.getpid(), os.path.abspath(logFile))
+    try:
+        return _LOGGERS[key]
+    except KeyError:
+        pass
+    logger = logging.getLogger('xl.xlutils.file{0}'.format(
+        next(_LOGGER_NUMBERS)))
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    for handler in list(logger.handlers):   # inherited through a fork
+        logger.removeHandler(handler)
+    handler = logging.FileHandler(logFile, mode='w')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    _LOGGERS[key] = logger
+    return logger
+
+
+def release_logger(logFile):
+    '''Close the log file of get_logger(logFile) and forget its logger
+
+    A process writing many log files (XLBatch jobs) releases each one
+    when its workbook is done, instead of holding every file open.
+    '''
+    if logFile is None:
+        return
+    logger = _LOGGERS.pop((os.getpid(), os.path.abspath(logFile)), None)
+    if logger is not None:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def _save_in_thread(xl, fileName, compression, future):
+    '''Save a workbook and resolve the future with the outcome'''
+    try:
+        xl._write_workbook(fileName, compression)
+    except Exception as error:
+        future.set_exception(error)
+    else:
+        future.set_result(fileName)
+
+
+def _wait_for_save(pid, read_fd, fileName, future, keep=None):
+    '''Wait for a forked save and resolve the future with the outcome
+
+    keep (the SpillFile the child reads) is held until the child exits.
+    '''
+    chunks = []
+    chunk = os.read(read_fd, 65536)
+    while chunk:
+        chunks.append(chunk)
+        chunk = os.read(read_fd, 65536)
+    os.close(read_fd)
+    status = os.waitpid(pid, 0)[1]
+    if status == 0:
+        future.set_result(fileName)
+    else:
+        error = b''.join(chunks).decode('utf-8', 'replace')
+        future.set_exception(IOError('Saving {0} failed\n{1}'.format(
+            fileName, error or 'exit status {0}'.format(status))))
+
+
+def _replace(src, dst):
+    '''Rename src to dst, replacing dst'''
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:           # python 2
+        if os.path.exists(dst) and os.name == 'nt':
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def _moved_style(workbook, other, style):
+    '''Return a copy of a style of other with the ids of workbook
+
+    The font, fill, border, alignment, protection and number format the
+    style refers to are added to workbook's lists if not there yet.
+    '''
+    from openpyxl.styles.cell_style import StyleArray
+    from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE
+    style = StyleArray(style)
+    style.fontId = workbook._fonts.add(other._fonts[style.fontId])
+    style.fillId = workbook._fills.add(other._fills[style.fillId])
+    style.borderId = workbook._borders.add(other._borders[style.borderId])
+    style.alignmentId = workbook._alignments.add(
+        other._alignments[style.alignmentId])
+    style.protectionId = workbook._protections.add(
+        other._protections[style.protectionId])
+    if style.numFmtId >= BUILTIN_FORMATS_MAX_SIZE:
+        code = other._number_formats[style.numFmtId -
+                                     BUILTIN_FORMATS_MAX_SIZE]
+        style.numFmtId = (workbook._number_formats.add(code) +
+                          BUILTIN_FORMATS_MAX_SIZE)
+    style.xfId = 0
+    return style
+
+
+def merge_styles(workbook, other):
+    '''Add the cell formats of another workbook to a workbook
+
+    @param workbook : openpyxl workbook to add to
+    @param other : openpyxl workbook the formats come from
+    @return mapping : list, format id in other -> format id in workbook
+    '''
+    return [workbook._cell_styles.add(_moved_style(workbook, other, style))
+            for style in other._cell_styles]
+
+
+def _set_style(styleable, ids):
+    '''Copy the font, fill, number format and alignment ids of a style
+
+    styleable is a cell or dimension, other style ids are left alone
+    '''
+    style = styleable._style
+    if style is None:
+        styleable._style = ids.__copy__()
+    else:
+        style[0] = ids[0]   # fontId
+        style[1] = ids[1]   # fillId
+        style[3] = ids[3]   # numFmtId
+        style[5] = ids[5]   # alignmentId
+
+
+def _auto_width(length):
+    '''Column width for the longest value length (capped at 50)'''
+    return (min(length, 50) + 2) * 1.1
+
+
+class _EmptyCell:
+    '''Stand-in for cells that were never written'''
+    value = None
+
+_EMPTY = _EmptyCell()
+
+
+def _chunked(rows, size):
+    '''Group an iterable of rows into lists of up to size rows'''
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _open_csv(path, mode, encoding):
+    '''Open a csv file the way the csv module of this python wants it'''
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return io.open(path, mode, encoding=encoding, newline='')
+
+
+def _coerce_value(value):
+    '''Turn a csv field into an int, a float, None (if empty) or itself
+
+    Only plain numbers ("12", "-1.5", "2e3") are converted, text int()
+    or float() would also take ("1_000", " 12 ", "nan") is kept as is.
+    '''
+    if not value:
+        return None
+    if _INT_RE.match(value):
+        return int(value)
+    if _FLOAT_RE.match(value):
+        number = float(value)
+        # too large a number overflows to inf, which is text to excel
+        return number if number - number == 0 else value
+    return value
+
+
+def _row_coercer(coerce):
+    '''Return a function converting a row for a coerce option, or None
+
+    @param coerce : False/None for no conversion, True for _coerce_value,
+                    a function for every value or a list of functions
+                    (or None) by column
+    '''
+    if not coerce:
+        return None
+    if coerce is True:
+        coerce = _coerce_value
+    if callable(coerce):
+        return lambda values: list(map(coerce, values))
+    functions = list(coerce)
+    count = len(functions)
+
+    def convert(values):
+        return [functions[i](value) if i < count and functions[i] else value
+                for i, value in enumerate(values)]
+    return convert
+
+
+def _finite(value):
+    '''Return a float as a cell value, NaN as None and inf as text'''
+    if value - value == 0:
+        return value
+    # inf is text to excel, as _coerce_value keeps it
+    return None if value != value else str(value)
+
+
+def _block_rows(values):
+    '''Return (rows, data_type) for a block of values
+
+    2-D arrays and buffers are turned into nested lists of Python values
+    in one C level tolist() call, with NaN as None (an empty cell), inf
+    as text ('inf', '-inf') and datetime64 as datetime. data_type is the
+    openpyxl cell type shared by every value ('n' or 'b') when the array
+    dtype guarantees one, else None. Lists and other iterables are
+    returned untouched.
+    '''
+    if isinstance(values, (list, tuple)):
+        return values, None
+    dtype = getattr(values, 'dtype', None)
+    if dtype is None:
+        try:
+            values = memoryview(values)
+        except TypeError:
+            return values, None
+        kind = values.format[-1:].lower()
+        kind = 'f' if kind in ('f', 'd', 'e') else 'i' if kind in _INT_CODES else ''
+    else:
+        kind = dtype.kind
+        if kind == 'M':
+            values = values.astype('datetime64[us]')
+    if values.ndim != 2:
+        raise ValueError('A block must be 2-D, not {0}-D'.format(values.ndim))
+    rows = values.tolist()
+    if kind == 'f':
+        if dtype is not None:
+            import numpy
+            finite = numpy.isfinite(values).all()
+        else:
+            finite = not any(value - value for row in rows for value in row)
+        if not finite:
+            rows = [[_finite(value) for value in row] for row in rows]
+            kind = ''
+    data_type = 'n' if kind in ('i', 'u', 'f') else 'b' if kind == 'b' else None
+    return rows, data_type
+
+
+def _infer_dtype(kinds):
+    '''Pick a numpy dtype for the set of Python types in a block'''
+    empty = type(None) in kinds
+    kinds.discard(type(None))
+    if kinds == set([int]) and not empty:
+        return 'int64'
+    if kinds == set([bool]) and not empty:
+        return 'bool'
+    if kinds <= set([int, float, bool]):
+        return 'float64'
+    if kinds <= set([datetime.datetime, datetime.date]):
+        return 'datetime64[us]'
+    return object
+
+
+def _column_array(values):
+    '''Make a numpy array of a column's values with _infer_dtype's dtype'''
+    import numpy
+    return numpy.array(values, dtype=_infer_dtype(set(map(type, values))))
+
+
+def _frame_name(name):
+    '''Return the header value of a DataFrame column or index name'''
+    if isinstance(name, tuple):
+        return ' '.join(str(part) for part in name if part != '')
+    return name
+
+
+def _frame_values(values):
+    '''Turn a slice of a pandas array (Series.array) into cell values
+
+    Numbers come out of one C level tolist() call, datetime64 and
+    timedelta64 as datetime and timedelta (timezones are dropped, the
+    local time is kept), inf as text as in write_block and missing
+    values of every kind as None.
+
+    @return (values, data_type) : data_type is 'n' when every value is
+                                  a number, else None
+    '''
+    dtype = values.dtype
+    if getattr(dtype, 'tz', None) is not None:
+        values = values.tz_localize(None)
+        dtype = values.dtype
+    kind = dtype.kind
+    if kind == 'M':
+        return values.to_numpy().astype('datetime64[us]').tolist(), None
+    if kind == 'm':
+        return values.to_numpy().astype('timedelta64[us]').tolist(), None
+    if kind == 'f':
+        import numpy
+        numbers = values.to_numpy(dtype='float64', na_value=numpy.nan)
+        if numpy.isfinite(numbers).all():
+            return numbers.tolist(), 'n'
+        return [_finite(value) for value in numbers.tolist()], None
+    empty = values.isna()
+    if kind in ('i', 'u', 'b') and not empty.any():
+        return values.to_numpy().tolist(), 'n' if kind != 'b' else None
+    result = values.to_numpy(dtype=object)
+    result[empty] = None
+    return result.tolist(), None
+
+
+def _length(values):
+    '''Number of values in a row or column, 0 for an iterator'''
+    try:
+        return len(values)
+    except TypeError:
+        return 0
+
+
+def _block_size(values):
+    '''Number of cells in a block of rows, an array or a buffer'''
+    size = getattr(values, 'size', None)
+    if size is not None:
+        return int(size)
+    if isinstance(values, (list, tuple)):
+        return sum(map(_length, values))
+    try:
+        values = memoryview(values)
+    except TypeError:
+        return 0
+    return values.nbytes // (values.itemsize or 1)
+
+
+def _span_size(span):
+    '''Number of cells in a span'''
+    (col1, row1), (col2, row2) = parse_span(span)
+    return (col2 - col1 + 1) * (row2 - row1 + 1)
+
+
+def _workbook_size(xl):
+    '''Number of cells in the loaded sheets of an XLUtil's workbook'''
+    return sum(len(getattr(ws, '_cells', ()))
+               for ws in xl.workbook.worksheets)
+
+
+def _timed(xl, name, method, cells):
+    '''Wrap a bound method so each call is added to xl's statistics'''
+    entry = xl._stats.setdefault(name.lstrip('_'), [0, 0.0, 0])
+
+    def timed(*args, **kwargs):
+        start = _clock()
+        result = method(*args, **kwargs)
+        entry[1] += _clock() - start
+        entry[0] += 1
+        entry[2] += cells(xl, *args, **kwargs)
+        return result
+    timed.__doc__ = method.__doc__
+    return timed
+
+
+class _RowStream:
+    '''Row buffer in front of a write-only worksheet
+
+    Holds the one row currently being written and flushes it to the
+    worksheet as soon as a later row is touched, so memory stays flat.
+    Rows before the buffered one can no longer be changed.
+    '''
+
+    def __init__(self, worksheet):
+        from openpyxl.cell import Cell, WriteOnlyCell
+        self.worksheet = worksheet
+        self.row = 1        # row held in pending, rows above are flushed
+        self.pending = []   # values (or styled cells) by column - 1
+        self.styled = False
+        self.flushed = False    # a row is out, the sheet's layout with it
+        self.Cell = Cell
+        self.WriteOnlyCell = WriteOnlyCell
+
+    def advance(self, row):
+        """Flush buffered rows until row is the one being written"""
+        if row == self.row:
+            return
+        if row < self.row:
+            raise ValueError('Row {0} has already been written out in '
+                             'stream mode'.format(row))
+        append = self.worksheet.append
+        append(self.pending)
+        for i in range(row - self.row - 1):
+            append(())
+        self.flushed = True
+        self.row = row
+        self.pending = []
+        self.styled = False
+
+    def flush(self):
+        """Flush the buffered row if anything was written to it"""
+        if self.pending:
+            self.advance(self.row + 1)
+
+    def next_row(self):
+        """Return the row an append would go to"""
+        return self.row + 1 if self.pending else self.row
+
+    def _extend(self, end):
+        pending = self.pending
+        if len(pending) < end:
+            pending.extend([None] * (end - len(pending)))
+        return pending
+
+    def put(self, column, row, value):
+        """Buffer a single value"""
+        self.advance(row)
+        pending = self._extend(column)
+        current = pending[column-1]
+        if isinstance(current, self.Cell):
+            current.value = value
+        else:
+            pending[column-1] = value
+
+    def put_row(self, column, row, values):
+        """Buffer a sequence of values from column onwards"""
+        self.advance(row)
+        values = list(values)
+        if self.styled:
+            for i, value in enumerate(values):
+                self.put(column+i, row, value)
+        else:
+            end = column - 1 + len(values)
+            self._extend(end)[column-1:end] = values
+
+    def cell(self, column, row):
+        """Return a styleable write-only cell for the buffered row"""
+        self.advance(row)
+        pending = self._extend(column)
+        current = pending[column-1]
+        if not isinstance(current, self.Cell):
+            current = self.WriteOnlyCell(self.worksheet, value=current)
+            pending[column-1] = current
+            self.styled = True
+        return current
+
+
+class _MergeIndex:
+    '''Index of the merged ranges of a worksheet by the tiles they cover
+
+    The sheet is divided into _MERGE_TILE x _MERGE_TILE tiles and each
+    range is listed under every tile it touches, so finding the ranges
+    at a cell or overlapping a span only looks at the ranges nearby.
+    Ranges covering more than _MERGE_LARGE tiles are kept in a list of
+    their own instead of being listed in thousands of tiles.
+    '''
+
+    def __init__(self, ranges):
+        self.tiles = {}     # (column tile, row tile) -> [CellRange]
+        self.large = []
+        self.count = 0      # ranges indexed, to spot outside changes
+        for cr in ranges:
+            self.add(cr)
+
+
+    def _tiles(self, col1, row1, col2, row2):
+        """Return the tile column and row ranges of a span"""
+        size = _MERGE_TILE
+        return (range((col1 - 1) // size, (col2 - 1) // size + 1),
+                range((row1 - 1) // size, (row2 - 1) // size + 1))
+
+
+    def add(self, cr):
+        columns, rows = self._tiles(cr.min_col, cr.min_row, cr.max_col,
+                                    cr.max_row)
+        if len(columns) * len(rows) > _MERGE_LARGE:
+            self.large.append(cr)
+        else:
+            tiles = self.tiles
+            for tile_row in rows:
+                for tile_col in columns:
+                    tiles.setdefault((tile_col, tile_row), []).append(cr)
+        self.count += 1
+
+
+    def remove(self, cr):
+        columns, rows = self._tiles(cr.min_col, cr.min_row, cr.max_col,
+                                    cr.max_row)
+        if len(columns) * len(rows) > _MERGE_LARGE:
+            self.large.remove(cr)
+        else:
+            for tile_row in rows:
+                for tile_col in columns:
+                    tile = self.tiles[(tile_col, tile_row)]
+                    tile.remove(cr)
+                    if not tile:
+                        del self.tiles[(tile_col, tile_row)]
+        self.count -= 1
+
+
+    def overlapping(self, col1, row1, col2, row2):
+        """Return the ranges overlapping a span"""
+        found = []
+        columns, rows = self._tiles(col1, row1, col2, row2)
+        if len(columns) * len(rows) > len(self.tiles):
+            candidates = chain.from_iterable(self.tiles.values())
+        else:
+            get = self.tiles.get
+            candidates = chain.from_iterable(
+                get((tile_col, tile_row), ()) for tile_row in rows
+                for tile_col in columns)
+        for cr in chain(candidates, self.large):
+            if (cr.min_col <= col2 and col1 <= cr.max_col and
+                    cr.min_row <= row2 and row1 <= cr.max_row and
+                    cr not in found):
+                found.append(cr)
+        return found
 
 
 # CLASS
@@ -71,18 +842,84 @@ class XLUtil:
     keep being specified  
     '''
 
-    def __init__(self, excelPath, logFile='XLUtil_log.txt'):
+    def __init__(self, excelPath, logFile='XLUtil_log.txt', mode=NORMAL,
+                 quiet=False, instrument=False, memory_budget=None,
+                 spill_dir=None, compact=False):
         '''Initialize XL with a path
 
+        @param excelPath : path of the workbook, .xlsx is added if missing
+        @param logFile : file the debug log is written to, None to only
+                         log to the 'xl.xlutils' logger
+        @param mode : NORMAL to load/edit the workbook in memory,
+                      STREAM to write rows in order with flat memory use,
+                      READ to read an existing file lazily row by row
+        @param quiet : don't print progress messages, only log them
+        @param instrument : collect call statistics from the start,
+                            see stats()
+        @param memory_budget : NORMAL mode only, the most cells a sheet
+                               keeps in memory, past it the sheet's
+                               cells move to a temporary file on disk
+        @param spill_dir : directory of that file (default system temp)
+        @param compact : NORMAL mode only, keep the values written by
+                         write_row, write_column, write_block and
+                         append_row in typed column arrays instead of
+                         openpyxl cells, several times smaller
+
+        Note: with logFile=None and quiet=True nothing is printed or
+        written, messages only reach 'xl.xlutils' if it is configured.
+
+        Note: in STREAM mode cells can only be written, an existing
+        file is replaced on save and rows must be written top to bottom
+        (a row is flushed once a later row is touched). Freeze panes and
+        column widths must be set before the first row is flushed, they
+        raise ValueError after.
+        READ mode keeps the file open until close_workbook is called.
+
+        Note: a compact sheet, or one spilled past memory_budget, is
+        still read, written, styled and saved through XLUtil, but its
+        cells are no longer in the openpyxl worksheet
+        (get_active_sheet()['A1'] won't see them). A compact sheet past
+        memory_budget spills as well.
         '''
-        self.workbook = openpyxl.Workbook()
-        self.worksheet = self.workbook.active
+        if mode not in MODES:
+            raise ValueError('Unknown mode {0}'.format(mode))
+        if (memory_budget is not None or compact) and mode != NORMAL:
+            raise ValueError('memory_budget and compact are only used in '
+                             'NORMAL mode')
+        self.mode = mode
+        self.quiet = quiet
+        self._stats = {}        # method -> [calls, seconds, cells]
+        self._instrumented = False
+        self._streams = {}
+        self._styles = {}
+        self._widths = {}       # sheet -> {column: longest value written}
+        self._measured = set()  # sheets whose widths cover every value
+        self._unmeasured = {}   # sheet -> [numeric spans not yet measured]
+        self._stale = {}        # sheet -> {columns with values overwritten}
+        self._tables = {}       # lower case name -> table extent
+        self._source = None     # existing file, loaded on first use
+        self._reader = None
+        self._sheetnames = None
+        self._budget = memory_budget
+        self._spill_dir = spill_dir
+        self._spill = None      # SpillFile, made when a sheet first spills
+        self._forks = []        # futures of the forked saves running
+        self._compact = compact
+        self._stores = {}       # compact or spilled sheet -> its store
+        self._dirty = set()     # sheets changed since loaded from the file
+        self._raw = {}          # sheets the next save copies from the file
+        self._calc = None       # formula Calculator, made on first use
+        self._merges = {}       # sheet -> _MergeIndex, made on first use
+        self._indexes = {}      # (sheet, column) -> {value: [rows]}
+        self._indexed = None    # (sheet, column) indexed last
+        # workbook copied from -> {its style: StyleArray of this workbook}
+        self._moved_styles = weakref.WeakKeyDictionary()
         self.xlFile = self.xlDir = ""
         
         # set up logging
-        logging.basicConfig(
-            filename=logFile, filemode='w', level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s')
+        self.log = get_logger(logFile)
+        if instrument:
+            self.instrument()
         
         # get the directory path and file name
         head, tail = os.path.split(excelPath)
@@ -93,28 +930,459 @@ class XLUtil:
             if(excelPath[-5:] != ".xlsx"):
                 tail+='.xlsx'
             # check if file exists or needs created
-            if(os.path.isfile(tail) == True):
-                logging.debug('Load workbook ' + tail)        
-	        self.workbook = openpyxl.load_workbook(tail)
-                self.worksheet = self.workbook.active
+            path = os.path.join(head, tail)
+            if(os.path.isfile(path) == True and mode == STREAM):
+                self.log.debug('Replacing workbook %s', tail)
+            elif(os.path.isfile(path) == True):
+                self.log.debug('Found workbook %s', tail)
+                self._source = path
+            elif(mode == READ):
+                raise IOError('{0} does not exist'.format(path))
             else:
-                logging.debug('Starting workbook ' + tail)
+                self.log.debug('Starting workbook %s', tail)
             self.xlDir = head
             self.xlFile = tail
         else:
-            print('\n{0}- Directory does not exist\n'.format(head))
+            self._say('\n%s- Directory does not exist\n', head)
+        if self._source is None:
+            self._new_workbook()
+        self._tables_indexed = self._source is None
+
+
+    def __getattr__(self, name):
+        """Load the workbook or active sheet on first use
+
+        An existing file is only opened when workbook or worksheet is
+        first needed, so XLUtil(path).get_sheets() never parses a sheet.
+        """
+        if name == 'workbook' and self.__dict__.get('_source'):
+            self._load_workbook()
+            return self.workbook
+        if name == 'worksheet' and '_source' in self.__dict__:
+            self.worksheet = self._sheet(self.workbook.active)
+            return self.worksheet
+        raise AttributeError(name)
+
+
+    def _new_workbook(self):
+        """Start an empty workbook for the mode
+
+        """
+        import openpyxl
+        if self.mode == STREAM:
+            self.workbook = openpyxl.Workbook(write_only=True)
+            self.worksheet = self.workbook.create_sheet()
+        else:
+            self.workbook = openpyxl.Workbook()
+            self.worksheet = self.workbook.active
+            self._measured.add(self.worksheet)
+
+
+    def _load_workbook(self):
+        """Load the existing file, leaving its sheets unparsed
+
+        READ mode uses openpyxl's read only workbook, which already
+        streams each sheet. Otherwise the sheets are placeholders that
+        are parsed by _sheet when they are selected.
+        """
+        path, self._source = self._source, None
+        self.log.debug('Load workbook %s', self.xlFile)
+        if self.mode == READ:
+            import openpyxl
+            self.workbook = openpyxl.load_workbook(path, read_only=True)
+        else:
+            from xl.reader import LazyReader
+            self._reader = LazyReader(path)
+            self._reader.read()
+            self.workbook = self._reader.wb
+        self._measured.clear()
+
+
+    def _sheet(self, ws):
+        """Return the worksheet, parsing it first if still a placeholder
+
+        @param ws : worksheet of self.workbook
+        """
+        if self._reader is not None and ws in self._reader.pending:
+            self._load_sheet(ws)
+        return ws
+
+
+    def _load_sheet(self, ws):
+        """Parse a placeholder worksheet of the lazily loaded workbook"""
+        self.log.debug('Load sheet %s', ws.title)
+        self._reader.load_sheet(ws)
+        self._check_budget(ws)
 
             
-    def save_workbook(self, fileName=None):
+    def save_workbook(self, fileName=None, compression='default'):
         '''Save the excel workbook
 
         Give the fileName to save under
         default is xlFile name picked from excel path
+        compression is 'stored', 'fast', 'default' or 'max', trading the
+        file's size for the time to save it ('stored' doesn't compress)
+
+        Sheets of a loaded file that were never read or written are
+        copied from the file as they are, only the sheets parsed (read,
+        written or handed out) are written again.
+        '''
+        fileName = self._prepare_save(fileName, compression)
+        self._write_workbook(fileName, compression)
+
+
+    def save_workbook_async(self, fileName=None, compression='default'):
+        '''Save the excel workbook in the background
+
+        Give the fileName to save under
+        default is xlFile name picked from excel path
+        compression is as for save_workbook
+        Returns a concurrent.futures.Future of the saved fileName.
+
+        The workbook is snapshotted by forking before this returns, so
+        it can keep being changed while the snapshot is written (to a
+        temporary file that is renamed into place when complete).
+        Where fork isn't available the save happens before returning.
+        In STREAM mode the save finishes the workbook, so it is written
+        on a thread without a snapshot.
         '''
+        from concurrent.futures import Future
+        fileName = self._prepare_save(fileName, compression)
+        future = Future()
+        if self.mode == STREAM:
+            thread = threading.Thread(target=_save_in_thread,
+                                      args=(self, fileName, compression,
+                                            future))
+        elif hasattr(os, 'fork'):
+            detach = self._replaces_source(fileName)
+            if detach:
+                # the file is replaced once the copy is written, so no
+                # sheet can be left to parse from it or copy from it
+                self._reader.load_all()
+            args = self._fork_save(fileName, compression) + (
+                fileName, future, self._spill)
+            if detach:
+                self._reader.parts = {}
+            self._forks = [running for running in self._forks
+                           if not running.done()] + [future]
+            thread = threading.Thread(target=_wait_for_save, args=args)
+        else:
+            self._write_workbook(fileName, compression)
+            future.set_result(fileName)
+            return future
+        thread.daemon = True
+        thread.start()
+        return future
+
+
+    def save_workbook_aio(self, fileName=None, compression='default'):
+        '''Save the excel workbook in the background for asyncio
+
+        Same as save_workbook_async but returns an asyncio future, so
+        it can be awaited: await xl.save_workbook_aio()
+        '''
+        import asyncio
+        return asyncio.wrap_future(self.save_workbook_async(fileName,
+                                                            compression))
+
+
+    def _prepare_save(self, fileName, compression):
+        """Resolve the file name and flush buffered rows before a save"""
+        if self.mode == READ:
+            self._unsupported('save_workbook')
+        from xl.archive import check_compression
+        check_compression(compression)
         if fileName is None:
-            fileName=self.xlFile
-        print("Saving {0}".format(fileName))
-        self.workbook.save(fileName)
+            fileName = os.path.join(self.xlDir, self.xlFile)
+        for stream in self._streams.values():
+            stream.flush()
+        if self._reader is not None:
+            self._raw = self._plain_sheets()
+            self._reader.load_all(skip=self._raw)
+        if self._spill is not None:
+            self._spill.commit()
+        self._say('Saving %s', fileName)
+        return fileName
+
+
+    def _write_workbook(self, fileName, compression='default'):
+        """Serialize the workbook to fileName"""
+        from xl.storage import save_workbook as save_stored
+        from xl.writer import (ARC_SHARED_STRINGS,
+                               save_workbook as save_partial)
+        replace = self._replaces_source(fileName)
+        target = fileName
+        if self._raw and replace:
+            target = '{0}.{1}.tmp'.format(fileName, os.getpid())
+        if self._raw:
+            save_partial(self.workbook, target, self._stores,
+                         self._reader.path, self._raw, self._reader.strings,
+                         compression)
+        else:
+            save_stored(self.workbook, target, self._stores, compression)
+        if replace:
+            if target != fileName:
+                _replace(target, fileName)
+            # the sheets can now be copied from the new file
+            strings = ARC_SHARED_STRINGS if (self._raw and
+                                             self._reader.strings) else None
+            self._reader.moved(dict((ws, ws.path[1:])
+                                    for ws in self.workbook.worksheets),
+                               strings)
+            self._dirty.clear()
+
+
+    def _plain_sheets(self):
+        """Return the unchanged sheets a save can copy from the file
+
+        Only the sheets never parsed or edited qualify, a parsed sheet
+        can have been changed through xl.worksheet or xl.workbook unseen.
+        """
+        untouched = self._reader.untouched
+        parts = dict((ws, part) for ws, part in self._reader.parts.items()
+                     if untouched(ws) and ws not in self._dirty and
+                     ws not in self._stores)
+        if not parts:
+            return {}
+        from xl.writer import plain_sheets
+        return plain_sheets(self._reader.path, parts)
+
+
+    def _replaces_source(self, fileName):
+        """Return True if saving to fileName replaces the loaded file"""
+        return (self._reader is not None and os.path.abspath(fileName) ==
+                os.path.abspath(self._reader.path))
+
+
+    def _fork_save(self, fileName, compression):
+        """Write the workbook from a forked copy of this process
+
+        @return (pid, fd) : child process and the pipe its errors come on
+        """
+        read_fd, write_fd = os.pipe()
+        if self._spill is not None:
+            # the child tells when it holds a snapshot of the spill file
+            started_fd, ready_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                os.close(read_fd)
+                temp = '{0}.{1}.tmp'.format(fileName, os.getpid())
+                if self._spill is not None:
+                    os.close(started_fd)
+                    self._spill.reopen()
+                    self._spill.snapshot()
+                    os.write(ready_fd, b'1')
+                    os.close(ready_fd)
+                self._write_workbook(temp, compression)
+                os.rename(temp, fileName)
+            except BaseException:
+                status = 1
+                os.write(write_fd, traceback.format_exc().encode('utf-8'))
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        if self._spill is not None:
+            # writing can go on once the child reads its own snapshot
+            # (or has failed, closing the pipe)
+            os.close(ready_fd)
+            os.read(started_fd, 1)
+            os.close(started_fd)
+        return pid, read_fd
+
+
+    def close_workbook(self):
+        '''Close the file a READ mode workbook is streamed from
+
+        Also removes the file spilled sheets are kept in, so the
+        workbook can't be used after this. Background saves still
+        reading it are waited for first.
+        '''
+        if self.mode == READ and 'workbook' in self.__dict__:
+            self.workbook.close()
+        if self._spill is not None:
+            for future in self._forks:
+                future.exception()      # waits for it
+            self._forks = []
+            self._spill.close()
+            self._spill = None
+            self._stores.clear()
+
+
+    def _stream(self):
+        """Return the row buffer of the active sheet in STREAM mode"""
+        if self.mode != STREAM:
+            self._unsupported('Writing')
+        try:
+            return self._streams[self.worksheet]
+        except KeyError:
+            stream = self._streams[self.worksheet] = _RowStream(self.worksheet)
+            return stream
+
+
+    def _check_layout(self, name):
+        """Raise once a STREAM sheet's layout has been written out"""
+        stream = self._streams.get(self.worksheet)
+        if stream is not None and stream.flushed:
+            raise ValueError('{0} must be called before the first row is '
+                             'flushed in stream mode'.format(name))
+
+
+    def _unsupported(self, name):
+        """Raise for operations the current mode can't do"""
+        raise TypeError('{0} is not available in {1} mode'.format(
+            name, self.mode))
+
+
+    def _say(self, message, *args):
+        """Print a progress message unless quiet, and log it"""
+        if not self.quiet:
+            print(message % args)
+        self.log.debug(message, *args)
+
+
+    # STORAGE
+    def _check_budget(self, ws):
+        """Spill a sheet to disk once it holds more cells than the budget"""
+        if self._budget is None:
+            return
+        store = self._stores.get(ws)
+        if store is None:
+            if len(ws._cells) > self._budget:
+                self._spill_sheet(ws)
+        elif store.in_memory and len(store) > self._budget:
+            self._spill_sheet(ws)
+
+
+    def _stage_sheet(self, ws):
+        """Move the cells of a sheet into typed column arrays"""
+        from xl.storage import ColumnStore
+        store = self._stores[ws] = ColumnStore()
+        store.take(ws._cells, self.workbook._cell_styles)
+
+
+    def _spill_sheet(self, ws):
+        """Move the cells of a sheet into the spill file
+
+        Cells that can't be stored (merged cells, cells with a link or
+        comment, rich text) stay in the sheet and take precedence over
+        the store at their position.
+        """
+        from openpyxl.styles.cell_style import StyleArray
+        from xl.storage import SpillFile
+        if self._spill is None:
+            self._spill = SpillFile(self._spill_dir)
+        store = self._spill.sheet()
+        styles = self.workbook._cell_styles
+        staged = self._stores.get(ws)
+        if staged is not None:
+            for row, column, value, style in store.extend(staged.cells()):
+                if (row, column) not in ws._cells:
+                    cell = ws.cell(row=row, column=column, value=value)
+                    if style is not None:
+                        cell._style = StyleArray(styles[style])
+            staged.drop()
+        self._stores[ws] = store
+        count = store.take(ws._cells, styles)
+        self.log.debug('Spilled %s cells of %s', count, ws.title)
+
+
+    def _hold(self, ws, store, column, row):
+        """Return an in-memory cell of a stored sheet, made from the store
+
+        """
+        cell = ws._cells.get((row, column))
+        if cell is None:
+            cell = ws.cell(row=row, column=column, value=store.get(column,
+                                                                  row))
+            style = store.style(column, row)
+            if style is not None:
+                from openpyxl.styles.cell_style import StyleArray
+                cell._style = StyleArray(self.workbook._cell_styles[style])
+        return cell
+
+
+    def _used_size(self, ws=None):
+        """Return (max column, max row) of a sheet's cells, default active"""
+        if ws is None:
+            ws = self.worksheet
+        store = self._stores.get(ws)
+        bounds = store.bounds() if store is not None else None
+        if bounds is None:
+            return ws.max_column, ws.max_row
+        if not ws._cells:
+            return bounds[2], bounds[3]
+        return max(bounds[2], ws.max_column), max(bounds[3], ws.max_row)
+
+
+    # INSTRUMENTATION
+    def instrument(self, on=True):
+        """Start or stop collecting call statistics
+
+        While on, each call of the write*, read*, style*, save and load
+        methods adds to its count, wall time and cells touched, see
+        stats(). The methods are wrapped on this instance only, so when
+        off there is no cost at all. A method's time includes the
+        methods it calls (append_table_row calls append_table_rows).
+
+        @param on : True to start, False to stop
+        """
+        if on == self._instrumented:
+            return
+        self._instrumented = on
+        for name, cells in _INSTRUMENTED.items():
+            if on:
+                self.__dict__[name] = _timed(self, name,
+                                             getattr(self, name), cells)
+            else:
+                del self.__dict__[name]
+
+
+    def stats(self):
+        """Return the call statistics collected while instrumented
+
+        @return {method: {'calls', 'seconds', 'cells'}} for each method
+                called, load_workbook and load_sheet are the (lazy)
+                loads of the file and of each of its sheets
+        """
+        return dict((name, {'calls': calls, 'seconds': seconds,
+                            'cells': cells})
+                    for name, (calls, seconds, cells) in self._stats.items()
+                    if calls)
+
+
+    def reset_stats(self):
+        """Clear the call statistics"""
+        for entry in self._stats.values():
+            entry[:] = [0, 0.0, 0]
+
+
+    @contextlib.contextmanager
+    def profile(self):
+        """Collect call statistics for a block of code
+
+        with xl.profile() as prof:
+            xl.write_block('A1', rows)
+        prof['write_block']['seconds']
+
+        The dict given holds the statistics of the calls made in the
+        block once it exits, instrumenting is restored to how it was.
+        """
+        was = self._instrumented
+        before = self.stats()
+        self.instrument()
+        prof = {}
+        try:
+            yield prof
+        finally:
+            self.instrument(was)
+            for name, entry in self.stats().items():
+                old = before.get(name, {'calls': 0, 'seconds': 0.0,
+                                        'cells': 0})
+                if entry['calls'] > old['calls']:
+                    prof[name] = dict((key, entry[key] - old[key])
+                                      for key in entry)
 
 
     # WORKSHEET METHODS
@@ -122,13 +1390,21 @@ class XLUtil:
         """Return a list of all the worksheets
 
         """
+        if self.__dict__.get('_source'):
+            if self._sheetnames is None:
+                from xl.reader import read_sheet_names
+                self._sheetnames = read_sheet_names(self._source)
+            return list(self._sheetnames)
         return self.workbook.sheetnames
 
     
     def get_active_sheet(self):
         """Return the active worksheet
 
+        The sheet counts as changed for save_workbook, as it may be
+        changed through openpyxl.
         """
+        self._dirty.add(self.worksheet)
         return self.worksheet
 
     
@@ -138,7 +1414,7 @@ class XLUtil:
         @param sheetName: name of new worksheet
         @param index: position of new worksheet (default 0)
         """
-        self.workbook.create_sheet(sheetName, index)
+        self._measured.add(self.workbook.create_sheet(sheetName, index))
 
     
     def select_sheet(self, sheetName):
@@ -147,9 +1423,9 @@ class XLUtil:
         @param sheetName: name of the worksheet to work in
         """
         if sheetName not in self.get_sheets():
-            make_sheet(sheetname)
+            self.make_sheet(sheetName)
             
-        self.worksheet = self.workbook[sheetName]
+        self.worksheet = self._sheet(self.workbook[sheetName])
 
         
     def remove_sheet(self, sheetName):
@@ -158,15 +1434,155 @@ class XLUtil:
         @param sheetName: name of the worksheet to remove
         """
         if sheetName in self.get_sheets():
+            self._streams.pop(self.workbook[sheetName], None)
+            self._widths.pop(self.workbook[sheetName], None)
+            self._unmeasured.pop(self.workbook[sheetName], None)
+            self._stale.pop(self.workbook[sheetName], None)
+            if self._reader is not None:
+                self._reader.pending.pop(self.workbook[sheetName], None)
+                self._reader.parts.pop(self.workbook[sheetName], None)
+            self._dirty.discard(self.workbook[sheetName])
+            self._merges.pop(self.workbook[sheetName], None)
+            for key in [key for key in self._indexes
+                        if key[0] is self.workbook[sheetName]]:
+                del self._indexes[key]
+            if (self._indexed is not None and
+                    self._indexed[0] is self.workbook[sheetName]):
+                self._indexed = None
+            store = self._stores.pop(self.workbook[sheetName], None)
+            if store is not None:
+                store.drop()
+            for name, ext in list(self._tables.items()):
+                if ext[0] is self.workbook[sheetName]:
+                    del self._tables[name]
             self.workbook.remove(self.workbook[sheetName])
+            self._calc = None
+
+    def copy_sheet(self, src, dest, source=None):
+        """Copy a sheet to a new sheet, from this or another workbook
 
-    def copy_sheet(self, src, dest):
-        """Copy a sheet
+        Values, styles, hyperlinks, comments, merged ranges, row and
+        column dimensions, freeze panes, print titles and the page setup
+        are copied, the cells straight into the new sheet. Styles from
+        another workbook are moved over once per distinct style and
+        remembered, so copying the same template again (or its styled
+        cells) only looks them up.
 
-        @param src : sheet to be copied
-        @param dst : sheet to copy to
+        @param src : name of the sheet to copy
+        @param dest : name of the new sheet, added after the others
+        @param source : XLUtil or openpyxl workbook holding src, default
+                        this workbook
+
+        Note: tables, images, charts, conditional formats and data
+        validations aren't copied, as with openpyxl's copy_worksheet
         """
-        dest = this.workbook.copy_worksheet(src)
+        if self.mode != NORMAL:
+            self._unsupported('copy_sheet')
+        if dest in self.get_sheets():
+            raise ValueError('Sheet {0} already exists'.format(dest))
+        stores = {}
+        if source is None:
+            source = self
+        if isinstance(source, XLUtil):
+            if source.mode != NORMAL:
+                source._unsupported('copy_sheet')
+            stores = source._stores
+            original = source._sheet(source.workbook[src])
+        elif source.read_only:
+            raise TypeError('Sheets of a read-only workbook cannot be copied')
+        else:
+            original = source[src]
+        other = original.parent
+        ws = self.workbook.create_sheet(dest)
+        if other is self.workbook:
+            moved = None
+        else:
+            moved = self._moved_styles.get(other)
+            if moved is None:
+                moved = self._moved_styles[other] = {}
+        self._copy_cells(original, ws, stores.get(original), moved)
+
+        for attr in ('row_dimensions', 'column_dimensions'):
+            dimensions = getattr(ws, attr)
+            for key, dim in getattr(original, attr).items():
+                dim = dimensions[key] = copy(dim)
+                dim.parent = ws
+                if moved is not None and dim._style is not None:
+                    dim._style = self._moved_style(other, dim._style, moved)
+        from openpyxl.worksheet.merge import MergedCellRange
+        for cr in original.merged_cells.ranges:
+            ws.merged_cells.ranges.add(MergedCellRange(ws, cr.coord))
+        ws.sheet_format = copy(original.sheet_format)
+        ws.sheet_properties = copy(original.sheet_properties)
+        ws.page_margins = copy(original.page_margins)
+        ws.page_setup = copy(original.page_setup)
+        ws.page_setup._parent = ws
+        ws.print_options = copy(original.print_options)
+        ws.freeze_panes = original.freeze_panes
+        ws._print_rows = copy(original._print_rows)
+        ws._print_cols = copy(original._print_cols)
+        ws._print_area = copy(original._print_area)
+
+        self._dirty.add(ws)
+        self._calc = None
+        if self._compact:
+            self._stage_sheet(ws)
+        self._check_budget(ws)
+
+
+    def _copy_cells(self, original, ws, store, moved):
+        """Copy the cells of a sheet (and its store) into another sheet
+
+        @param moved : {style of the original's workbook: StyleArray} to
+                       move styles with, None within one workbook
+        """
+        from openpyxl.cell import Cell, MergedCell
+        other = original.parent
+        cells = ws._cells
+        new = Cell.__new__
+        if store is not None:
+            styles = other._cell_styles
+            for row, column, value, style in store.cells():
+                cell = cells[(row, column)] = Cell(ws, row=row,
+                                                   column=column, value=value)
+                if style is not None:
+                    style = styles[style]
+                    cell._style = (style.__copy__() if moved is None else
+                                   self._moved_style(other, style, moved))
+        for (row, column), cell in original._cells.items():
+            style = cell._style
+            if style is not None:
+                style = (style.__copy__() if moved is None else
+                         self._moved_style(other, style, moved))
+            if cell.__class__ is MergedCell:
+                copied = cells[(row, column)] = MergedCell(ws, row, column)
+                if style is not None:
+                    copied._style = style
+                continue
+            copied = cells[(row, column)] = new(Cell)
+            copied.row = row
+            copied.column = column
+            copied._value = cell._value
+            copied.data_type = cell.data_type
+            copied.parent = ws
+            copied._hyperlink = copied._comment = None
+            copied._style = style
+            if cell._hyperlink is not None:
+                copied._hyperlink = copy(cell._hyperlink)
+            if cell._comment is not None:
+                copied.comment = copy(cell._comment)
+        if cells:
+            ws._current_row = max(ws._current_row,
+                                  max(row for row, column in cells))
+
+
+    def _moved_style(self, other, style, moved):
+        """Return a StyleArray of this workbook for a style of other"""
+        key = tuple(style)
+        found = moved.get(key)
+        if found is None:
+            found = moved[key] = _moved_style(self.workbook, other, style)
+        return found.__copy__()
 
         
     def rename_sheet(self, newName):
@@ -175,6 +1591,7 @@ class XLUtil:
         @param newName : string
         """
         self.worksheet.title = newName
+        self._calc = None
 
         
     # CELL VALUES
@@ -182,17 +1599,12 @@ class XLUtil:
         """Parse the coordinate string for column & row value
 
         @param coordinate : string value of coordinate (eg "B2")
+                            or a (column, row) tuple
         @return [column, row] : numeric values
 
-        Note: Does not catch no match (search returns NoneType)
+        Note: raises ValueError when the coordinate can't be parsed
         """
-        # match any alpha char [a-z], one or more times (+) at start ^
-        col = re.search('^[a-zA-Z]+', coordinate).group()
-        
-        # match any digit (\d), one or more times (+) at end $
-        row = re.search('\d+$', coordinate).group()
-        
-        return [column_index_from_string(col), int(row)]
+        return list(parse_coord(coordinate))
 
     
     def make_coord(self, column, row):
@@ -202,19 +1614,18 @@ class XLUtil:
         @param row : integer value of row
         @return coord : string of format 'A1"
         """                
-        return get_column_letter(column)+str(row)
+        return column_letter(column) + str(row)
                 
 
     def get_span(self, coords):
         """Parse a span of coordinates for row & column values
 
         @param coords : string of coords (eg "A1:B2")
+                        or a pair of coordinates ((1, 1), (2, 2))
         @return [col1, row1], [col2, row2] : ints of cols & rows
         """
-        idx = coords.index(':')
-        coord1 = self.get_coord(coords[0:idx])
-        coord2 = self.get_coord(coords[idx+1:])
-        return coord1, coord2
+        coord1, coord2 = parse_span(coords)
+        return list(coord1), list(coord2)
 
     
     def make_span(self, coord1, coord2):
@@ -224,40 +1635,102 @@ class XLUtil:
         @param coord2 : list [column, row] of ending numeric vals
         @return span : string of form "A1:B2"
         """
-        coord1 = self.make_coord(coord1[0], coord1[1])
-        coord2 = self.make_coord(coord2[0], coord2[1])
-        return coord1 + ':' + coord2
+        return span_string((coord1, coord2))
 
     
     # READING AND WRITING METHODS
+    #
+    # Every coord below may be an "A1" string or a (column, row) tuple.
+    # The row/column/block helpers work on integers from there on.
     def write(self, coord, value):
         """Write to a cell in the active sheet
 
         @param coord : string of format 'A1"
         @param value : data to write to cell
         """
-        column, row = self.get_coord(coord)
-        self.worksheet.cell(row=row, column=column).value = value
+        column, row = parse_coord(coord)
+        if self.mode != NORMAL:
+            return self._stream().put(column, row, value)
+        ws = self.worksheet
+        self._dirty.add(ws)
+        if self._calc is not None:
+            self._calc.written(ws.title, column, row, ((value,),))
+        if self._indexes:
+            self._index_written(ws, column, row, ((value,),))
+        if ws in self._stores:
+            self._store_put(ws, column, row, value)
+        else:
+            cell = ws.cell(row=row, column=column)
+            if cell._value is not None:
+                self._stale_widths(ws).add(column)
+            cell.value = value
+            if self._budget is not None:
+                self._check_budget(ws)
+        if value is not None:
+            widths = self._sheet_widths()
+            length = len(value if value.__class__ is str else str(value))
+            if length > widths.get(column, 0):
+                widths[column] = length
+
+
+    def _store_put(self, ws, column, row, value):
+        """Write a value to a compact or spilled sheet"""
+        store = self._stores[ws]
+        if (row, column) in ws._cells:
+            cell = ws._cells[(row, column)]
+            if cell._value is not None:
+                self._stale_widths(ws).add(column)
+            cell.value = value
+            return
+        if store.get(column, row) is not None:
+            self._stale_widths(ws).add(column)
+        try:
+            store.put(column, row, value)
+        except TypeError:
+            self._hold(ws, store, column, row).value = value
+        if self._budget is not None:
+            self._check_budget(ws)
 
         
-    def read(self, coord):
+    def read(self, coord, evaluate=False):
         """Read from a cell in the active sheet
 
         @param coord : string of format 'A1"
+        @param evaluate : NORMAL mode only, give a formula's value
+                          instead of its text, see recalculate()
         """
-        column, row = self.get_coord(coord)
+        column, row = parse_coord(coord)
+        if evaluate:
+            if self.mode != NORMAL:
+                self._unsupported('read(evaluate=True)')
+            return self._calculator().value(self.worksheet.title, column,
+                                            row)
+        if self.mode == NORMAL:
+            return self._cell_value(self.worksheet, column, row)
+        if self.mode == STREAM:
+            self._unsupported('read')
         return self.worksheet.cell(row=row, column=column).value
 
     
+    def _cell_value(self, ws, column, row):
+        """Return the value of a cell of a sheet in NORMAL mode"""
+        cell = ws._cells.get((row, column))
+        if cell is not None:
+            return cell.value
+        store = self._stores.get(ws)
+        return store.get(column, row) if store is not None else None
+
+
     def write_row(self, coord, values):
         """Write to the cells in a row
 
         @param coord : string of format 'A1"
         @param values : a list of values to write
         """
-        column, row = self.get_coord(coord)
-        for i in range(len(values)):
-            self.write(self.make_coord(column+i, row), values[i])
+        column, row = parse_coord(coord)
+        if self.mode != NORMAL:
+            return self._stream().put_row(column, row, values)
+        self._put_rows(column, row, (values,))
 
             
     def read_row(self, coord, length):
@@ -267,9 +1740,12 @@ class XLUtil:
         @param length : the number of cells to read
         @return values : list of values read
         """
-        column, row = self.get_coord(coord)
-        return [self.read( self.make_coord(column+i, row) )
-                for i in range(length)]
+        column, row = parse_coord(coord)
+        if length < 1:
+            return []
+        for values in self.iter_rows(((column, row),
+                                      (column+length-1, row))):
+            return list(values)
 
     def write_column(self, coord, values):
         """Write to the cells in a column
@@ -277,9 +1753,13 @@ class XLUtil:
         @param coord : string of format 'A1"
         @param values : a list of values to write
         """
-        column, row = self.get_coord(coord)
-        for i in range(len(values)):            
-            self.write(self.make_coord(column, row+i), values[i])
+        column, row = parse_coord(coord)
+        if self.mode != NORMAL:
+            stream = self._stream()
+            for i, value in enumerate(values):
+                stream.put(column, row+i, value)
+            return
+        self._put_rows(column, row, ((value,) for value in values))
     
             
     def read_column(self, coord, length):
@@ -289,24 +1769,153 @@ class XLUtil:
         @param length : the number of cells to read
         @return values : list of values read
         """
-        column, row = self.get_coord(coord)
-        return [self.read( self.make_coord(column, row+i) )
-                for i in range(length)]
+        column, row = parse_coord(coord)
+        if length < 1:
+            return []
+        return [values[0] for values in
+                self.iter_rows(((column, row), (column, row+length-1)))]
 
     
     def write_block(self, coord, values):
         """Write to the cells in both columns and rows
 
         @param coord : starting cell, string of format "A1"
-        @param values : list of lists to write, [ [1,2], [3,4] ]
+        @param values : list of lists to write, [ [1,2], [3,4] ],
+                        or a 2-D numpy array / buffer-protocol object
 
         Note: values don't have to be equal in length
         """
-        column, row = self.get_coord(coord)
-        for i in range(len(values)):
-            for j in range(len(values[i])):
-                self.write(self.make_coord(column+j, row+i),
-                           values[i][j])
+        column, row = parse_coord(coord)
+        values, data_type = _block_rows(values)
+        self._write_block(column, row, values, data_type)
+
+
+    def _write_block(self, column, row, values, data_type=None):
+        """Write rows of values from (column, row) in any writable mode"""
+        if self.mode != NORMAL:
+            stream = self._stream()
+            for i, row_values in enumerate(values):
+                stream.put_row(column, row+i, row_values)
+            return
+        self._put_rows(column, row, values, data_type)
+
+
+    def _put_rows(self, column, row, rows, data_type=None):
+        """Write rows of values into the active sheet from (column, row)
+
+        Cells are created straight into the sheet, skipping the
+        per-cell lookups and checks of worksheet.cell(). When data_type
+        is known for every value (numeric arrays) new cells are filled
+        in directly instead of going through Cell type detection.
+        """
+        if column < 1 or row < 1:
+            raise ValueError('Row or column values must be at least 1')
+        ws = self.worksheet
+        self._dirty.add(ws)
+        if self._calc is not None or self._indexes:
+            rows = [values if isinstance(values, (list, tuple))
+                    else list(values) for values in rows]
+            if self._calc is not None:
+                self._calc.written(ws.title, column, row, rows)
+            if self._indexes:
+                self._index_written(ws, column, row, rows)
+        if self._compact and ws not in self._stores:
+            self._stage_sheet(ws)
+        if ws in self._stores:
+            return self._store_rows(ws, column, row, rows, data_type)
+        from openpyxl.cell import Cell
+        cells = ws._cells
+        get = cells.get
+        widths = self._sheet_widths()
+        width = widths.get
+        # overwritten values may have been the longest in their column
+        stale = self._stale_widths(ws)
+        last = row - 1
+        if data_type is None:
+            for last, values in enumerate(rows, row):
+                for col, value in enumerate(values, column):
+                    cell = get((last, col))
+                    if cell is None:
+                        cells[(last, col)] = Cell(ws, row=last, column=col,
+                                                  value=value)
+                    else:
+                        if cell._value is not None:
+                            stale.add(col)
+                        cell.value = value
+                    if value is not None:
+                        length = len(value if value.__class__ is str
+                                     else str(value))
+                        if length > width(col, 0):
+                            widths[col] = length
+        else:
+            new = Cell.__new__
+            for last, values in enumerate(rows, row):
+                for col, value in enumerate(values, column):
+                    cell = get((last, col))
+                    if cell is None:
+                        cell = cells[(last, col)] = new(Cell)
+                        cell.row = last
+                        cell.column = col
+                        cell._value = value
+                        cell.data_type = data_type
+                        cell.parent = ws
+                        cell._hyperlink = cell._comment = None
+                        cell._style = None
+                    else:
+                        if cell._value is not None:
+                            stale.add(col)
+                        cell.value = value
+            # numbers are measured only if the sheet is autosized
+            if last >= row:
+                end = column + len(values) - 1
+                self._unmeasured.setdefault(ws, []).append(
+                    ((column, row), (end, last)))
+        if last > ws._current_row:
+            ws._current_row = last
+        if self._budget is not None:
+            self._check_budget(ws)
+
+
+    def _store_rows(self, ws, column, row, rows, data_type=None):
+        """Write rows of values into a stored sheet from (column, row)"""
+        store = self._stores[ws]
+        rows = [values if isinstance(values, (list, tuple)) else list(values)
+                for values in rows]
+        last = row + len(rows) - 1
+        bounds = store.bounds()
+        if rows and bounds is not None and row <= bounds[3] and \
+                last >= bounds[1]:
+            # stored values may be overwritten, their widths are stale
+            end = column + max(len(values) for values in rows) - 1
+            self._stale_widths(ws).update(range(column, end + 1))
+        for col, r, value in store.put_rows(column, row, rows):
+            self._hold(ws, store, col, r).value = value
+        # cells held in memory hide the stored ones, so they are set too
+        for (r, col), cell in list(ws._cells.items()):
+            if row <= r <= last and col >= column:
+                values = rows[r-row]
+                if col - column < len(values):
+                    if cell._value is not None:
+                        self._stale_widths(ws).add(col)
+                    cell.value = values[col-column]
+        if data_type is None:
+            widths = self._sheet_widths()
+            width = widths.get
+            for values in rows:
+                for col, value in enumerate(values, column):
+                    if value is not None:
+                        length = len(value if value.__class__ is str
+                                     else str(value))
+                        if length > width(col, 0):
+                            widths[col] = length
+        elif rows:
+            end = column + max(len(values) for values in rows) - 1
+            self._unmeasured.setdefault(ws, []).append(
+                ((column, row), (end, last)))
+        if last > ws._current_row:
+            ws._current_row = last
+        if self._budget is not None:
+            self._check_budget(ws)
 
                 
     def read_block(self, span):
@@ -315,12 +1924,115 @@ class XLUtil:
         @param span : string of format 'A1:B2'
         @return table : list of lists, list of rows read
         """
-        ([col1, row1], [col2, row2]) = self.get_span(span)        
-        table_width = col2 - col1 + 1
-        table_height = row2 - row1 + 1
-        return [self.read_row(self.make_coord(col1, row1+i),
-                              table_width)
-                for i in range(table_height)]
+        return [list(values) for values in self.iter_rows(span)]
+
+
+    def read_block_array(self, span, dtype=None):
+        """Read from the cells specified by the span into a numpy array
+
+        @param span : string of format 'A1:B2'
+        @param dtype : numpy dtype, inferred from the values if None
+        @return array : 2-D ndarray, one row per sheet row
+
+        Note: all numbers (and empty cells) give float64 with NaN for the
+        empty cells, all ints give int64, all dates give datetime64 with
+        NaT for the empty cells and anything else an object array
+        """
+        import numpy
+        table = self.read_block(span)
+        if dtype is None:
+            dtype = _infer_dtype(set(map(type, chain.from_iterable(table))))
+        return numpy.array(table, dtype=dtype)
+
+
+    def iter_rows(self, span=None, values_only=True, chunk_size=None):
+        """Lazily iterate over the rows of the active sheet
+
+        @param span : string of format 'A1:B2' (default is the used area)
+        @param values_only : yield values (True) or openpyxl cells (False)
+        @param chunk_size : if given, yield lists of up to chunk_size rows
+        @return generator of row tuples (or lists of row tuples)
+
+        Note: in READ mode the sheet is parsed as it is iterated, so even
+        very large sheets are never held in memory
+        """
+        if self.mode == STREAM:
+            self._unsupported('iter_rows')
+        ws = self.worksheet
+        if not values_only and ws in self._stores:
+            raise TypeError('{0} is kept on disk, only its values can be '
+                            'iterated'.format(ws.title))
+        if span is None:
+            if self.mode == NORMAL and values_only:
+                if not ws._cells and ws not in self._stores:
+                    return iter(())
+                span = ((1, 1), self._used_size())
+            else:
+                rows = ws.iter_rows(values_only=values_only)
+        if span is not None:
+            (col1, row1), (col2, row2) = parse_span(span)
+            if self.mode == NORMAL and values_only:
+                rows = self._iter_values(col1, row1, col2, row2)
+            else:
+                rows = ws.iter_rows(min_row=row1, max_row=row2,
+                                    min_col=col1, max_col=col2,
+                                    values_only=values_only)
+        if chunk_size is None:
+            return rows
+        return _chunked(rows, chunk_size)
+
+
+    def iter_block(self, span=None, chunk_size=1000, values_only=True):
+        """Lazily iterate over a span in blocks of rows
+
+        @param span : string of format 'A1:B2' (default is the used area)
+        @param chunk_size : number of rows in each block
+        @param values_only : yield values (True) or openpyxl cells (False)
+        @return generator of lists of row tuples
+        """
+        return self.iter_rows(span, values_only, chunk_size)
+
+
+    def _iter_values(self, col1, row1, col2, row2, ws=None):
+        """Return row tuples of values without creating empty cells
+
+        @param ws : worksheet to read, default the active sheet
+        """
+        if ws is None:
+            ws = self.worksheet
+        store = self._stores.get(ws)
+        if store is not None:
+            return self._iter_stored(store, col1, row1, col2, row2, ws)
+        return self._iter_cells(col1, row1, col2, row2, ws)
+
+
+    def _iter_cells(self, col1, row1, col2, row2, ws=None):
+        """Yield row tuples of values from the sheet's cells"""
+        if ws is None:
+            ws = self.worksheet
+        get = ws._cells.get
+        columns = range(col1, col2+1)
+        for row in range(row1, row2+1):
+            yield tuple([get((row, column), _EMPTY).value
+                         for column in columns])
+
+
+    def _iter_stored(self, store, col1, row1, col2, row2, ws=None):
+        """Yield row tuples of values of a compact or spilled sheet"""
+        if ws is None:
+            ws = self.worksheet
+        held = {}
+        for (row, column), cell in ws._cells.items():
+            if row1 <= row <= row2 and col1 <= column <= col2:
+                held.setdefault(row, []).append((column - col1, cell))
+        for row, values in enumerate(store.values(col1, row1, col2, row2),
+                                     row1):
+            if row in held:
+                values = list(values)
+                for i, cell in held[row]:
+                    values[i] = cell.value
+                values = tuple(values)
+            yield values
 
     
     def append_row(self, values):
@@ -328,68 +2040,696 @@ class XLUtil:
 
         @param values : list of values
         """
-        self.worksheet.append(row)
+        if self.mode != NORMAL:
+            stream = self._stream()
+            return stream.put_row(1, stream.next_row(), values)
+        self._put_rows(1, self.worksheet._current_row + 1, (values,))
+
+
+    # FORMULAS
+    def recalculate(self):
+        """Evaluate every formula of the workbook that is out of date
+
+        Values are cached once evaluated, writing a cell only clears the
+        formulas that depend on it (directly or through other formulas),
+        so read(coord, evaluate=True) and recalculate() only redo those.
+        Supported: + - * / ^ & % and comparisons, cross sheet references
+        and SUM, AVERAGE, MIN, MAX, COUNT, COUNTA, IF, IFERROR, AND, OR,
+        NOT, ROUND, ABS, VLOOKUP, SUMIF, COUNTIF, CONCATENATE, LEN,
+        UPPER, LOWER. Anything else gives #NAME?.
+
+        @return count : number of formulas evaluated
+        """
+        if self.mode != NORMAL:
+            self._unsupported('recalculate')
+        return self._calculator().recalculate()
+
+
+    def _calculator(self):
+        """Return the formula Calculator, made on first use"""
+        if self._calc is None:
+            from xl.formula import Calculator
+            self._calc = Calculator(self._formula_input, self._formula_block,
+                                    self._formula_cells)
+        return self._calc
+
+
+    def _named_sheet(self, name):
+        """Return a worksheet by its name in any case, KeyError if none"""
+        for ws in self.workbook.worksheets:
+            if ws.title.lower() == name:
+                return self._sheet(ws)
+        raise KeyError(name)
+
+
+    def _formula_input(self, sheet, column, row):
+        """Return a cell's value (or formula) for the Calculator"""
+        return self._cell_value(self._named_sheet(sheet), column, row)
+
+
+    def _formula_block(self, sheet, col1, row1, col2, row2):
+        """Return the rows of values of a span for the Calculator"""
+        ws = self._named_sheet(sheet)
+        if row2 is None:
+            row2 = self._used_size(ws)[1]
+        return [list(values) for values in
+                self._iter_values(col1, row1, col2, row2, ws)]
+
+
+    def _formula_cells(self):
+        """Yield (sheet, column, row) of every formula in the workbook"""
+        from xl.formula import is_formula
+        for ws in self.workbook.worksheets:
+            ws = self._sheet(ws)
+            for (row, column), cell in ws._cells.items():
+                if is_formula(cell.value):
+                    yield ws.title, column, row
+            store = self._stores.get(ws)
+            if store is not None:
+                for row, column, value, style in store.cells():
+                    if (row, column) not in ws._cells and is_formula(value):
+                        yield ws.title, column, row
+
+
+    # LOOKUPS
+    def build_index(self, column, sheet=None):
+        """Index the values of a column for find and vlookup
+
+        The index is kept up to date by the methods writing to the
+        sheet (write, write_row, write_column, write_block, append_row,
+        import_csv, the table methods and merge), so lookups stay a dict
+        hit while the sheet is edited. Cells changed through openpyxl
+        directly aren't seen, build the index again after those.
+
+        @param column : column number or letters of the keys
+        @param sheet : name of the sheet, default the active sheet
+        @return index : {value: [rows holding it in order]}, without
+                        the empty cells, values match as in a dict
+                        (1 == 1.0 == True, text is case sensitive)
+        """
+        if self.mode != NORMAL:
+            self._unsupported('build_index')
+        ws = self._lookup_sheet(sheet)
+        if not isinstance(column, int):
+            column = column_index(column)
+        index = {}
+        last = self._used_size(ws)[1]
+        for row, values in enumerate(
+                self._iter_values(column, 1, column, last, ws), 1):
+            if values[0] is not None:
+                index.setdefault(values[0], []).append(row)
+        self._indexes[(ws, column)] = index
+        self._indexed = (ws, column)
+        return index
+
+
+    def find(self, value, column=None, sheet=None):
+        """Return the rows of a column holding a value
+
+        @param value : value to look for
+        @param column : column number or letters, default the column
+                        indexed last, indexed on first use
+        @param sheet : name of the sheet, default the active sheet
+        @return rows : list of row numbers, empty if none
+        """
+        ws, index = self._index(column, sheet)
+        return list(index.get(value, ()))
+
+
+    def vlookup(self, key, key_col, return_col, sheet=None, default=None):
+        """Return a value from the first row holding a key
+
+        @param key : value to look for in key_col
+        @param key_col : column number or letters of the keys, indexed
+                         on first use
+        @param return_col : column number or letters of the value
+        @param sheet : name of the sheet, default the active sheet
+        @param default : returned if the key isn't found
+        """
+        ws, index = self._index(key_col, sheet)
+        rows = index.get(key)
+        if not rows:
+            return default
+        if not isinstance(return_col, int):
+            return_col = column_index(return_col)
+        return self._cell_value(ws, return_col, rows[0])
+
+
+    def _index(self, column, sheet):
+        """Return (sheet, index) of a column, indexing it if needed"""
+        if column is None and sheet is None and self._indexed is not None:
+            ws, column = self._indexed
+        elif column is None:
+            raise ValueError('No column given and none has been indexed')
+        else:
+            ws = self._lookup_sheet(sheet)
+            if not isinstance(column, int):
+                column = column_index(column)
+        index = self._indexes.get((ws, column))
+        if index is None:
+            index = self.build_index(column, ws.title)
+        return ws, index
+
+
+    def _lookup_sheet(self, sheet):
+        """Return the sheet named sheet, or the active sheet if None"""
+        if sheet is None:
+            return self.worksheet
+        if sheet not in self.get_sheets():
+            raise ValueError('Sheet {0} does not exist'.format(sheet))
+        return self._sheet(self.workbook[sheet])
+
+
+    def _index_written(self, ws, column, row, rows):
+        """Move the rows about to be written in the indexes of a sheet
+
+        @param rows : the rows of values that will be written from
+                      (column, row), a short row leaves the cells past
+                      it unchanged
+        """
+        for (sheet, col), index in self._indexes.items():
+            i = col - column
+            if sheet is not ws or i < 0:
+                continue
+            last = row + len(rows) - 1
+            if last < row:
+                continue
+            old = self._iter_values(col, row, col, last, ws)
+            for r, (values, before) in enumerate(zip(rows, old), row):
+                if i >= len(values):
+                    continue
+                before, after = before[0], values[i]
+                found = index.get(before)
+                if found is not None and r in found:
+                    found.remove(r)
+                    if not found:
+                        del index[before]
+                if after is not None:
+                    found = index.setdefault(after, [])
+                    if found and found[-1] > r:
+                        insort(found, r)
+                    else:
+                        found.append(r)
+
+
+    # CSV
+    def import_csv(self, path, start="A1", chunk_rows=1000, coerce=True,
+                   header=False, delimiter=',', encoding='utf-8'):
+        """Write a csv file into the active sheet chunk by chunk
+
+        Only chunk_rows rows of the file are held at a time, so with a
+        STREAM mode sheet a csv of any size is converted in flat memory.
+
+        @param path : csv file to read
+        @param start : top left cell, string of format "A1"
+        @param chunk_rows : number of rows read and written at a time
+        @param coerce : True to turn numbers into int/float and empty
+                        fields into empty cells, False to write the
+                        strings as read, a function to apply to every
+                        value or a list of functions (or None) by column
+        @param header : the first row is a header, written uncoerced
+        @param delimiter : field separator
+        @param encoding : text encoding of the file
+        @return rows : number of rows written, header included
+        """
+        column, row = parse_coord(start)
+        convert = _row_coercer(coerce)
+        count = 0
+        with _open_csv(path, 'r', encoding) as fh:
+            reader = csv.reader(fh, delimiter=delimiter)
+            if header:
+                for values in islice(reader, 1):
+                    self._write_block(column, row, (values,))
+                    count = 1
+            while True:
+                chunk = list(islice(reader, chunk_rows))
+                if not chunk:
+                    break
+                if convert is not None:
+                    chunk = list(map(convert, chunk))
+                self._write_block(column, row + count, chunk)
+                count += len(chunk)
+        self.log.debug('Imported %s rows from %s', count, path)
+        return count
+
+
+    def export_csv(self, path, span=None, chunk_rows=1000, coerce=None,
+                   delimiter=',', encoding='utf-8'):
+        """Write the cells of the active sheet to a csv file
+
+        Rows are read and written chunk_rows at a time. In READ mode the
+        sheet is also parsed as it goes, so any size of sheet is
+        exported in flat memory.
+
+        @param path : csv file to write
+        @param span : string of format 'A1:B2' (default is the used area)
+        @param chunk_rows : number of rows read and written at a time
+        @param coerce : a function to apply to every value or a list of
+                        functions (or None) by column, empty cells are
+                        written as empty fields
+        @param delimiter : field separator
+        @param encoding : text encoding of the file
+        @return rows : number of rows written
+        """
+        convert = _row_coercer(coerce)
+        count = 0
+        with _open_csv(path, 'w', encoding) as fh:
+            writer = csv.writer(fh, delimiter=delimiter)
+            for chunk in self.iter_rows(span, chunk_size=chunk_rows):
+                if convert is not None:
+                    chunk = list(map(convert, chunk))
+                writer.writerows(chunk)
+                count += len(chunk)
+        self.log.debug('Exported %s rows to %s', count, path)
+        return count
+
+
+    # DATAFRAMES
+    def to_dataframe(self, span=None, header=True, chunksize=None):
+        """Read cells of the active sheet into a pandas DataFrame
+
+        Rows are read _FRAME_ROWS at a time and gathered by column, each
+        column is made into one numpy array, so the rows are never all
+        held as lists. A column's dtype is picked from its values as in
+        read_block_array: int64, float64 (NaN for empty cells), bool,
+        datetime64 (NaT for empty cells) or object.
+
+        @param span : string of format 'A1:B2' (default is the used area)
+        @param header : the first row holds the column names, else the
+                        columns are named by their letters
+        @param chunksize : if given, return an iterator of DataFrames of
+                           up to chunksize rows (each chunk's dtypes are
+                           picked from its own values)
+        @return DataFrame, or iterator of DataFrames with chunksize
+
+        Note: in READ mode the sheet is parsed as it is read, so with
+        chunksize a sheet of any size is converted in flat memory
+        """
+        import pandas
+        col1 = parse_span(span)[0][0] if span is not None else 1
+        rows = iter(self.iter_rows(span))
+        names = next(rows, ()) if header else None
+        chunks = _chunked(rows, chunksize or _FRAME_ROWS)
+        if chunksize:
+            return (self._frame(pandas, names, col1, list(zip(*chunk)))
+                    for chunk in chunks)
+        columns = None
+        for chunk in chunks:
+            if columns is None:
+                columns = [list(values) for values in zip(*chunk)]
+            else:
+                for values, more in zip(columns, zip(*chunk)):
+                    values.extend(more)
+        return self._frame(pandas, names, col1, columns or [])
+
+
+    def _frame(self, pandas, names, col1, columns):
+        """Make a DataFrame of lists of values by column
+
+        Each list is dropped as soon as its array is made.
+        """
+        width = max(len(names or ()), len(columns))
+        letters = [column_letter(column)
+                   for column in range(col1, col1 + width)]
+        if names:
+            letters = [letters[i] if name is None else name
+                       for i, name in enumerate(names)]
+        arrays = {}
+        for i in range(width):
+            arrays[i] = _column_array(columns[i] if i < len(columns) else [])
+            if i < len(columns):
+                columns[i] = None
+        frame = pandas.DataFrame(arrays, copy=False)
+        frame.columns = letters
+        return frame
+
+
+    def from_dataframe(self, df, start="A1", index=False, header=True,
+                       header_style=True, chunk_rows=_FRAME_ROWS):
+        """Write a pandas DataFrame into the active sheet chunk by chunk
+
+        Each column is turned into cell values straight from its array,
+        chunk_rows rows at a time, so the frame is never copied whole:
+        numbers stay numbers (NaN is an empty cell, inf is text),
+        datetime64 and timedelta64 become datetime and timedelta. A
+        chunk of finite numbers only is written like a numeric
+        write_block array.
+
+        @param df : pandas DataFrame
+        @param start : top left cell, string of format "A1"
+        @param index : write the index (each level) as the first columns
+        @param header : write the column names as the first row
+        @param header_style : dict of style_block arguments for the
+                              header row, True for HEADER_STYLE, None
+                              to leave it plain
+        @param chunk_rows : number of rows converted and written at a time
+        @return rows : number of rows written, header included
+        """
+        column, row = parse_coord(start)
+        sources = []        # (header, pandas array) by sheet column
+        if index:
+            levels = df.index.names
+            for level, name in enumerate(levels):
+                if name is None:
+                    name = 'index' if len(levels) == 1 else \
+                           'level_{0}'.format(level)
+                sources.append((_frame_name(name),
+                                df.index.get_level_values(level).array))
+        for position, name in enumerate(df.columns):
+            sources.append((_frame_name(name), df.iloc[:, position].array))
+        if not sources:
+            return 0
+        count = 0
+        if header:
+            self._write_block(column, row, ([name for name, values
+                                             in sources],))
+            if header_style is True:
+                header_style = _style_constant('HEADER_STYLE')
+            if header_style:
+                self.style_block(((column, row),
+                                  (column + len(sources) - 1, row)),
+                                 **header_style)
+            count = 1
+        for first in range(0, len(df), chunk_rows):
+            columns, data_types = zip(*[
+                _frame_values(values[first:first+chunk_rows])
+                for name, values in sources])
+            self._write_block(column, row + count, list(zip(*columns)),
+                              'n' if set(data_types) == set(['n']) else None)
+            count += len(columns[0])
+        self.log.debug('Wrote a frame of %s rows', count)
+        return count
+
 
-        
     #FORMATING METHODS
     def merge(self, span):
         """Merge a span of cells to create one cell
 
         @param span : string value of cells ('A1:B2')
+
+        Note: a span overlapping cells already merged raises ValueError,
+        merging the exact same span again does nothing
         """
-        self.worksheet.merge_cells(span)
+        self.merge_many((span,))
+
+
+    def merge_many(self, spans):
+        """Merge many spans of cells, each into one cell
+
+        Each span is checked against the ranges already merged through
+        an index of the sheet's merged ranges, so the cost of a merge
+        doesn't grow with the number of merged ranges.
+
+        @param spans : list of spans ('A1:B2'), a span overlapping an
+                       earlier one raises ValueError, the spans before
+                       it are left merged
+        """
+        from openpyxl.cell import MergedCell
+        from openpyxl.worksheet.cell_range import CellRange
+        from openpyxl.worksheet.merge import MergedCellRange
+        ws = self._merge_sheet()
+        index = self._merge_index(ws)
+        ranges = ws.merged_cells.ranges
+        store = self._stores.get(ws)
+        if self.mode == NORMAL:
+            self._dirty.add(ws)
+        for span in spans:
+            coord = span_string(span)
+            (col1, row1), (col2, row2) = parse_span(coord)
+            found = index.overlapping(col1, row1, col2, row2)
+            if found:
+                if found[0].bounds == (col1, row1, col2, row2):
+                    continue
+                raise ValueError('{0} overlaps merged cells {1}'.format(
+                    coord, found[0].coord))
+            if self.mode != NORMAL:
+                cr = CellRange(coord)
+                ranges.add(cr)
+                index.add(cr)
+                continue
+            if store is not None:
+                # the top left cell keeps its value, it has to be in memory
+                self._hold(ws, store, col1, row1)
+            if self._calc is not None or self._indexes:
+                # the other cells lose their values
+                width = col2 - col1 + 1
+                for column, row, rows in (
+                        (col1 + 1, row1, [[None] * (width-1)]),
+                        (col1, row1 + 1, [[None] * width] * (row2 - row1))):
+                    if self._calc is not None:
+                        self._calc.written(ws.title, column, row, rows)
+                    if self._indexes:
+                        self._index_written(ws, column, row, rows)
+            cr = MergedCellRange(ws, coord)
+            ranges.add(cr)
+            index.add(cr)
+            # the widths of the columns that lose values are stale
+            cells = ws._cells
+            stale = self._stale_widths(ws)
+            if store is not None:
+                stale.update(range(col1, col2 + 1))
+            for key in islice(cr.cells, 1, None):
+                cell = cells.get(key)
+                if cell is not None and cell._value is not None:
+                    stale.add(key[1])
+            style = cr.start_cell._style
+            if style is not None and (style.borderId or style.protectionId):
+                # the borders and protection are copied to every cell
+                ws._clean_merge_range(cr)
+                continue
+            for key in islice(cr.cells, 1, None):
+                cells[key] = MergedCell(ws, *key)
 
 
     def unmerge(self, span):
         """Unmerge a span of cells to create many cells
 
-        @param span : string value of cells ('A1:B2')
+        @param span : string value of cells ('A1:B2'), it must have
+                      been merged as a whole
         """
-        self.worksheet.unmerge_cells(span)
+        ws = self._merge_sheet()
+        coord = span_string(span)
+        (col1, row1), (col2, row2) = parse_span(coord)
+        index = self._merge_index(ws)
+        for cr in index.overlapping(col1, row1, col2, row2):
+            if cr.bounds == (col1, row1, col2, row2):
+                break
+        else:
+            raise ValueError('Cell range {0} is not merged'.format(coord))
+        index.remove(cr)
+        ws.merged_cells.ranges.remove(cr)
+        if self.mode == NORMAL:
+            self._dirty.add(ws)
+            cells = cr.cells
+            next(cells)         # the top left cell stays
+            for key in cells:
+                ws._cells.pop(key, None)
+
+
+    def merged_range_at(self, coord):
+        """Return the merged span a cell is part of
+
+        @param coord : string of format 'A1'
+        @return span : string of format 'A1:B2', None if not merged
+        """
+        if self.mode == READ:
+            self._unsupported('merged_range_at')
+        column, row = parse_coord(coord)
+        ws = self._merge_sheet()
+        found = self._merge_index(ws).overlapping(column, row, column, row)
+        return found[0].coord if found else None
+
+
+    def _merge_sheet(self):
+        """Return the worksheet merge and unmerge work on for the mode"""
+        if self.mode == NORMAL:
+            return self.worksheet
+        return self._stream().worksheet
+
+
+    def _merge_index(self, ws):
+        """Return the index of a sheet's merged ranges
+
+        It is rebuilt if the ranges were changed other than through
+        XLUtil (ws.merge_cells...).
+        """
+        index = self._merges.get(ws)
+        if index is None or index.count != len(ws.merged_cells.ranges):
+            index = self._merges[ws] = _MergeIndex(ws.merged_cells.ranges)
+        return index
 
         
-    def style(self, coord, font=FONT, align=ALIGN,
-               num=FORMAT, fill=FILL):
+    def style(self, coord, font=None, align=None,
+               num=FORMAT, fill=None):
         """Style a cell with font, alignment, fill, and format
 
         @param coord : string value of cell ('A1')
         @param span : string value of cells ('A1:B2')
-        @param font : the font class of openpyxl
-        @param align : the align class of openpyxl
+        @param font : the font class of openpyxl (default FONT)
+        @param align : the align class of openpyxl (default ALIGN)
         @param num : the format class of openpyxl
-        @param fill : the fill class of openpyxl
+        @param fill : the fill class of openpyxl (default FILL)
         """
-        column, row = self.get_coord(coord)
-        cell = self.worksheet.cell(row=row, column=column)
-        cell.font = font
-        cell.alignment = align
-        cell.number_format = num
-        cell.fill = fill
+        column, row = parse_coord(coord)
+        ids = self._style_ids(font, align, num, fill)
+        self._dirty.add(self.worksheet)
+        if self.mode != NORMAL:
+            cell = self._stream().cell(column, row)
+        elif self.worksheet in self._stores:
+            return self._store_style(column, row, column, row, ids)
+        else:
+            cell = self.worksheet.cell(row=row, column=column)
+        _set_style(cell, ids)
 
 
-    def style_block(self, span, font=FONT, align=ALIGN,
-                    num=FORMAT, fill=FILL):
+    def style_block(self, span, font=None, align=None,
+                    num=FORMAT, fill=None):
         """Style a span of cells
 
         @param span : string value of cells ('A1:B2')
-        @param font : the font class of openpyxl
-        @param align : the align class of openpyxl
+        @param font : the font class of openpyxl (default FONT)
+        @param align : the align class of openpyxl (default ALIGN)
         @param num : the format class of openpyxl
-        @param fill : the fill class of openpyxl
+        @param fill : the fill class of openpyxl (default FILL)
         """
-        ([col1, row1], [col2, row2]) = self.get_span(span)
-        for i in range(col2-col1+1):
-            for j in range(row2 - row1 + 1):
-                self.style(self.make_coord(col1 + i, row1 + j),
-                           font, align, num, fill)
+        (col1, row1), (col2, row2) = parse_span(span)
+        ids = self._style_ids(font, align, num, fill)
+        columns = range(col1, col2+1)
+        if self.mode != NORMAL:
+            stream = self._stream()
+            for row in range(row1, row2+1):
+                for column in columns:
+                    _set_style(stream.cell(column, row), ids)
+            return
+        ws = self.worksheet
+        self._dirty.add(ws)
+        if ws in self._stores:
+            return self._store_style(col1, row1, col2, row2, ids)
+        get = ws._cells.get
+        font_id, fill_id, num_id, align_id = ids[0], ids[1], ids[3], ids[5]
+        for row in range(row1, row2+1):
+            for column in columns:
+                cell = get((row, column))
+                if cell is None:
+                    cell = ws.cell(row=row, column=column)
+                style = cell._style
+                if style is None:
+                    cell._style = ids.__copy__()
+                    continue
+                style[0] = font_id
+                style[1] = fill_id
+                style[3] = num_id
+                style[5] = align_id
+        if self._budget is not None:
+            self._check_budget(ws)
+
+
+    def _store_style(self, col1, row1, col2, row2, ids):
+        """Style a span of a compact or spilled sheet"""
+        styles = self.workbook._cell_styles
+
+        def change(index):
+            if index is None:
+                return styles.add(ids.__copy__())
+            style = styles[index].__copy__()
+            style[0], style[1], style[3], style[5] = (ids[0], ids[1],
+                                                      ids[3], ids[5])
+            return styles.add(style)
+
+        ws = self.worksheet
+        self._stores[ws].restyle(col1, row1, col2, row2, change)
+        for (row, column), cell in list(ws._cells.items()):
+            if row1 <= row <= row2 and col1 <= column <= col2:
+                _set_style(cell, ids)
+
+
+    def style_row(self, row, font=None, align=None,
+                  num=FORMAT, fill=None):
+        """Style a whole row through its row dimension
+
+        @param row : row number to style
+        @param font : the font class of openpyxl (default FONT)
+        @param align : the align class of openpyxl (default ALIGN)
+        @param num : the format class of openpyxl
+        @param fill : the fill class of openpyxl (default FILL)
+
+        Note: applies to the empty cells of the row, cells already
+        styled keep their own style (use style_block for those)
+        """
+        if self.mode == READ:
+            self._unsupported('style_row')
+        self._style_dimension(self.worksheet.row_dimensions[row],
+                              font, align, num, fill)
+
+
+    def style_column(self, column, font=None, align=None,
+                     num=FORMAT, fill=None):
+        """Style a whole column through its column dimension
+
+        @param column : column number (or letters) to style
+        @param font : the font class of openpyxl (default FONT)
+        @param align : the align class of openpyxl (default ALIGN)
+        @param num : the format class of openpyxl
+        @param fill : the fill class of openpyxl (default FILL)
+
+        Note: applies to the empty cells of the column, cells already
+        styled keep their own style (use style_block for those)
+        """
+        if self.mode == READ:
+            self._unsupported('style_column')
+        if not isinstance(column, _STRING_TYPES):
+            column = column_letter(column)
+        self._style_dimension(self.worksheet.column_dimensions[column],
+                              font, align, num, fill)
+
+
+    def _style_dimension(self, dimension, font, align, num, fill):
+        """Style a row or column dimension"""
+        self._dirty.add(self.worksheet)
+        _set_style(dimension, self._style_ids(font, align, num, fill))
+
+
+    def _style_ids(self, font, align, num, fill):
+        """Return the style array interned for a style combination
+
+        Each (font, align, num, fill) combination goes through openpyxl's
+        style de-duplication once per workbook, afterwards styling a cell
+        is just copying the four ids.
+        """
+        if font is None:
+            font = _style_constant('FONT')
+        if align is None:
+            align = _style_constant('ALIGN')
+        if fill is None:
+            fill = _style_constant('FILL')
+        key = (id(font), id(align), num, id(fill))
+        try:
+            return self._styles[key][0]
+        except KeyError:
+            pass
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(self.worksheet)
+        cell.font = font
+        cell.alignment = align
+        cell.number_format = num
+        cell.fill = fill
+        if len(self._styles) >= _CACHE_LIMIT:
+            self._styles.clear()
+        # keep the style objects alive so their ids stay unique
+        self._styles[key] = (cell._style, font, align, fill)
+        return cell._style
 
             
     def freeze(self, coord):
         """Freeze the rows and columns before the cell value given
 
         @param coord : string value of cell ('A1')
+
+        Raises ValueError in STREAM mode once a row has been flushed.
         """
-        self.worksheet.freeze_panes = coord
+        self._check_layout('freeze')
+        self._dirty.add(self.worksheet)
+        self.worksheet.freeze_panes = coord_string(coord)
 
 
     def set_column_width(self, column, w=10, auto=False):
@@ -398,162 +2738,276 @@ class XLUtil:
         @param column : column to size
         @param width : width (in ?) to set
         @param auto : auto size column True/False
+
+        Note: autosizing uses the widths tracked as values are written
+        (a column with values overwritten or merged away is measured
+        again), a sheet loaded from disk has its column scanned once. Raises
+        ValueError in STREAM mode once a row has been flushed.
         """
-        column_letter = get_column_letter(column)
+        self._check_layout('set_column_width')
+        letter = column_letter(column)
         if(auto == True):
-            max_length = 0
-            column = self.worksheet[column_letter]
-            for cell in column:
-                try: # Necessary to avoid error on empty cells
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            if(max_length > 50):
-                max_length = 50
-            adjusted_width = (max_length + 2) * 1.1
-            w = adjusted_width            
-        self.worksheet.column_dimensions[column_letter].width = w 
+            if self.mode != NORMAL:
+                self._unsupported('set_column_width(auto=True)')
+            if self.worksheet in self._measured:
+                max_length = self._measured_widths().get(column, 0)
+            else:
+                max_length = 0
+                for values in self.iter_rows(
+                        ((column, 1), (column, self._used_size()[1]))):
+                    if values[0] is not None:
+                        max_length = max(max_length, len(str(values[0])))
+            w = _auto_width(max_length)
+        self._dirty.add(self.worksheet)
+        self.worksheet.column_dimensions[letter].width = w 
+
+
+    def autosize_all(self):
+        """Autosize every column of the active sheet that has values
+
+        Uses the widths tracked as values are written (columns with
+        values overwritten or merged away are measured again), a sheet
+        loaded from disk is measured in a single pass over its rows first
+        """
+        if self.mode != NORMAL:
+            self._unsupported('autosize_all')
+        ws = self.worksheet
+        if ws in self._measured:
+            widths = self._measured_widths()
+        else:
+            widths = self._widths[ws] = {}
+            self._unmeasured.pop(ws, None)
+            self._stale.pop(ws, None)
+            width = widths.get
+            for values in self.iter_rows():
+                for col, value in enumerate(values, 1):
+                    if value is not None:
+                        length = len(value if value.__class__ is str
+                                     else str(value))
+                        if length > width(col, 0):
+                            widths[col] = length
+            self._measured.add(ws)
+        self._dirty.add(ws)
+        dimensions = ws.column_dimensions
+        for column, length in widths.items():
+            if length:
+                dimensions[column_letter(column)].width = _auto_width(length)
+
+
+    def _measured_widths(self):
+        """Return the widths of the active sheet, measuring numeric blocks
+
+        Blocks written from numeric arrays are not measured as they are
+        written, they are measured here column by column when needed.
+        Columns that had values overwritten are measured again in full,
+        as the longest value may be gone.
+        """
+        widths = self._sheet_widths()
+        width = widths.get
+        for span in self._unmeasured.pop(self.worksheet, ()):
+            column = span[0][0]
+            for col, values in enumerate(zip(*self.iter_rows(span)), column):
+                values = [value for value in values if value is not None]
+                length = max(chain((0,), map(len, map(str, values))))
+                if length > width(col, 0):
+                    widths[col] = length
+        stale = self._stale.pop(self.worksheet, ())
+        if stale:
+            rows = self._used_size()[1]
+            for col in stale:
+                values = [values[0] for values in
+                          self.iter_rows(((col, 1), (col, rows)))
+                          if values[0] is not None]
+                widths[col] = max(chain((0,), map(len, map(str, values))))
+        return widths
+
+
+    def _sheet_widths(self):
+        """Return the {column: longest value} widths of the active sheet"""
+        try:
+            return self._widths[self.worksheet]
+        except KeyError:
+            widths = self._widths[self.worksheet] = {}
+            return widths
+
+
+    def _stale_widths(self, ws):
+        """Return the columns of a sheet whose widths may be too wide"""
+        try:
+            return self._stale[ws]
+        except KeyError:
+            stale = self._stale[ws] = set()
+            return stale
+
+
+    # TABLES
+    def write_table(self, coord, tableData, tableName):
+        """Write a sortable, filterable table to the active sheet
+
+        The first row of tableData is the header. If the table already
+        exists its values are rewritten from coord and it is resized.
+
+        @param coord : top left cell, string of format "A1"
+        @param tableData : list of rows or a 2-D array, header row first
+        @param tableName : name of the table, unique in the workbook
+        """
+        column, row = parse_coord(coord)
+        rows, data_type = _block_rows(tableData)
+        if not isinstance(rows, (list, tuple)):
+            rows = list(rows)
+        if not rows or not len(rows[0]):
+            raise ValueError('A table needs a header row')
+        ws = self.worksheet
+        ext = self._table(tableName)
+        if ext is not None and ext[0] is not ws:
+            raise ValueError('Table {0} is on sheet {1}'.format(
+                tableName, ext[0].title))
+        self._write_block(column, row, rows, data_type)
+
+        from openpyxl.worksheet.filters import AutoFilter
+        from openpyxl.worksheet.table import Table, TableColumn
+        header = rows[0]
+        if ext is None:
+            table = Table(displayName=tableName)
+            ext = [ws, table, 0, 0, 0, 0]
+        table = ext[1]
+        ext[2:] = [column, row, column + len(header) - 1, row + len(rows) - 1]
+        table.tableColumns = [TableColumn(id=i, name=str(name))
+                              for i, name in enumerate(header, 1)]
+        table.autoFilter = AutoFilter()
+        self._set_table_ref(ext)
+        if tableName.lower() not in self._tables:
+            with warnings.catch_warnings():
+                # the columns are named above, also in STREAM mode
+                warnings.simplefilter('ignore')
+                ws.add_table(table)
+            self._tables[tableName.lower()] = ext
 
-'''
-UNDER CONSTRUCTION
 
-    def get_ranges(self):
-#        print(self.workbook.defined_names.localnames(self.worksheet))
-        return self.workbook.defined_names.definedName
+    def append_table_row(self, rowData, tableName):
+        """Add a row of data to the end of a table
 
-    ##########
-    # check if a given region name exists in the defined name's list
-    ##########
-    def is_table_exists(self, tableName):
-        # get the definedName's list, then get all the name properties of each definedName
-        dfns = self.get_ranges()
-        dfnNames = []
-        for dfn in dfns:
-            dfnNames.append(dfn.name)
-            logging.debug(dfn.name)
-            logging.debug(dfn.attr_text)
-        #Check if the given name exists
-        if(tableName not in dfnNames):
-            logging.debug("Table Not Found - " + tableName)
-            return False
-        else:
-            logging.debug("Table Found - " + tableName)
-            return True
-
-    ##########
-    # Make a attr_text value for a defined name from the active sheet and the starting and ending coordinates of the region
-    ##########
-    def build_attr_text(self, coords):
-        # active sheet
-        text = "$"+self.worksheet.title+"."
-        # starting Column and row
-        text += "$"+coords[0][0] +"$" + coords[0][1] + ":"
-        # ending Column and row
-        text += "$"+coords[1][0] + "$" + coords[1][1]
-        logging.debug(text)
-        return text
-
-    ##########
-    # From the defined name attr_text value
-    # Make a list of the sheet the region exists, starting column, starting row, ending column, ending row 
-    ##########
-    def debuild_attr_text(self, attr_text):
-        logging.debug(attr_text)
-        leave = attr_text[1:] # remove first $
-        findList = ['$', '$', ':', '$','$']
-        texts = []
-        for char in findList:
-            idx = leave.find(char)
-            remove = leave[:idx]
-            leave = leave[idx+1:]
-            logging.debug(char +'\t'+remove+'\t'+leave)
-            texts.append(remove)
-        texts.append(leave)
-        texts[0] = texts[0][:-1]
-        del texts[3]
-        logging.debug(texts)
-        return texts
-
-    ##########
-    # Create a sortable table and label the region by using the defined name properties
-    # if the table already exists, rewrite all values and update the size
-    ##########
-    def write_table(self, column, row, tableData, tableName):
-        # table size properties
-        numRows = len(tableData)
-        numColumns = len(tableData[0])
-        startCoord = [get_columnumn_letter(column),str(row)]
-        endCoord=[get_columnumn_letter(column+numColumns-1),
-                  str(row+numRows-1)]
-        span =startCoord[0]+startCoord[1]+':'+endCoord[0]+endCoord[1]
-        coords = [startCoord, endCoord]
-        # write the table
-        for i in range(0, numRows):
-            self.write_row(column, row+i, tableData[i])
-        # make filterable
-#        self.worksheet.auto_filter.ref = span
-
-        # Check if table exists, if not create one
-        if(self.is_table_exists(tableName) == False):
-            dfn = DefinedName(name=tableName)
-            dfn.attr_text = self.build_attr_text(coords)
-            self.workbook.defined_names.append(dfn)
+        @param rowData : list of values
+        @param tableName : name of an existing table
+        """
+        self.append_table_rows((rowData,), tableName)
+
+
+    def append_table_rows(self, rowsData, tableName):
+        """Add rows of data to the end of a table
+
+        The table is resized once for all of the rows.
+
+        @param rowsData : list of rows or a 2-D array
+        @param tableName : name of an existing table
+        """
+        ext = self._table(tableName)
+        if ext is None:
+            raise ValueError('Table {0} does not exist'.format(tableName))
+        rows, data_type = _block_rows(rowsData)
+        if not isinstance(rows, (list, tuple)):
+            rows = list(rows)
+        if not rows:
+            return
+        active, self.worksheet = self.worksheet, ext[0]
+        try:
+            self._write_block(ext[2], ext[5] + 1, rows, data_type)
+        finally:
+            self.worksheet = active
+        ext[5] += len(rows)
+        self._set_table_ref(ext)
+
+
+    def format_table(self, tableName, style=TABLE_STYLE, banded=True):
+        """Band the rows of a table and style its header
+
+        The banding is the table's style, which excel applies to the
+        rows as it draws them, so it costs the same for any number of
+        rows and follows the table as rows are appended. Only the
+        header cells are styled (bold and centered).
+
+        @param tableName : name of an existing table
+        @param style : name of one of excel's table styles
+                       ('TableStyleMedium2'...), None for no style
+        @param banded : shade every other row
+        """
+        ext = self._table(tableName)
+        if ext is None:
+            raise ValueError('Table {0} does not exist'.format(tableName))
+        table = ext[1]
+        if style is None:
+            table.tableStyleInfo = None
         else:
-            foundTable = self.workbook.defined_names[tableName]
-            foundTable.attr_text = self.build_attr_text(coords)
+            from openpyxl.worksheet.table import TableStyleInfo
+            table.tableStyleInfo = TableStyleInfo(name=style,
+                                                  showRowStripes=banded)
+        active, self.worksheet = self.worksheet, ext[0]
+        try:
+            self.style_block(((ext[2], ext[3]), (ext[4], ext[3])),
+                             font=_style_constant('FONT_BOLD'),
+                             align=_style_constant('ALIGN_CENTER'))
+        finally:
+            self.worksheet = active
+        self._dirty.add(ext[0])
 
-    ##########
-    # Add a row of data to an existing table by looking up the defined name,
-    # inserting the row at the end, then updating the region size
-    ##########
-    def append_table_row(self, rowData, tableName):
-        if(self.is_table_exists(tableName) == True):
-            foundTable = self.workbook.defined_names[tableName]
-            rawCoords=self.debuild_attr_text(foundTable.attr_text)  
-            sheet = rawCoords[0]
-            columnumn = rawCoords[1]
-            row = rawCoords[2]
-            endColumn = rawCoords[3]
-            endRow = rawCoords[4]
-            column = columnumn_index_from_string(columnumn)
-            row = int(endRow)+1
-            self.write_row(column, row, rowData)
-            startCoords = [columnumn, row]
-            endCoords = [endColumn, str(row)]
-            coords = [startCoords, endCoords]
-            foundTable.attr_text=self.build_attr_text(coords)
-
-    ##########
-    # look up the table by the defined name and format the header, then the rows
-    ##########
-    def format_table(self, tableName):
-        if(self.is_table_exists(tableName) == True):
-            foundTable = self.workbook.defined_names[tableName]
-            rawCoords=self.debuild_attr_text(foundTable.attr_text)  
-            sheet = rawCoords[0]
-            columnumn = columnumn_index_from_string(rawCoords[1])
-            row = int(rawCoords[2])
-            endColumn = columnumn_index_from_string(rawCoords[3])
-            endRow = int(rawCoords[4])
-            numColumns = endColumn - columnumn + 1
-            numRows = endRow - row + 1
-            # remove formatting
-            for i in range(0, numRows):
-                self.format_row(columnumn, row, numColumns)
-            # format header
-            self.format_row(columnumn, row, numColumns,
-                            fnt=boldFont, algn=centerAlign)
-            # format rows
-            for i in range(0, numRows-1):
-                if(i%2 == 0):
-                    fill = greyFill
-                else:
-                    fill = whiteFill
-                self.format_row(columnumn, row+1+i, numColumns,
-                                algn=centerAlign, fll=fill)
+
+    def is_table_exists(self, tableName):
+        """Return True if the workbook has a table named tableName
+
+        @param tableName : name of the table
+        """
+        return self._table(tableName) is not None
 
 
+    def get_table_span(self, tableName):
+        """Return the span of a table, header included
+
+        @param tableName : name of an existing table
+        @return span : string of format 'A1:B2'
+        """
+        ext = self._table(tableName)
+        if ext is None:
+            raise ValueError('Table {0} does not exist'.format(tableName))
+        return ext[1].ref
+
+
+    def _table(self, tableName):
+        """Return the extent of a table, None if there is no such table
+
+        The extent is [sheet, table, column, row, end column, end row].
+        Tables of a loaded workbook are indexed on the first lookup that
+        misses, which parses any sheets that haven't been loaded yet.
+        """
+        ext = self._tables.get(tableName.lower())
+        if ext is None and not self._tables_indexed:
+            self._index_tables()
+            ext = self._tables.get(tableName.lower())
+        return ext
+
+
+    def _index_tables(self):
+        """Add the tables already in the workbook to the table index"""
+        self._tables_indexed = True
+        if self.mode == READ:
+            return
+        worksheets = self.workbook.worksheets
+        if self._reader is not None:
+            self._reader.load_all()
+        for ws in worksheets:
+            for table in ws.tables.values():
+                (col1, row1), (col2, row2) = parse_span(table.ref)
+                self._tables.setdefault(table.name.lower(),
+                                        [ws, table, col1, row1, col2, row2])
+
+
+    def _set_table_ref(self, ext):
+        """Set a table's ref (and its filter's) from its extent"""
+        table = ext[1]
+        table.ref = span_string(((ext[2], ext[3]), (ext[4], ext[5])))
+        if table.autoFilter is not None:
+            table.autoFilter.ref = table.ref
+
+'''
 TODO
 
 """Charts"""